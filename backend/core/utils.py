@@ -1,6 +1,7 @@
 # backend/core/utils.py
 
-from typing import Any, Dict, List, Tuple, Union
+from copy import deepcopy
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
 from pathlib import Path
 
 def _navigate_to_sub_path(
@@ -62,66 +63,108 @@ def unwrap_dot_accessible_dicts(data: Any) -> Any:
     """
     递归地将 DotAccessibleDict 实例转换回普通的 Python 字典。
     这对于将包含这些对象的数据结构序列化为 JSON 至关重要。
+    只进入 dict/list/tuple（其余值都是叶子），并且只复制通往代理对象的那条路径；
+    不含代理的子树原样共享，不再整树复制。
+    写时复制容器（CopyOnWriteDict/CopyOnWriteList）被还原为普通容器：未改变的部分直接复用原始数据，
+    因此结果与原始数据结构共享，而不是一份完整副本。
     """
-    if isinstance(data, DotAccessibleDict):
-        # 基础情况：解包 DotAccessibleDict 并对其内容进行递归调用
-        return unwrap_dot_accessible_dicts(data._data)
-    elif isinstance(data, dict):
-        # 递归情况：遍历字典的值
-        return {key: unwrap_dot_accessible_dicts(value) for key, value in data.items()}
-    elif isinstance(data, list):
-        # 递归情况：遍历列表的项
-        return [unwrap_dot_accessible_dicts(item) for item in data]
-    else:
-        # 基本类型：直接返回
-        return data
+    unwrapped = _unwrap(data)
+    return data if unwrapped is _UNCHANGED else unwrapped
+
+
+# _unwrap 的返回值：表示对象内部没有代理，调用方可以直接共享原对象
+_UNCHANGED = object()
+# 不可能容纳代理的常见值类型，遍历时直接跳过
+_LEAF_TYPES = frozenset((str, int, float, bool, type(None)))
+
+
+def _unwrap(data: Any) -> Any:
+    # 先按精确类型判断，isinstance 只作为子类的兜底
+    data_type = type(data)
+    if data_type is CopyOnWriteDict:
+        return _materialize_dict(data)
+    if data_type is CopyOnWriteList:
+        return _materialize_list(data)
+    if data_type is dict or isinstance(data, dict):
+        copied = None
+        for key, value in data.items():
+            if type(value) in _LEAF_TYPES:
+                continue
+            unwrapped = _unwrap(value)
+            if unwrapped is not _UNCHANGED:
+                if copied is None:
+                    copied = dict(data)
+                copied[key] = unwrapped
+        return _UNCHANGED if copied is None else copied
+    if data_type is list or data_type is tuple or isinstance(data, (list, tuple)):
+        copied = None
+        for index, item in enumerate(data):
+            if type(item) in _LEAF_TYPES:
+                continue
+            unwrapped = _unwrap(item)
+            if unwrapped is not _UNCHANGED:
+                if copied is None:
+                    copied = list(data)
+                copied[index] = unwrapped
+        if copied is None:
+            return _UNCHANGED
+        return copied if isinstance(data, list) else type(data)(copied)
+    if data_type is DotAccessibleDict or isinstance(data, DotAccessibleDict):
+        inner = _data_of(data)
+        unwrapped = _unwrap(inner)
+        return inner if unwrapped is _UNCHANGED else unwrapped
+    # 基本类型：直接返回
+    return _UNCHANGED
 
 class DotAccessibleDict:
     """
     一个递归代理类，它包装一个字典，允许通过点符号进行属性访问。
     此版本确保对嵌套的可变对象（如列表）的修改能够正确地作用于原始数据。
+    子字典的代理会被缓存复用，`moment.a.b.c` 不再每次访问都创建新的代理；
+    缓存按对象身份校验，底层字典中的值被替换后会自动重新包装。
     """
+    __slots__ = ('_data', '_children')
+
     def __init__(self, data: Dict[str, Any]):
         # 使用 object.__setattr__ 来避免触发我们自己的 __setattr__
         object.__setattr__(self, '_data', data)
-
-    @staticmethod
-    def _wrap_if_dict(value: Any) -> Any:
-        """
-        一个静态辅助方法，仅当值为字典时才进行包装。
-        """
-        if isinstance(value, dict):
-            # 避免对已经是代理的对象进行重复包装
-            if isinstance(value, DotAccessibleDict):
-                return value
-            return DotAccessibleDict(value)
-        return value
+        object.__setattr__(self, '_children', None)
 
     def __contains__(self, key: str) -> bool:
-        return key in self._data
+        return key in _data_of(self)
 
-    def __getattr__(self, name: str) -> Any:
-        if name.startswith('__'):
-            raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
-            
+    def __getattribute__(self, name: str) -> Any:
+        # 宏里的每一次 `moment.x` 都会经过这里，因此不走 __getattr__：
+        # 那样每次访问都要先让常规属性查找失败并抛出一次 AttributeError。
+        # 下划线开头的名称优先按对象自身的属性（槽位、特殊属性）查找
+        if name[:1] == '_':
+            try:
+                return object.__getattribute__(self, name)
+            except AttributeError:
+                # 槽位尚未赋值时（如 copy/pickle 重建对象的过程中）不能再去读取 _data
+                if name.startswith('__') or name in DotAccessibleDict.__slots__:
+                    raise
+        data = _data_of(self)
         try:
-            value = self._data[name]
-            # 仅当值是字典时才递归包装。
-            # 对于列表、字符串、数字等，直接返回原始对象引用。
-            return self._wrap_if_dict(value)
+            value = data[name]
         except KeyError:
             # 允许调用底层字典的方法，如 .keys(), .items()
-            underlying_attr = getattr(self._data, name, None)
+            underlying_attr = getattr(data, name, None)
             if callable(underlying_attr):
                 return underlying_attr
             raise AttributeError(f"'{type(self).__name__}' object has no attribute or method '{name}'")
+        # 仅当值是字典时才递归包装。
+        # 对于列表、字符串、数字等，直接返回原始对象引用。
+        return _child_proxy(self, name, value) if isinstance(value, dict) else value
 
     def __setattr__(self, name: str, value: Any):
-        if name == '_data':
+        if name in DotAccessibleDict.__slots__:
             object.__setattr__(self, name, value)
+            if name == '_data':
+                object.__setattr__(self, '_children', None)
         else:
-            # 直接在底层字典上设置值
-            self._data[name] = value
+            # 直接在底层字典上设置值；代理对象以其底层字典存入，避免把代理写进状态
+            self._data[name] = value._data if isinstance(value, DotAccessibleDict) else value
 
     def __delattr__(self, name: str):
         try:
@@ -130,12 +173,246 @@ class DotAccessibleDict:
             raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
 
     def __repr__(self) -> str:
-        return f"DotAccessibleDict({self._data})"
+        return f"DotAccessibleDict({_data_of(self)})"
     
     def __getitem__(self, key):
-        value = self._data[key]
         # 确保通过方括号访问也能正确工作
-        return self._wrap_if_dict(value)
+        value = _data_of(self)[key]
+        return _child_proxy(self, key, value) if isinstance(value, dict) else value
     
     def __setitem__(self, key, value):
-        self._data[key] = value
\ No newline at end of file
+        self._data[key] = value._data if isinstance(value, DotAccessibleDict) else value
+
+
+# 直接读取槽位的描述符，省去属性查找
+_data_of = DotAccessibleDict._data.__get__
+_children_of = DotAccessibleDict._children.__get__
+
+
+def _child_proxy(parent: DotAccessibleDict, key: Any, value: Dict[str, Any]) -> DotAccessibleDict:
+    """为子字典返回代理，复用之前为同一个字典对象创建的那一个。"""
+    children = _children_of(parent)
+    if children is None:
+        children = {}
+        object.__setattr__(parent, '_children', children)
+    else:
+        cached = children.get(key)
+        if cached is not None and _data_of(cached) is value:
+            return cached
+    proxy = children[key] = DotAccessibleDict(value)
+    return proxy
+
+
+# --- 写时复制的执行状态 ---
+
+_MISSING = object()
+
+
+def _own(value: Any) -> Any:
+    """
+    为一个属于原始数据的非叶子值取得可写的副本：dict/list 包装为写时复制容器，
+    其他对象（例如 moment 中 pickle 保存的自定义类实例）可能被原地修改，只能深拷贝。
+    """
+    value_type = type(value)
+    if value_type is dict:
+        return CopyOnWriteDict(value)
+    if value_type is list:
+        return CopyOnWriteList(value)
+    return deepcopy(value)
+
+
+class CopyOnWriteDict(dict):
+    """
+    包装一个不可修改的原始字典（例如快照中的 moment），供一次执行原地读写。
+    创建时只复制顶层；子容器在第一次被取出时才复制一层并替换进来（见 _own），原始数据永远不会被修改。
+    因此一次执行的开销取决于它触及的路径，而不是状态的总大小。
+    unwrap_dot_accessible_dicts 会把它还原为普通字典，并让未改变的子树与原始数据共享。
+    所有把子容器交给调用方的入口（下标、get、setdefault、pop、items、values、迭代拷贝等）都先复制再返回。
+    """
+    __slots__ = ('_base',)
+
+    def __init__(self, base: Dict[str, Any]):
+        super().__init__(base)
+        self._base = base
+
+    def __getitem__(self, key):
+        value = dict.__getitem__(self, key)
+        if type(value) not in _LEAF_TYPES and value is self._base.get(key, _MISSING):
+            value = _own(value)
+            dict.__setitem__(self, key, value)
+        return value
+
+    def __iter__(self) -> Iterator:
+        # 覆盖 __iter__ 会让 dict(x)、{**x}、update(x) 改用 keys() + __getitem__，而不是直接复制内部存储
+        return dict.__iter__(self)
+
+    def _own_all(self):
+        base = self._base
+        for key, value in dict.items(self):
+            if type(value) not in _LEAF_TYPES and value is base.get(key, _MISSING):
+                dict.__setitem__(self, key, _own(value))
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def setdefault(self, key, default=None):
+        if key in self:
+            return self[key]
+        dict.__setitem__(self, key, default)
+        return default
+
+    def pop(self, key, *default):
+        if key in self:
+            value = self[key]
+            dict.__delitem__(self, key)
+            return value
+        return dict.pop(self, key, *default)
+
+    def popitem(self):
+        key, value = dict.popitem(self)
+        if type(value) not in _LEAF_TYPES and value is self._base.get(key, _MISSING):
+            value = _own(value)
+        return key, value
+
+    def items(self):
+        self._own_all()
+        return dict.items(self)
+
+    def values(self):
+        self._own_all()
+        return dict.values(self)
+
+    def copy(self) -> Dict[str, Any]:
+        return dict(self)
+
+    def __copy__(self) -> Dict[str, Any]:
+        return dict(self)
+
+    def __deepcopy__(self, memo: Dict[int, Any]) -> Dict[str, Any]:
+        return deepcopy(unwrap_dot_accessible_dicts(self), memo)
+
+    def __reduce_ex__(self, protocol):
+        # 序列化（pickle）时传递普通字典
+        return (dict, (unwrap_dot_accessible_dicts(self),))
+
+
+class CopyOnWriteList(list):
+    """CopyOnWriteDict 的列表版本：非叶子元素在第一次被取出时才复制。"""
+    __slots__ = ('_base', '_base_ids')
+
+    def __init__(self, base: List[Any]):
+        super().__init__(base)
+        self._base = base
+        # 原始列表中非叶子元素的 id；列表会被插入、删除和排序，只能按身份而不是位置识别原始元素
+        self._base_ids: Optional[frozenset] = None
+
+    def _owned(self, index: int, value: Any) -> Any:
+        if type(value) in _LEAF_TYPES:
+            return value
+        base_ids = self._base_ids
+        if base_ids is None:
+            # 原始列表由 _base 持有，其中元素的 id 在本对象存活期间保持有效
+            base_ids = self._base_ids = frozenset(id(item) for item in self._base if type(item) not in _LEAF_TYPES)
+        if id(value) in base_ids:
+            value = _own(value)
+            list.__setitem__(self, index, value)
+        return value
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return self._owned(index, list.__getitem__(self, index))
+
+    def __iter__(self) -> Iterator:
+        index = 0
+        while index < len(self):
+            yield self._owned(index, list.__getitem__(self, index))
+            index += 1
+
+    def __reversed__(self) -> Iterator:
+        for index in range(len(self) - 1, -1, -1):
+            if index < len(self):
+                yield self[index]
+
+    def _own_all(self):
+        for index in range(len(self)):
+            self._owned(index, list.__getitem__(self, index))
+
+    def pop(self, index: int = -1):
+        value = self[index]
+        list.__delitem__(self, index)
+        return value
+
+    def copy(self) -> List[Any]:
+        return list(self)
+
+    def __add__(self, other) -> List[Any]:
+        return list(self) + other
+
+    def __radd__(self, other) -> List[Any]:
+        # `[] + cow`、`sum([...], [])`：子类的反射方法优先于 list.__add__，否则会直接复制出未复制的原始元素
+        return other + list(self)
+
+    def __mul__(self, count: int) -> List[Any]:
+        return list(self) * count
+
+    def __copy__(self) -> List[Any]:
+        return list(self)
+
+    def __deepcopy__(self, memo: Dict[int, Any]) -> List[Any]:
+        return deepcopy(unwrap_dot_accessible_dicts(self), memo)
+
+    def __reduce_ex__(self, protocol):
+        return (list, (unwrap_dot_accessible_dicts(self),))
+
+
+def get_original_if_unchanged(state: Dict[str, Any], key: str) -> Tuple[Any, bool]:
+    """
+    读取 state[key]，不触发写时复制。state 是 CopyOnWriteDict 且这个值在本次执行中没有被修改时，
+    返回原始数据中的那个对象和 True：原始数据永远不会被修改，调用方可以按对象身份缓存由它派生的结果。
+    否则返回当前值（写时复制容器已还原为普通容器）和 False。键不存在时值为 None。
+    """
+    if type(state) is not CopyOnWriteDict:
+        return state.get(key), False
+    original = state._base.get(key)
+    current = dict.get(state, key)
+    if current is not original:
+        # 被取出过但内容未变的写时复制容器还原后就是原始对象；只遍历被取出过的路径
+        current = unwrap_dot_accessible_dicts(current)
+    return current, current is original
+
+
+def _materialize_dict(cow: CopyOnWriteDict) -> Dict[str, Any]:
+    """把写时复制字典还原为普通字典；内容与原始字典相同（按身份）时直接返回原始字典。"""
+    base = cow._base
+    changed = dict.__len__(cow) != len(base)
+    result = {}
+    for key, value in dict.items(cow):
+        original = base.get(key, _MISSING)
+        if value is not original:
+            unwrapped = _unwrap(value)
+            if unwrapped is not _UNCHANGED:
+                value = unwrapped
+            changed = changed or value is not original
+        result[key] = value
+    return result if changed else base
+
+
+def _materialize_list(cow: CopyOnWriteList) -> List[Any]:
+    base = cow._base
+    changed = list.__len__(cow) != len(base)
+    result = []
+    base_length = len(base)
+    base_ids = cow._base_ids
+    for index, value in enumerate(list.__iter__(cow)):
+        if index < base_length and value is base[index]:
+            result.append(value)
+            continue
+        # 原始元素（可能因插入、排序而换了位置）不含代理，无需再遍历
+        if type(value) not in _LEAF_TYPES and (base_ids is None or id(value) not in base_ids):
+            unwrapped = _unwrap(value)
+            if unwrapped is not _UNCHANGED:
+                value = unwrapped
+        changed = changed or index >= base_length or value is not base[index]
+        result.append(value)
+    return result if changed else base
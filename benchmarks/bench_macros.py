@@ -0,0 +1,114 @@
+# benchmarks/bench_macros.py
+"""
+测量一个典型节点配置的宏求值（evaluate_data）耗时。
+
+用法:
+    python -m benchmarks.bench_macros
+    python -m benchmarks.bench_macros --iterations 2000 --repeat 5
+
+对比四种情况：
+- lookup:    纯读取宏走快速路径（在事件循环上直接解析路径，不加锁、不经过线程池）；
+- exec:      语义相同但写成语句形式的宏，强制走 exec 路径（inline 执行方式：廉价宏在事件循环上执行）；
+- exec-pool: exec 路径，thread 执行方式，每个宏都经过专用线程池往返；
+- no-cache:  exec-pool 且关闭已编译宏缓存，即每次都重新 parse/compile。
+
+另外单独测量：
+- template-40:  一个含 40 个占位符的长提示词模板的渲染耗时；
+- static-blob:  一个以静态内容为主的大配置（200 条消息、一个知识库对象），其中只有一个宏。
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from typing import Any, Dict, List
+
+from backend.core.utils import DotAccessibleDict
+from plugins.core_engine.evaluation import evaluate_data, macro_code_cache, macro_executor, template_plan_cache
+
+READ_MACROS = [
+    "nodes.llm.output",
+    "moment.player.hp",
+    "run.triggering_input.user_message",
+    "moment.player['inventory'][0]",
+    "lore.world.name",
+]
+
+
+def node_config(force_exec: bool) -> Dict[str, Any]:
+    def macro(code: str) -> str:
+        return "{{ _v = " + code + "\n_v }}" if force_exec else "{{ " + code + " }}"
+    return {
+        "prompt": f"Player {macro(READ_MACROS[1])} says: {macro(READ_MACROS[2])}",
+        "history": macro(READ_MACROS[0]),
+        "item": macro(READ_MACROS[3]),
+        "world": macro(READ_MACROS[4]),
+        "static": {"temperature": 0.7, "stop": ["\n"]},
+    }
+
+
+def long_template_config() -> Dict[str, Any]:
+    lines = [f"Line {i}: {{{{ {READ_MACROS[i % len(READ_MACROS)]} }}}}" for i in range(40)]
+    return {"prompt": "\n".join(lines)}
+
+
+def static_blob_config() -> Dict[str, Any]:
+    return {
+        "messages": [{"role": "user" if i % 2 else "assistant", "content": f"message {i}"} for i in range(200)],
+        "lore": {"entries": [{"key": f"k{i}", "tags": ["a", "b"], "text": "static text"} for i in range(100)]},
+        "question": "{{ run.triggering_input.user_message }}",
+    }
+
+
+def eval_context() -> Dict[str, Any]:
+    return {
+        "nodes": DotAccessibleDict({"llm": {"output": "previous reply"}}),
+        "moment": DotAccessibleDict({"player": {"hp": 42, "inventory": ["sword", "shield"]}}),
+        "run": DotAccessibleDict({"triggering_input": {"user_message": "hello"}}),
+        "lore": DotAccessibleDict({"world": {"name": "Hevno"}}),
+    }
+
+
+async def time_config(config: Dict[str, Any], iterations: int, repeat: int) -> List[float]:
+    context = eval_context()
+    lock = asyncio.Lock()
+    await evaluate_data(config, context, lock)  # 预热
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            await evaluate_data(config, context, lock)
+        timings.append((time.perf_counter() - start) / iterations)
+    return timings
+
+
+async def main(args: argparse.Namespace):
+    print(f"iterations={args.iterations} repeat={args.repeat}")
+    print(f"{'mode':<12}{'median us/config':>18}{'min us/config':>16}")
+    cases = [
+        ("lookup", False, "inline", True), ("exec", True, "inline", True),
+        ("exec-pool", True, "thread", True), ("no-cache", True, "thread", False),
+    ]
+    for label, force_exec, execution_mode, cache_enabled in cases:
+        macro_executor.configure(mode=execution_mode)
+        if not cache_enabled:
+            macro_code_cache.configure(max_entries=0, max_bytes=0)
+            template_plan_cache.configure(max_entries=0, max_bytes=0)
+        timings = await time_config(node_config(force_exec), args.iterations, args.repeat)
+        print(f"{label:<12}{statistics.median(timings) * 1e6:>18.1f}{min(timings) * 1e6:>16.1f}")
+
+    macro_executor.configure(mode="inline")
+    macro_code_cache.configure(max_entries=4096, max_bytes=8 * 1024 * 1024)
+    template_plan_cache.configure(max_entries=4096, max_bytes=8 * 1024 * 1024)
+    timings = await time_config(long_template_config(), args.iterations, args.repeat)
+    print(f"{'template-40':<12}{statistics.median(timings) * 1e6:>18.1f}{min(timings) * 1e6:>16.1f}")
+    timings = await time_config(static_blob_config(), args.iterations, args.repeat)
+    print(f"{'static-blob':<12}{statistics.median(timings) * 1e6:>18.1f}{min(timings) * 1e6:>16.1f}")
+    macro_executor.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=3)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,144 @@
+# benchmarks/bench_scheduler.py
+"""
+比较图内节点调度器（event / worker_pool）在宽图、深图和菱形图上的吞吐。
+
+用法:
+    python -m benchmarks.bench_scheduler
+    python -m benchmarks.bench_scheduler --width 2000 --depth 500 --delay 0.001 --repeat 5
+
+节点使用一个不做任何事的运行时（可选地 sleep 一段时间来模拟 I/O），
+因此测出的时间几乎完全是调度与节点执行框架本身的开销。
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from typing import Any, Callable, Dict, List
+from uuid import uuid4
+
+from pydantic import BaseModel
+
+from backend.container import Container
+from backend.core.hooks import HookManager
+from plugins.core_engine.contracts import GraphDefinition, RuntimeInterface, Sandbox, StateSnapshot
+from plugins.core_engine.engine import ExecutionEngine
+from plugins.core_engine.registry import RuntimeRegistry
+from plugins.core_engine.scheduling import SCHEDULERS
+from plugins.core_engine.state import create_main_execution_context
+
+
+class NoopRuntime(RuntimeInterface):
+    @classmethod
+    def get_config_model(cls):
+        class NoopConfig(BaseModel):
+            delay: float = 0.0
+        return NoopConfig
+
+    async def execute(self, config: Dict[str, Any], context, **kwargs) -> Dict[str, Any]:
+        delay = config.get("delay", 0.0)
+        if delay:
+            await asyncio.sleep(delay)
+        return {"output": None}
+
+
+def _node(node_id: str, depends_on: List[str], delay: float) -> Dict[str, Any]:
+    return {"id": node_id, "depends_on": depends_on, "run": [{"runtime": "bench.noop", "config": {"delay": delay}}]}
+
+
+def wide_graph(width: int, delay: float) -> GraphDefinition:
+    """一个根节点扇出到 width 个叶子，再汇合到一个终点。"""
+    leaves = [_node(f"leaf_{i}", ["root"], delay) for i in range(width)]
+    return GraphDefinition.model_validate({"nodes": [
+        _node("root", [], delay), *leaves, _node("sink", [n["id"] for n in leaves], delay)
+    ]})
+
+
+def deep_graph(depth: int, delay: float) -> GraphDefinition:
+    """一条长度为 depth 的链。"""
+    return GraphDefinition.model_validate({"nodes": [
+        _node(f"n_{i}", [f"n_{i - 1}"] if i else [], delay) for i in range(depth)
+    ]})
+
+
+def layered_graph(layers: int, width: int, delay: float) -> GraphDefinition:
+    """layers 层、每层 width 个节点，每个节点依赖上一层的全部节点。"""
+    nodes = []
+    for layer in range(layers):
+        deps = [f"l{layer - 1}_{j}" for j in range(width)] if layer else []
+        nodes.extend(_node(f"l{layer}_{i}", deps, delay) for i in range(width))
+    return GraphDefinition.model_validate({"nodes": nodes})
+
+
+def skewed_graph(cheap: int, chain: int, parallelism: int, delay: float) -> GraphDefinition:
+    """
+    cheap 个廉价的独立节点加一条由 chain 个慢节点（10 倍耗时）组成的链，
+    声明顺序把廉价节点放在前面，且并行度受限，模拟“长 LLM 链被格式化节点挡住”的情况。
+    """
+    nodes = [_node(f"cheap_{i}", [], delay) for i in range(cheap)]
+    nodes += [_node(f"chain_{i}", [f"chain_{i - 1}"] if i else [], delay * 10) for i in range(chain)]
+    return GraphDefinition.model_validate({"metadata": {"max_parallelism": parallelism}, "nodes": nodes})
+
+
+def build_engine(scheduler: str, prioritize_critical_path: bool = True) -> ExecutionEngine:
+    container = Container()
+    hook_manager = HookManager(container)
+    registry = RuntimeRegistry()
+    registry.register("bench.noop", NoopRuntime)
+    return ExecutionEngine(
+        registry=registry, container=container, hook_manager=hook_manager,
+        scheduler=scheduler, prioritize_critical_path=prioritize_critical_path
+    )
+
+
+async def time_graph(engine: ExecutionEngine, graph_def: GraphDefinition, repeat: int) -> List[float]:
+    sandbox = Sandbox(name="bench", definition={})
+    snapshot = StateSnapshot(sandbox_id=sandbox.id)
+    # 预热：编译并缓存执行计划，使计时只包含调度与执行
+    await engine.plan_cache.get_plan(graph_def)
+
+    timings = []
+    for _ in range(repeat):
+        context = create_main_execution_context(snapshot, sandbox, engine.container, engine.hook_manager)
+        start = time.perf_counter()
+        results = await engine._internal_execute_graph(graph_def, context)
+        timings.append(time.perf_counter() - start)
+        assert len(results) == len(graph_def.nodes), "benchmark graph did not run to completion"
+    return timings
+
+
+async def main(args: argparse.Namespace):
+    cases: Dict[str, Callable[[], GraphDefinition]] = {
+        f"wide({args.width})": lambda: wide_graph(args.width, args.delay),
+        f"deep({args.depth})": lambda: deep_graph(args.depth, args.delay),
+        f"layered({args.layers}x{args.layer_width})": lambda: layered_graph(args.layers, args.layer_width, args.delay),
+    }
+    print(f"delay={args.delay}s repeat={args.repeat}")
+    print(f"{'graph':<22}{'scheduler':<14}{'median ms':>12}{'min ms':>12}")
+    for case_name, factory in cases.items():
+        graph_def = factory()
+        for scheduler in SCHEDULERS:
+            timings = await time_graph(build_engine(scheduler), graph_def, args.repeat)
+            print(f"{case_name:<22}{scheduler:<14}{statistics.median(timings) * 1000:>12.2f}{min(timings) * 1000:>12.2f}")
+
+    # 关键路径优先级只在并行度饱和时起作用；这里需要非零耗时才能体现差异
+    skew_delay = args.delay or 0.001
+    graph_def = skewed_graph(cheap=40, chain=10, parallelism=4, delay=skew_delay)
+    print(f"\nskewed(40 cheap + 10x{skew_delay * 10}s chain, max_parallelism=4)")
+    print(f"{'ordering':<22}{'scheduler':<14}{'median ms':>12}{'min ms':>12}")
+    for prioritize in (False, True):
+        for scheduler in SCHEDULERS:
+            timings = await time_graph(build_engine(scheduler, prioritize), graph_def, args.repeat)
+            label = "critical-path" if prioritize else "fifo"
+            print(f"{label:<22}{scheduler:<14}{statistics.median(timings) * 1000:>12.2f}{min(timings) * 1000:>12.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--width", type=int, default=1000)
+    parser.add_argument("--depth", type=int, default=300)
+    parser.add_argument("--layers", type=int, default=20)
+    parser.add_argument("--layer-width", type=int, default=50)
+    parser.add_argument("--delay", type=float, default=0.0, help="每个节点模拟的 I/O 耗时（秒）")
+    parser.add_argument("--repeat", type=int, default=3)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,79 @@
+# benchmarks/bench_snapshots.py
+"""
+测量快照存储在长会话中的磁盘占用、保存耗时和重新加载耗时。
+
+用法:
+    python -m benchmarks.bench_snapshots
+    python -m benchmarks.bench_snapshots --turns 2000 --keyframe-interval 16
+
+模拟一个不断增长的 memoria 流：每一步追加一条记忆并修改少量状态，
+分别以全量格式（keyframe_interval=1）、增量格式，以及增量格式加内容寻址的块存储保存同一段历史，
+然后模拟重启后重新加载。
+"""
+
+import argparse
+import asyncio
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from uuid import uuid4
+
+from plugins.core_engine.contracts import StateSnapshot
+from plugins.core_persistence.chunks import ChunkedPersistenceService
+from plugins.core_persistence.service import PersistenceService
+from plugins.core_persistence.stores import PersistentSnapshotStore
+
+
+def directory_size(path: Path) -> int:
+    return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+
+
+async def run_case(label: str, turns: int, keyframe_interval: int, chunked: bool = False):
+    assets_dir = Path(tempfile.mkdtemp(prefix="hevno-bench-"))
+    try:
+        service_cls = ChunkedPersistenceService if chunked else PersistenceService
+        service = service_cls(assets_base_dir=str(assets_dir))
+        store = PersistentSnapshotStore(service, keyframe_interval=keyframe_interval)
+        sandbox_id = uuid4()
+        moment = {"memoria": {"stream": []}, "player": {"hp": 100}, "world": {"desc": "x" * 2000}}
+        parent = None
+
+        start = time.perf_counter()
+        for turn in range(turns):
+            # 与引擎产出的新 moment 一样，未修改的部分与上一个快照共享
+            moment = {
+                **moment,
+                "memoria": {"stream": moment["memoria"]["stream"] + [{"id": turn, "content": f"turn {turn} happened"}]},
+                "player": {"hp": 100 - turn % 10},
+            }
+            snapshot = StateSnapshot(sandbox_id=sandbox_id, moment=moment, parent_snapshot_id=parent)
+            await store.save(snapshot)
+            parent = snapshot.id
+        save_s = time.perf_counter() - start
+
+        reloaded = PersistentSnapshotStore(service, keyframe_interval=keyframe_interval)
+        start = time.perf_counter()
+        snapshots = await reloaded.find_by_sandbox(sandbox_id)
+        load_s = time.perf_counter() - start
+        assert snapshots[-1].moment == moment
+
+        size_mb = directory_size(assets_dir) / 1024 / 1024
+        print(f"{label:<10}{size_mb:>12.1f}{save_s * 1000 / turns:>16.2f}{load_s:>12.2f}")
+    finally:
+        shutil.rmtree(assets_dir, ignore_errors=True)
+
+
+async def main(args: argparse.Namespace):
+    print(f"turns={args.turns}")
+    print(f"{'format':<10}{'disk MB':>12}{'save ms/step':>16}{'load s':>12}")
+    await run_case("full", args.turns, keyframe_interval=1)
+    await run_case("delta", args.turns, keyframe_interval=args.keyframe_interval)
+    await run_case("chunks", args.turns, keyframe_interval=args.keyframe_interval, chunked=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=500)
+    parser.add_argument("--keyframe-interval", type=int, default=16)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,104 @@
+# benchmarks/bench_state_access.py
+"""
+测量宏作用域代理（DotAccessibleDict）的属性访问和快照创建时的解包（unwrap_dot_accessible_dicts）耗时。
+
+用法:
+    python -m benchmarks.bench_state_access
+    python -m benchmarks.bench_state_access --turns 5000 --iterations 50000 --repeat 5
+
+测试数据是一个接近真实长会话的 moment：
+一条含 --turns 条记录的 memoria 流、若干角色状态、一份较大的世界设定，以及少量宏写入的代理对象。
+
+分别测量：
+- deep-get:       `moment.player.stats.hp` 这样的三层属性访问；
+- wide-get:       依次读取 20 个角色的属性；
+- unwrap-clean:   对不含代理的 moment 解包（快照创建时最常见的情况）；
+- unwrap-dirty:   moment 中有少量宏写入的代理对象时解包；
+- step-deepcopy:  旧的做法：深拷贝整个 moment，修改一个值，再解包出新快照的 moment；
+- step-cow:       写时复制：包装 moment，修改同一个值，再还原出与原数据共享结构的新 moment。
+"""
+
+import argparse
+import copy
+import statistics
+import time
+from typing import Any, Callable, Dict, List
+
+from backend.core.utils import CopyOnWriteDict, DotAccessibleDict, unwrap_dot_accessible_dicts
+
+
+def build_moment(turns: int) -> Dict[str, Any]:
+    return {
+        "player": {"name": "Ann", "stats": {"hp": 42, "mp": 7}, "inventory": ["sword", "shield"] * 10},
+        "characters": {
+            f"npc_{i}": {"name": f"NPC {i}", "mood": "calm", "stats": {"hp": i, "trust": i % 5}}
+            for i in range(20)
+        },
+        "memoria": {
+            "stream": [
+                {"id": i, "level": "event", "content": f"turn {i}: something happened in the tavern", "tags": ["t"]}
+                for i in range(turns)
+            ],
+        },
+        "world": {"regions": {f"r{i}": {"desc": "x" * 200, "links": [f"r{i + 1}"]} for i in range(200)}},
+    }
+
+
+def time_it(fn: Callable[[], Any], iterations: int, repeat: int) -> List[float]:
+    fn()  # 预热
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            fn()
+        timings.append((time.perf_counter() - start) / iterations)
+    return timings
+
+
+def main(args: argparse.Namespace):
+    clean = build_moment(args.turns)
+    dirty = build_moment(args.turns)
+    moment = DotAccessibleDict(dirty)
+    # 模拟宏把代理对象放进状态：经由列表方法写入时不会被自动解包
+    for i in range(5):
+        moment.player.inventory.append(moment.characters[f"npc_{i}"].stats)
+
+    proxy = DotAccessibleDict(clean)
+    names = [f"npc_{i}" for i in range(20)]
+
+    def deep_get():
+        return proxy.player.stats.hp
+
+    def wide_get():
+        characters = proxy.characters
+        return [characters[name].stats.hp for name in names]
+
+    def step(state: Dict[str, Any]) -> Dict[str, Any]:
+        # 一个典型的步骤只触及少量状态：扣血并追加一条记忆
+        moment_proxy = DotAccessibleDict(state)
+        moment_proxy.player.stats.hp -= 1
+        moment_proxy.memoria.stream.append({"id": -1, "level": "event", "content": "new", "tags": []})
+        return unwrap_dot_accessible_dicts(state)
+
+    unwrap_iterations = max(args.iterations // 1000, 10)
+    cases = [
+        ("deep-get", deep_get, args.iterations),
+        ("wide-get", wide_get, args.iterations // 20),
+        ("unwrap-clean", lambda: unwrap_dot_accessible_dicts(clean), unwrap_iterations),
+        ("unwrap-dirty", lambda: unwrap_dot_accessible_dicts(moment), unwrap_iterations),
+        ("step-deepcopy", lambda: step(copy.deepcopy(clean)), unwrap_iterations),
+        ("step-cow", lambda: step(CopyOnWriteDict(clean)), unwrap_iterations),
+    ]
+    print(f"turns={args.turns} iterations={args.iterations} repeat={args.repeat}")
+    print(f"{'case':<14}{'median us/op':>14}{'min us/op':>12}")
+    for label, fn, iterations in cases:
+        timings = time_it(fn, iterations, args.repeat)
+        print(f"{label:<14}{statistics.median(timings) * 1e6:>14.2f}{min(timings) * 1e6:>12.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=2000)
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=3)
+    main(parser.parse_args())
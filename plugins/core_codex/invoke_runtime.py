@@ -12,7 +12,8 @@ from backend.core.utils import DotAccessibleDict
 from plugins.core_engine.contracts import (
     RuntimeInterface, 
     ExecutionContext,
-    MacroEvaluationServiceInterface
+    MacroEvaluationServiceInterface,
+    macro_origin
 )
 from .models import CodexCollection, ActivatedEntry, TriggerMode, Codex
 
@@ -49,6 +50,8 @@ class InvokeRuntime(RuntimeInterface):
     """
     codex.invoke: 从 Lore 和 Moment 中收集、合并、渲染知识条目，生成最终文本。
     """
+    # 知识条目的渲染以宏求值为主
+    concurrency_class = "macro"
     class FromSource(BaseModel):
         codex: str = Field(..., description="要扫描的知识库的名称。")
         source: Optional[str] = Field(
@@ -75,6 +78,11 @@ class InvokeRuntime(RuntimeInterface):
     def get_config_model(cls) -> Type[BaseModel]:
         return cls.ConfigModel
 
+    @classmethod
+    def get_dependency_config(cls) -> Dict[str, Any]:
+        # 知识库从 lore/moment 中隐式读取；条目内嵌宏所读取的路径由记忆化分析递归纳入
+        return {"state_reads": ["lore.codices", "moment.codices"]}
+
     async def execute(
         self,
         config: Dict[str, Any],
@@ -87,7 +95,7 @@ class InvokeRuntime(RuntimeInterface):
             return {"error": f"Invalid configuration for codex.invoke: {e}"}
 
         macro_service: MacroEvaluationServiceInterface = context.shared.services.macro_evaluation_service
-        lock = context.shared.global_write_lock
+        lock = context.shared.macro_locks
         
         lore_codices = context.shared.lore_state.get("codices", {})
         moment_codices = context.shared.moment_state.get("codices", {})
@@ -113,11 +121,12 @@ class InvokeRuntime(RuntimeInterface):
             source_text = await macro_service.evaluate(source_config.source, structural_eval_context, lock) if source_config.source else ""
             
             for entry in codex_model.entries:
-                is_enabled = await macro_service.evaluate(entry.is_enabled, structural_eval_context, lock)
-                if not is_enabled: continue
-                
-                keywords = await macro_service.evaluate(entry.keywords, structural_eval_context, lock)
-                priority = await macro_service.evaluate(entry.priority, structural_eval_context, lock)
+                with macro_origin(f"codex:{codex_name}/{entry.id}"):
+                    is_enabled = await macro_service.evaluate(entry.is_enabled, structural_eval_context, lock)
+                    if not is_enabled: continue
+
+                    keywords = await macro_service.evaluate(entry.keywords, structural_eval_context, lock)
+                    priority = await macro_service.evaluate(entry.priority, structural_eval_context, lock)
 
                 is_activated, matched_keywords = False, []
                 if entry.trigger_mode == TriggerMode.ALWAYS_ON:
@@ -134,6 +143,8 @@ class InvokeRuntime(RuntimeInterface):
                     )
                     initial_pool.append(activated)
         
+        # 条目内容的求值上下文只在 trigger 上不同：基础上下文构建一次，每个条目只覆盖 trigger
+        content_base_context = macro_service.build_context(context)
         rendered_entry_ids: Set[str] = set()
         rendered_parts_with_priority = []
         rendering_pool = sorted(initial_pool, key=lambda x: x.priority_val, reverse=True)
@@ -142,12 +153,15 @@ class InvokeRuntime(RuntimeInterface):
             entry_to_render = rendering_pool.pop(0)
             if entry_to_render.entry_model.id in rendered_entry_ids: continue
             
-            content_eval_context = macro_service.build_context(context)
-            content_eval_context['trigger'] = DotAccessibleDict({
-                "source_text": entry_to_render.source_text,
-                "matched_keywords": entry_to_render.matched_keywords
-            })
-            rendered_content = str(await macro_service.evaluate(entry_to_render.entry_model.content, content_eval_context, lock))
+            content_eval_context = {
+                **content_base_context,
+                "trigger": DotAccessibleDict({
+                    "source_text": entry_to_render.source_text,
+                    "matched_keywords": entry_to_render.matched_keywords
+                })
+            }
+            with macro_origin(f"codex:{entry_to_render.codex_name}/{entry_to_render.entry_model.id}"):
+                rendered_content = str(await macro_service.evaluate(entry_to_render.entry_model.content, content_eval_context, lock))
             
             rendered_parts_with_priority.append({
                 "content": rendered_content, "priority": entry_to_render.priority_val, "id": entry_to_render.entry_model.id
@@ -161,13 +175,15 @@ class InvokeRuntime(RuntimeInterface):
                         if entry.id in rendered_entry_ids or any(p.entry_model.id == entry.id for p in rendering_pool): continue
                         if entry.trigger_mode != TriggerMode.ON_KEYWORD: continue
                         
-                        is_enabled = await macro_service.evaluate(entry.is_enabled, structural_eval_context, lock)
-                        if not is_enabled: continue
-                        keywords = await macro_service.evaluate(entry.keywords, structural_eval_context, lock)
+                        with macro_origin(f"codex:{codex_name}/{entry.id}"):
+                            is_enabled = await macro_service.evaluate(entry.is_enabled, structural_eval_context, lock)
+                            if not is_enabled: continue
+                            keywords = await macro_service.evaluate(entry.keywords, structural_eval_context, lock)
                         new_matched_keywords = [kw for kw in keywords if re.search(re.escape(str(kw)), rendered_content, re.IGNORECASE)]
                         
                         if new_matched_keywords:
-                            priority = await macro_service.evaluate(entry.priority, structural_eval_context, lock)
+                            with macro_origin(f"codex:{codex_name}/{entry.id}"):
+                                priority = await macro_service.evaluate(entry.priority, structural_eval_context, lock)
                             activated = ActivatedEntry(
                                 entry_model=entry, codex_name=codex_name, codex_config=codex_model.config,
                                 priority_val=int(priority), keywords_val=keywords, is_enabled_val=is_enabled,
@@ -1,15 +1,23 @@
 # plugins/core_engine/__init__.py
 
+import os
 import logging
 from typing import Dict, Type, List
 from fastapi import APIRouter
 
 from backend.core.contracts import Container, HookManager
 from .engine import ExecutionEngine
+from .concurrency import ConcurrencyLimiter, DEFAULT_CLASS_LIMITS, parse_concurrency_limits
+from .step_scheduler import StepScheduler
 from .registry import RuntimeRegistry
 from .state import SnapshotStore
 from .contracts import RuntimeInterface
 from .evaluation_service import MacroEvaluationService
+from .evaluation import macro_code_cache, macro_executor, macro_stats, template_plan_cache
+from .macro_cache import MacroCodeCache
+from .macro_executor import MacroExecutor
+from .macro_stats import MacroStatsCollector
+from .reporters import MacroCacheReporter, MacroExecutorReporter, MacroStatsReporter
 
 
 from .runtimes.io_runtimes import InputRuntime, LogRuntime
@@ -18,6 +26,7 @@ from .runtimes.flow_runtimes import ExecuteRuntime, CallRuntime, MapRuntime
 from .api import router as sandbox_router
 from .editor_api import editor_router
 from .schema_api import schema_router 
+from .macro_stats_api import macro_stats_router
 from .editor_utils import EditorUtilsService
 
 logger = logging.getLogger(__name__)
@@ -35,11 +44,56 @@ def _create_runtime_registry() -> RuntimeRegistry:
     logger.info(f"Registered {len(base_runtimes)} built-in system runtimes.")
     return registry
 
+def _create_concurrency_limiter() -> ConcurrencyLimiter:
+    # HEVNO_CONCURRENCY_LIMITS 形如 "llm=4,macro=2"，覆盖默认的类别上限；
+    # HEVNO_MAX_CONCURRENT_RUNTIMES 是整个进程内同时执行的运行时总数上限（0 表示不限）。
+    class_limits = {**DEFAULT_CLASS_LIMITS, **parse_concurrency_limits(os.getenv("HEVNO_CONCURRENCY_LIMITS"))}
+    global_limit = int(os.getenv("HEVNO_MAX_CONCURRENT_RUNTIMES", "64"))
+    logger.info(f"Runtime concurrency limits: {class_limits}, global: {global_limit or 'unlimited'}")
+    return ConcurrencyLimiter(class_limits=class_limits, global_limit=global_limit)
+
+def _create_macro_code_cache() -> MacroCodeCache:
+    # 已编译宏缓存和模板渲染计划缓存是 evaluation 模块级的共享实例，这里只按环境变量调整它们的上限
+    max_entries = int(os.getenv("HEVNO_MACRO_CACHE_ENTRIES", "4096"))
+    max_bytes = int(os.getenv("HEVNO_MACRO_CACHE_BYTES", str(8 * 1024 * 1024)))
+    macro_code_cache.configure(max_entries=max_entries, max_bytes=max_bytes)
+    template_plan_cache.configure(max_entries=max_entries, max_bytes=max_bytes)
+    return macro_code_cache
+
+def _create_macro_executor() -> MacroExecutor:
+    # HEVNO_MACRO_EXECUTION：inline（默认，廉价宏在事件循环上执行）、thread 或 process（纯宏进入进程池）；
+    # 池大小为 0 时按 CPU 数自动确定
+    macro_executor.configure(
+        mode=os.getenv("HEVNO_MACRO_EXECUTION", "inline"),
+        max_threads=int(os.getenv("HEVNO_MACRO_THREADS", "0")),
+        max_processes=int(os.getenv("HEVNO_MACRO_PROCESSES", "0")),
+        inline_threshold_ms=float(os.getenv("HEVNO_MACRO_INLINE_MS", "0.5"))
+    )
+    logger.info(f"Macro execution mode: {macro_executor.mode}")
+    return macro_executor
+
+def _create_macro_stats() -> MacroStatsCollector:
+    # HEVNO_MACRO_STATS=1 在启动时开启宏热点统计（也可以通过 PUT /api/system/macros/stats 随时开关）
+    macro_stats.enabled = os.getenv("HEVNO_MACRO_STATS", "0").lower() in ("1", "true", "yes")
+    macro_stats.max_entries = int(os.getenv("HEVNO_MACRO_STATS_ENTRIES", "2048"))
+    return macro_stats
+
+def _create_step_scheduler() -> StepScheduler:
+    return StepScheduler(
+        max_concurrent_steps=int(os.getenv("HEVNO_MAX_CONCURRENT_STEPS", "32")),
+        max_queue_depth=int(os.getenv("HEVNO_STEP_QUEUE_DEPTH", "16")),
+        max_total_queued=int(os.getenv("HEVNO_STEP_QUEUE_TOTAL", "1024"))
+    )
+
 def _create_execution_engine(container: Container) -> ExecutionEngine:
     return ExecutionEngine(
         registry=container.resolve("runtime_registry"),
         container=container,
-        hook_manager=container.resolve("hook_manager")
+        hook_manager=container.resolve("hook_manager"),
+        scheduler=os.getenv("HEVNO_ENGINE_SCHEDULER", "event"),
+        concurrency_limiter=container.resolve("concurrency_limiter"),
+        # HEVNO_STEP_TIMEOUT：每个 step 的服务端时长上限（秒，0 表示不限）
+        default_step_timeout=float(os.getenv("HEVNO_STEP_TIMEOUT", "0")) or None
     )
 
 def _create_editor_utils_service(container: Container) -> EditorUtilsService:
@@ -58,13 +112,26 @@ async def populate_runtime_registry(container: Container):
         for name, runtime_class in external_runtimes.items():
             registry.register(name, runtime_class)
 
+async def provide_reporter(reporters: list, container: Container) -> list:
+    """向审计系统提供本插件的报告器。"""
+    reporters.append(MacroCacheReporter(container.resolve("macro_code_cache"), template_plan_cache))
+    reporters.append(MacroExecutorReporter(container.resolve("macro_executor")))
+    reporters.append(MacroStatsReporter(container.resolve("macro_stats")))
+    logger.debug("Provided macro cache, executor and stats reporters to the auditor.")
+    return reporters
+
+async def shutdown_macro_executor(container: Container):
+    """应用关闭时回收宏执行器的线程池和进程池。"""
+    container.resolve("macro_executor").shutdown()
+
 # --- (新) 钩子实现：提供API路由 ---
 async def provide_api_router(routers: List[APIRouter]) -> List[APIRouter]:
     """钩子实现：将本插件的路由添加到收集中。"""
     routers.append(sandbox_router)
     routers.append(editor_router)
     routers.append(schema_router)
-    logger.debug("Provided sandbox runner, editor, and schema API routers to the application.")
+    routers.append(macro_stats_router)
+    logger.debug("Provided sandbox runner, editor, schema and macro stats API routers to the application.")
     return routers
 
 # --- 主注册函数 ---
@@ -72,8 +139,13 @@ def register_plugin(container: Container, hook_manager: HookManager):
     logger.info("--> 正在注册 [core_engine] 插件...")
 
     container.register("runtime_registry", _create_runtime_registry, singleton=True)
+    container.register("concurrency_limiter", _create_concurrency_limiter, singleton=True)
     container.register("execution_engine", _create_execution_engine, singleton=True)
+    container.register("step_scheduler", _create_step_scheduler, singleton=True)
     container.register("macro_evaluation_service", lambda: MacroEvaluationService(), singleton=True)
+    container.register("macro_code_cache", _create_macro_code_cache, singleton=True)
+    container.register("macro_executor", _create_macro_executor, singleton=True)
+    container.register("macro_stats", _create_macro_stats, singleton=True)
     container.register("editor_utils_service", _create_editor_utils_service, singleton=True)
     
     hook_manager.add_implementation(
@@ -88,5 +160,7 @@ def register_plugin(container: Container, hook_manager: HookManager):
         provide_api_router,
         plugin_name="core_engine"
     )
+    hook_manager.add_implementation("collect_reporters", provide_reporter, plugin_name="core_engine")
+    hook_manager.add_implementation("app_shutdown", shutdown_macro_executor, plugin_name="core_engine")
 
     logger.info("插件 [core_engine] 注册成功。")
\ No newline at end of file
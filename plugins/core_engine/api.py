@@ -1,6 +1,7 @@
 # plugins/core_engine/api.py
 
 import io
+import asyncio
 import logging
 import json
 import time
@@ -13,8 +14,8 @@ from pydantic import BaseModel, Field, ValidationError, field_validator
 from datetime import datetime, timezone
 from PIL import Image
 
-from fastapi import APIRouter, Body, Depends, HTTPException, UploadFile, File
-from fastapi.responses import Response, FileResponse, JSONResponse
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Request, UploadFile, File
+from fastapi.responses import Response, FileResponse, JSONResponse, StreamingResponse
 
 # 导入核心依赖解析器和所有必要的接口与数据模型（契约）
 from backend.core.dependencies import Service
@@ -25,8 +26,12 @@ from plugins.core_engine.contracts import (
     ExecutionEngineInterface,
     SnapshotStoreInterface,
     StepDiagnostics,
-    StepResponse
+    StepResponse,
+    StepSchedulerInterface,
+    StepQueueFullError,
+    StepDeadlineExceededError
 )
+from plugins.core_engine.profiling import StepProfiler
 from plugins.core_persistence.contracts import (
     PersistenceServiceInterface, 
     PackageManifest, 
@@ -325,26 +330,73 @@ async def create_sandbox(
     return sandbox
 
 # ... (文件的其余部分保持不变) ...
+
+# 轮询客户端连接状态的间隔（秒）
+_DISCONNECT_POLL_INTERVAL = 0.25
+
+def _step_deadline(timeout: Optional[float]) -> Optional[float]:
+    """将请求给出的相对超时（秒）换算为 time.monotonic() 时钟上的绝对截止时间，排队时间也计算在内。"""
+    return time.monotonic() + timeout if timeout is not None else None
+
+def _record_queue_wait(profiler: Optional[StepProfiler], ticket) -> None:
+    if profiler is not None:
+        profiler.record(
+            "queue_wait", "queue",
+            start_ms=max(profiler.elapsed_ms() - ticket.queue_wait_ms, 0.0), duration_ms=ticket.queue_wait_ms
+        )
+
+async def _cancel_on_disconnect(request: Request, task: asyncio.Task):
+    """等待 task 完成；期间客户端断开连接则取消它并返回 None。"""
+    while True:
+        done, _ = await asyncio.wait({task}, timeout=_DISCONNECT_POLL_INTERVAL)
+        if done:
+            return task.result()
+        if await request.is_disconnected():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            return None
+
 @router.post("/{sandbox_id}/step", response_model=StepResponse, summary="Execute a step")
 async def execute_sandbox_step(
     sandbox_id: UUID, 
+    request: Request,
     user_input: Dict[str, Any] = Body(...),
+    timeout: Optional[float] = Query(None, gt=0, description="整个 step（含排队）的超时秒数。"),
+    profile: bool = Query(False, description="返回分阶段耗时时间线（diagnostics.profile）。"),
     sandbox_store: SandboxStoreInterface = Depends(Service("sandbox_store")),
-    engine: ExecutionEngineInterface = Depends(Service("execution_engine"))
+    engine: ExecutionEngineInterface = Depends(Service("execution_engine")),
+    step_scheduler: StepSchedulerInterface = Depends(Service("step_scheduler"))
 ):
     """
     执行一步计算。持久化逻辑已封装在 engine.step 方法内部。
+    请求先经过 step 调度器：同一沙盒的 step 串行执行，队列已满时返回 429。
+    超过 timeout 时取消执行并返回 504；客户端断开连接时同样取消执行。
     返回一个包含执行元数据和更新后沙盒的信封。
     """
+    deadline = _step_deadline(timeout)
+    profiler = StepProfiler() if profile else None
     sandbox = sandbox_store.get(sandbox_id)
     if not sandbox:
         raise HTTPException(status_code=404, detail="Sandbox not found.")
-    
-    start_time = time.monotonic()
+
+    async def run_step():
+        async with step_scheduler.admit(sandbox_id) as ticket:
+            # 排队期间前一个 step 可能已经推进了头指针，或沙盒已被删除
+            current = sandbox_store.get(sandbox_id)
+            if not current:
+                raise HTTPException(status_code=404, detail="Sandbox not found.")
+
+            _record_queue_wait(profiler, ticket)
+            start_time = time.monotonic()
+            updated = await engine.step(current, user_input, deadline=deadline, profiler=profiler)
+            return updated, ticket, (time.monotonic() - start_time) * 1000
     
     try:
-        updated_sandbox = await engine.step(sandbox, user_input)
-        execution_time_ms = (time.monotonic() - start_time) * 1000
+        outcome = await _cancel_on_disconnect(request, asyncio.create_task(run_step()))
+        if outcome is None:
+            logger.info(f"Client disconnected; cancelled step for sandbox {sandbox_id}.")
+            return Response(status_code=499)
+        updated_sandbox, ticket, execution_time_ms = outcome
         
         # 从临时属性中获取诊断日志
         diagnostics_log = getattr(updated_sandbox, '_temp_diagnostics_log', None)
@@ -356,9 +408,34 @@ async def execute_sandbox_step(
             sandbox=updated_sandbox,
             diagnostics=StepDiagnostics(
                 execution_time_ms=execution_time_ms,
-                detailed_log=diagnostics_log # 将日志放入响应
+                queue_wait_ms=ticket.queue_wait_ms,
+                detailed_log=diagnostics_log, # 将日志放入响应
+                profile=profiler.timeline() if profiler else None
             )
         )
+    except HTTPException:
+        raise
+    except StepQueueFullError as e:
+        logger.warning(f"Rejected step for sandbox {sandbox_id}: {e}")
+        return JSONResponse(
+            status_code=429,
+            headers={"Retry-After": "1"},
+            content=StepResponse(
+                status="ERROR",
+                sandbox=sandbox,
+                error_message=str(e)
+            ).model_dump(mode="json")
+        )
+    except StepDeadlineExceededError as e:
+        logger.warning(f"Step for sandbox {sandbox_id} exceeded its deadline: {e}")
+        return JSONResponse(
+            status_code=504,
+            content=StepResponse(
+                status="ERROR",
+                sandbox=sandbox,
+                error_message=str(e)
+            ).model_dump(mode="json")
+        )
     except Exception as e:
         logger.error(f"Error during engine step for sandbox {sandbox_id}: {e}", exc_info=True)
         # 失败时，返回执行前的沙盒状态
@@ -372,6 +449,119 @@ async def execute_sandbox_step(
         )
 
 
+# 流式 step 在后台任务中运行；客户端断开连接时该任务被取消，并在退出时释放调度许可
+_streaming_step_tasks: set = set()
+
+def _format_sse(event: str, payload: Dict[str, Any]) -> str:
+    data = json.dumps(payload, ensure_ascii=False, default=str)
+    return f"event: {event}\ndata: {data}\n\n"
+
+async def _run_streaming_step(
+    admission,
+    sandbox_id: UUID,
+    user_input: Dict[str, Any],
+    sandbox_store: SandboxStoreInterface,
+    engine: ExecutionEngineInterface,
+    events: asyncio.Queue,
+    deadline: Optional[float] = None,
+    profiler: Optional[StepProfiler] = None
+):
+    emit = lambda event, payload: events.put_nowait((event, payload))
+    try:
+        async with admission as ticket:
+            _record_queue_wait(profiler, ticket)
+            emit("step_started", {"sandbox_id": str(sandbox_id), "queue_wait_ms": ticket.queue_wait_ms})
+            sandbox = sandbox_store.get(sandbox_id)
+            if not sandbox:
+                emit("step_failed", {"error_message": "Sandbox not found."})
+                return
+
+            start_time = time.monotonic()
+            try:
+                updated_sandbox = await engine.step(
+                    sandbox, user_input, event_sink=emit, deadline=deadline, profiler=profiler
+                )
+            except StepDeadlineExceededError as e:
+                logger.warning(f"Streaming step for sandbox {sandbox_id} exceeded its deadline: {e}")
+                emit("step_failed", {"error_message": str(e), "deadline_exceeded": True})
+                return
+            except Exception as e:
+                logger.error(f"Error during streaming step for sandbox {sandbox_id}: {e}", exc_info=True)
+                emit("step_failed", {"error_message": str(e)})
+                return
+            execution_time_ms = (time.monotonic() - start_time) * 1000
+
+        diagnostics_log = getattr(updated_sandbox, '_temp_diagnostics_log', None)
+        if hasattr(updated_sandbox, '_temp_diagnostics_log'):
+            delattr(updated_sandbox, '_temp_diagnostics_log')
+
+        emit("step_completed", {
+            "snapshot_id": str(updated_sandbox.head_snapshot_id),
+            "sandbox": updated_sandbox.model_dump(mode="json"),
+            "diagnostics": StepDiagnostics(
+                execution_time_ms=execution_time_ms,
+                queue_wait_ms=ticket.queue_wait_ms,
+                detailed_log=diagnostics_log,
+                profile=profiler.timeline() if profiler else None
+            ).model_dump(mode="json")
+        })
+    finally:
+        events.put_nowait(None)
+
+@router.post("/{sandbox_id}/step:stream", summary="Execute a step and stream node events")
+async def stream_sandbox_step(
+    sandbox_id: UUID,
+    user_input: Dict[str, Any] = Body(...),
+    timeout: Optional[float] = Query(None, gt=0, description="整个 step（含排队）的超时秒数。"),
+    profile: bool = Query(False, description="在 step_completed 的 diagnostics.profile 中返回分阶段耗时时间线。"),
+    sandbox_store: SandboxStoreInterface = Depends(Service("sandbox_store")),
+    engine: ExecutionEngineInterface = Depends(Service("execution_engine")),
+    step_scheduler: StepSchedulerInterface = Depends(Service("step_scheduler"))
+):
+    """
+    执行一步计算，并以 Server-Sent Events 的形式实时推送执行过程：
+    step_started -> node_started / node_succeeded / node_failed / node_skipped ... -> step_completed（或 step_failed）。
+    step_completed 携带已提交快照的 ID、更新后的沙盒和诊断信息。
+    超过 timeout 时发送带 deadline_exceeded 标记的 step_failed；客户端断开连接时取消执行。
+    """
+    deadline = _step_deadline(timeout)
+    profiler = StepProfiler() if profile else None
+    sandbox = sandbox_store.get(sandbox_id)
+    if not sandbox:
+        raise HTTPException(status_code=404, detail="Sandbox not found.")
+
+    try:
+        admission = step_scheduler.admit(sandbox_id)
+    except StepQueueFullError as e:
+        logger.warning(f"Rejected streaming step for sandbox {sandbox_id}: {e}")
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "1"})
+
+    events: asyncio.Queue = asyncio.Queue()
+    task = asyncio.create_task(
+        _run_streaming_step(admission, sandbox_id, user_input, sandbox_store, engine, events, deadline, profiler)
+    )
+    _streaming_step_tasks.add(task)
+    task.add_done_callback(_streaming_step_tasks.discard)
+
+    async def event_stream():
+        try:
+            while True:
+                item = await events.get()
+                if item is None:
+                    break
+                yield _format_sse(*item)
+        finally:
+            # 响应流在 step 结束前被关闭，说明客户端已断开连接
+            if not task.done():
+                task.cancel()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @router.put("/{sandbox_id}/revert", status_code=200, summary="Revert to a snapshot")
 async def revert_sandbox_to_snapshot(
     sandbox_id: UUID, 
@@ -386,12 +576,11 @@ async def revert_sandbox_to_snapshot(
     if not sandbox:
         raise HTTPException(status_code=404, detail="Sandbox not found.")
 
-    target_snapshot = snapshot_store.get(snapshot_id)
-    # 如果缓存里没有，就从磁盘加载所有快照来确认它是否存在
-    if not target_snapshot or target_snapshot.sandbox_id != sandbox.id:
-        all_snapshots = await snapshot_store.find_by_sandbox(sandbox_id)
-        if not any(s.id == snapshot_id for s in all_snapshots):
-            raise HTTPException(status_code=404, detail="Target snapshot not found or does not belong to this sandbox.")
+    # 先通过快照索引确认它属于这个沙盒；索引可能因为进程崩溃而与快照文件不一致，
+    # 所以仍要确认快照能被加载（它即将成为 head，下一步本来就要用到）
+    indexed = await snapshot_store.exists(sandbox_id, snapshot_id)
+    if not indexed or await snapshot_store.load(sandbox_id, snapshot_id) is None:
+        raise HTTPException(status_code=404, detail="Target snapshot not found or does not belong to this sandbox.")
 
     sandbox.head_snapshot_id = snapshot_id
     
@@ -424,12 +613,11 @@ async def delete_snapshot(
         )
 
     # 检查快照是否存在（可选，但更健壮）
-    snapshot = snapshot_store.get(snapshot_id)
-    if not snapshot or snapshot.sandbox_id != sandbox_id:
+    if not await snapshot_store.exists(sandbox_id, snapshot_id):
         # 即使找不到，也返回成功，因为最终状态是“不存在”
         return Response(status_code=204)
 
-    await snapshot_store.delete(snapshot_id)
+    await snapshot_store.delete(snapshot_id, sandbox_id=sandbox_id)
     
     logger.info(f"Deleted snapshot '{snapshot_id}' for sandbox '{sandbox.name}' ({sandbox.id}).")
     return Response(status_code=204)
@@ -538,12 +726,13 @@ async def apply_definition_to_sandbox(
 @router.get("/{sandbox_id}/history", response_model=List[StateSnapshot], summary="Get history")
 async def get_sandbox_history(
     sandbox_id: UUID,
+    limit: Optional[int] = Query(None, ge=1, description="只返回最新的 N 个快照（按创建时间排列）。"),
     sandbox_store: SandboxStoreInterface = Depends(Service("sandbox_store")),
     snapshot_store: SnapshotStoreInterface = Depends(Service("snapshot_store"))
 ):
     if sandbox_id not in sandbox_store:
         raise HTTPException(status_code=404, detail="Sandbox not found.")
-    return await snapshot_store.find_by_sandbox(sandbox_id)
+    return await snapshot_store.find_by_sandbox(sandbox_id, limit=limit)
 
 
 @router.patch("/{sandbox_id}", response_model=Sandbox, summary="Update Sandbox Details")
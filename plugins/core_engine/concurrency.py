@@ -0,0 +1,117 @@
+# plugins/core_engine/concurrency.py
+
+import asyncio
+import logging
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# 运行时未声明 concurrency_class 时所属的类别
+DEFAULT_CONCURRENCY_CLASS = "default"
+
+# 内置类别的默认上限。未列出的类别不设类别上限，只受全局上限约束。
+DEFAULT_CLASS_LIMITS: Dict[str, int] = {
+    "llm": 8,
+    "macro": 4,
+}
+
+
+def parse_concurrency_limits(raw: Optional[str]) -> Dict[str, int]:
+    """
+    解析形如 "llm=4,macro=2" 的配置字符串。
+    值为 0 或负数表示该类别不设上限。格式错误的条目会被忽略并记录警告。
+    """
+    limits: Dict[str, int] = {}
+    if not raw:
+        return limits
+    for item in raw.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        name, sep, value = item.partition("=")
+        try:
+            if not sep:
+                raise ValueError("missing '='")
+            limits[name.strip()] = int(value)
+        except ValueError as e:
+            logger.warning(f"Ignoring invalid concurrency limit entry '{item}': {e}")
+    return limits
+
+
+class ConcurrencyLimiter:
+    """
+    进程级的运行时并发限制器，由所有沙盒的所有图共享。
+
+    - 每个并发类别（由运行时的 `concurrency_class` 声明）拥有独立的信号量，
+      因此慢速的 LLM 调用不会占满廉价节点的执行槽位。
+    - 全局信号量限制整个进程中同时执行的运行时总数，防止单个繁重的沙盒拖垮其他沙盒。
+    - concurrency_class 为 None 的运行时（如 system.flow.*）完全不受限制：
+      它们只是在等待子图，如果占用槽位，嵌套子图就可能因拿不到槽位而死锁。
+
+    先获取类别槽位、再获取全局槽位，使排队等待类别槽位的调用不会占用全局容量。
+    """
+    def __init__(self, class_limits: Optional[Dict[str, int]] = None, global_limit: Optional[int] = None):
+        self.class_limits: Dict[str, int] = {
+            name: limit for name, limit in (class_limits or {}).items() if limit and limit > 0
+        }
+        self.global_limit: Optional[int] = global_limit if global_limit and global_limit > 0 else None
+        self._class_semaphores: Dict[str, asyncio.Semaphore] = {
+            name: asyncio.Semaphore(limit) for name, limit in self.class_limits.items()
+        }
+        self._global_semaphore: Optional[asyncio.Semaphore] = (
+            asyncio.Semaphore(self.global_limit) if self.global_limit else None
+        )
+        self._in_flight: Dict[str, int] = defaultdict(int)
+        self._waiting: Dict[str, int] = defaultdict(int)
+
+    @asynccontextmanager
+    async def slot(self, concurrency_class: Optional[str]) -> AsyncIterator[None]:
+        """在执行一个运行时期间持有其并发类别和全局的槽位。"""
+        if concurrency_class is None:
+            yield
+            return
+
+        class_semaphore = self._class_semaphores.get(concurrency_class)
+        self._waiting[concurrency_class] += 1
+        try:
+            if class_semaphore is not None:
+                await class_semaphore.acquire()
+            if self._global_semaphore is not None:
+                try:
+                    await self._global_semaphore.acquire()
+                except BaseException:
+                    if class_semaphore is not None:
+                        class_semaphore.release()
+                    raise
+        finally:
+            self._waiting[concurrency_class] -= 1
+
+        self._in_flight[concurrency_class] += 1
+        try:
+            yield
+        finally:
+            self._in_flight[concurrency_class] -= 1
+            if self._global_semaphore is not None:
+                self._global_semaphore.release()
+            if class_semaphore is not None:
+                class_semaphore.release()
+
+    def get_stats(self) -> Dict[str, Dict[str, Optional[int]]]:
+        """返回各类别当前的上限、执行中与排队中的数量。"""
+        classes = set(self.class_limits) | set(self._in_flight) | set(self._waiting)
+        stats = {
+            name: {
+                "limit": self.class_limits.get(name),
+                "in_flight": self._in_flight.get(name, 0),
+                "waiting": self._waiting.get(name, 0),
+            }
+            for name in sorted(classes)
+        }
+        stats["__global__"] = {
+            "limit": self.global_limit,
+            "in_flight": sum(self._in_flight.values()),
+            "waiting": sum(self._waiting.values()),
+        }
+        return stats
@@ -3,14 +3,17 @@
 from __future__ import annotations
 import asyncio
 from datetime import datetime, timezone
-from typing import Any, Dict, List, Optional, Set, Callable, Type
+from typing import Any, Dict, List, Optional, Set, Callable, Tuple, Type
 from uuid import UUID, uuid4
-from pydantic import BaseModel, Field, RootModel, ConfigDict, field_validator
+from pydantic import BaseModel, Field, PrivateAttr, RootModel, ConfigDict, SkipValidation, field_validator
 from abc import ABC, abstractmethod
 from typing_extensions import Literal
 
 # 从平台核心导入最基础的接口
 from backend.core.contracts import HookManager
+from .macro_locks import MacroLock, MacroLockManager
+# 运行时插件用它标记宏的来源（如 codex 条目），供宏热点统计归属
+from .macro_stats import macro_origin
 
 # --- 1. 核心持久化状态模型 ---
 
@@ -44,6 +47,8 @@ class StateSnapshot(BaseModel):
     parent_snapshot_id: Optional[UUID] = None
     triggering_input: Dict[str, Any] = Field(default_factory=dict)
     run_output: Optional[Dict[str, Any]] = None
+    # 记忆化节点的输入指纹 {node_id: fingerprint}，供下一次 step 判断能否复用 run_output 中的结果
+    memo_fingerprints: Optional[Dict[str, str]] = None
     
     model_config = ConfigDict(
         frozen=True,
@@ -65,13 +70,18 @@ class Sandbox(BaseModel):
 
 # --- 2. 核心运行时上下文模型 (确保有 arbitrary_types_allowed=True) ---
 class SharedContext(BaseModel):
-    definition_state: Dict[str, Any] = Field(default_factory=dict)
-    lore_state: Dict[str, Any] = Field(default_factory=dict)
-    moment_state: Dict[str, Any] = Field(default_factory=dict)
+    # 三个状态作用域通常是包装快照/沙盒数据的写时复制字典（CopyOnWriteDict），
+    # 跳过验证以保留传入的对象本身，否则 Pydantic 会把它复制成普通字典
+    definition_state: SkipValidation[Dict[str, Any]] = Field(default_factory=dict)
+    lore_state: SkipValidation[Dict[str, Any]] = Field(default_factory=dict)
+    moment_state: SkipValidation[Dict[str, Any]] = Field(default_factory=dict)
     session_info: Dict[str, Any]
-    global_write_lock: asyncio.Lock
+    # 宏的 (作用域, 顶层键) 级读写锁，取代原先串行化所有宏的 global_write_lock
+    macro_locks: MacroLockManager = Field(default_factory=MacroLockManager)
     services: Any
     model_config = {"arbitrary_types_allowed": True}
+    # 宏求值上下文的 step 级基础层缓存（见 evaluation.build_evaluation_context）
+    _evaluation_layer: Optional[Tuple[Tuple[Any, ...], Dict[str, Any]]] = PrivateAttr(default=None)
 
 class ExecutionContext(BaseModel):
     node_states: Dict[str, Any] = Field(default_factory=dict)
@@ -80,6 +90,8 @@ class ExecutionContext(BaseModel):
     initial_snapshot: StateSnapshot
     hook_manager: HookManager
     model_config = {"arbitrary_types_allowed": True}
+    # 宏求值上下文的图执行级覆盖层缓存（run/nodes）
+    _evaluation_layer: Optional[Tuple[Tuple[Any, ...], Dict[str, Any]]] = PrivateAttr(default=None)
 
 
 # --- 3. 系统事件契约 (用于钩子) ---
@@ -133,6 +145,10 @@ class SubGraphRunner(ABC):
 
 class RuntimeInterface(ABC):
     """定义所有运行时必须实现的接口。"""
+    # 并发类别：引擎按类别限制同时执行的运行时数量（见 concurrency.py）。
+    # 设为 None 表示不受任何并发限制，只应用于本身只是在等待子图的编排类运行时。
+    concurrency_class: Optional[str] = "default"
+
     @classmethod
     @abstractmethod
     def get_config_model(cls) -> Type[BaseModel]:
@@ -224,19 +240,62 @@ class MacroEvaluationServiceInterface(ABC):
         self,
         data: Any,
         eval_context: Dict[str, Any],
-        lock: asyncio.Lock
+        lock: MacroLock
     ) -> Any:
         raise NotImplementedError
 
+# step 执行期间的事件回调：(事件名, 负载)。回调必须是同步且非阻塞的（例如 asyncio.Queue.put_nowait）。
+StepEventSink = Callable[[str, Dict[str, Any]], None]
+
 class ExecutionEngineInterface(ABC):
     """定义执行引擎的核心接口。"""
     @abstractmethod
-    async def step(self, sandbox: 'Sandbox', triggering_input: Dict[str, Any] = None) -> 'Sandbox':
+    async def step(
+        self,
+        sandbox: 'Sandbox',
+        triggering_input: Dict[str, Any] = None,
+        event_sink: Optional[StepEventSink] = None,
+        deadline: Optional[float] = None,
+        profiler: Optional[Any] = None
+    ) -> 'Sandbox':
         """
         在沙盒的最新状态上执行一步计算，并返回更新后的、已持久化的沙盒对象。
+        提供 event_sink 时，主图中每个节点的开始/成功/失败/跳过都会实时推送给它。
+        deadline 是 time.monotonic() 时钟上的绝对截止时间；到期时抛出 StepDeadlineExceededError。
+        提供 profiler（StepProfiler）时，各执行阶段的耗时会被记录到它上面。
+        """
+        raise NotImplementedError
+
+class StepQueueFullError(Exception):
+    """当某个沙盒或整个进程的 step 排队数达到上限时，由 StepScheduler 抛出。"""
+    def __init__(self, message: str, sandbox_id: Optional[UUID] = None):
+        super().__init__(message)
+        self.sandbox_id = sandbox_id
+
+class StepDeadlineExceededError(Exception):
+    """step 未能在截止时间前完成时由执行引擎抛出。此时运行中的节点已被取消，且不会提交任何快照。"""
+    def __init__(self, message: str, node_results: Optional[Dict[str, Any]] = None):
+        super().__init__(message)
+        self.node_results = node_results or {}
+
+class StepSchedulerInterface(ABC):
+    """
+    定义多租户 step 调度器的接口。
+    同一沙盒的 step 严格按提交顺序串行执行，不同沙盒之间按权重公平地分享全局并发额度。
+    """
+    @abstractmethod
+    def admit(self, sandbox_id: UUID, weight: Optional[float] = None):
+        """
+        立即将请求入队并返回一个异步上下文管理器：进入时等待执行许可，退出时释放。
+        进入后得到的票据带有 queue_wait_ms。队列已满时在调用时同步抛出 StepQueueFullError。
         """
         raise NotImplementedError
 
+    @abstractmethod
+    def get_stats(self) -> Dict[str, Any]:
+        """返回当前运行中/排队中的 step 统计。"""
+        raise NotImplementedError
+
 class SnapshotStoreInterface(ABC):
     """定义快照存储的核心接口。"""
     @abstractmethod
@@ -249,14 +308,23 @@ class SnapshotStoreInterface(ABC):
         """同步从缓存获取一个快照。"""
         raise NotImplementedError
     
+    async def load(self, sandbox_id: UUID, snapshot_id: UUID) -> Optional['StateSnapshot']:
+        """异步获取一个快照，缓存未命中时从持久化层加载。默认实现只查缓存。"""
+        snapshot = self.get(snapshot_id)
+        return snapshot if snapshot and snapshot.sandbox_id == sandbox_id else None
+
+    async def exists(self, sandbox_id: UUID, snapshot_id: UUID) -> bool:
+        """异步判断快照是否存在且属于这个沙盒。"""
+        return await self.load(sandbox_id, snapshot_id) is not None
+
     @abstractmethod
-    async def find_by_sandbox(self, sandbox_id: UUID) -> List['StateSnapshot']:
-        """异步查找并加载属于特定沙盒的所有快照。"""
+    async def find_by_sandbox(self, sandbox_id: UUID, limit: Optional[int] = None) -> List['StateSnapshot']:
+        """异步查找并加载属于特定沙盒的快照，按创建时间排列；给出 limit 时只返回最新的 limit 个。"""
         raise NotImplementedError
 
     @abstractmethod
-    async def delete(self, snapshot_id: UUID) -> None:
-        """异步删除一个指定的快照。"""
+    async def delete(self, snapshot_id: UUID, sandbox_id: Optional[UUID] = None) -> None:
+        """异步删除一个指定的快照。提供 sandbox_id 时，不在缓存中的快照也能被删除。"""
         raise NotImplementedError
 
     @abstractmethod
@@ -310,13 +378,40 @@ class SandboxStoreInterface(ABC):
 
 # --- 5. API 契约 ---
 
+class ProfileSpan(BaseModel):
+    """step 时间线中的一个耗时区间。时间均以毫秒计，相对于请求被接收的时刻。"""
+    name: str
+    category: Literal["queue", "graph", "node", "hook", "macro", "concurrency_wait", "runtime", "snapshot", "persistence"]
+    start_ms: float
+    duration_ms: float
+    node_id: Optional[str] = None
+    instruction: Optional[int] = Field(default=None, description="节点 run 列表中的指令下标。")
+    runtime: Optional[str] = None
+
+class StepProfile(BaseModel):
+    """opt-in 的 step 分析结果，可直接渲染为瀑布图。"""
+    total_ms: float
+    spans: List[ProfileSpan] = Field(default_factory=list)
+    nodes: Dict[str, Dict[str, float]] = Field(
+        default_factory=dict,
+        description="每个节点按类别汇总的耗时（毫秒）。"
+    )
+
 class StepDiagnostics(BaseModel):
     """用于承载本次执行的诊断信息。"""
     execution_time_ms: float
+    queue_wait_ms: Optional[float] = Field(
+        default=None,
+        description="本次 step 在调度器中排队等待执行许可的时间。"
+    )
     detailed_log: Optional[List[Dict[str, Any]]] = Field(
         default=None,
         description="一个包含本次 step 执行期间所有详细诊断事件的列表。"
     )
+    profile: Optional[StepProfile] = Field(
+        default=None,
+        description="请求开启 profile 时返回的分阶段耗时时间线。"
+    )
 
 class StepResponse(BaseModel):
     """/step 端点的标准响应信封。"""
@@ -65,7 +65,7 @@ class EditorUtilsService(EditorUtilsServiceInterface):
             if not sandbox_to_modify.head_snapshot_id:
                 raise ValueError("Cannot mutate moment: Sandbox has no head snapshot.")
             
-            head_snapshot = self._snapshot_store.get(sandbox_to_modify.head_snapshot_id)
+            head_snapshot = await self._snapshot_store.load(sandbox_to_modify.id, sandbox_to_modify.head_snapshot_id)
             if not head_snapshot:
                  raise ValueError(f"Head snapshot {sandbox_to_modify.head_snapshot_id} not found.")
 
@@ -148,7 +148,7 @@ class EditorUtilsService(EditorUtilsServiceInterface):
         
         if any(p == 'moment' or p.startswith("moment/") for p in paths):
             if sandbox.head_snapshot_id:
-                head_snapshot = self._snapshot_store.get(sandbox.head_snapshot_id)
+                head_snapshot = await self._snapshot_store.load(sandbox.id, sandbox.head_snapshot_id)
                 if head_snapshot:
                     moment_data = head_snapshot.moment
             if moment_data is None:
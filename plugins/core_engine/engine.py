@@ -2,9 +2,8 @@
 
 import asyncio
 import logging
-from enum import Enum, auto
+import time
 from typing import Dict, Any, Set, List, Optional
-from collections import defaultdict
 import traceback
 
 from backend.core.contracts import Container, HookManager
@@ -15,11 +14,24 @@ from .contracts import (
     BeforeConfigEvaluationContext, AfterMacroEvaluationContext,
     SnapshotStoreInterface,
     SandboxStoreInterface,
+    StepEventSink,
+    StepDeadlineExceededError,
     RuntimeInterface, SubGraphRunner
 )
-from .dependency_parser import build_dependency_graph_async
+from .execution_plan import ExecutionPlan, ExecutionPlanCache
+from .graph_run import GraphRun, NodeState
+from .scheduling import (
+    NodeScheduler, WorkerPoolScheduler, EventDrivenScheduler,
+    SCHEDULERS, collect_initial_ready, abort_unfinished
+)
+from .concurrency import ConcurrencyLimiter, DEFAULT_CONCURRENCY_CLASS
+from .latency import NodeLatencyTracker
+from .memoization import NodeMemoizer, StepMemo, is_memoization_requested
+from .profiling import StepProfiler, get_current_profiler, profile_span, use_profiler
+from .timeouts import get_node_timeout, get_instruction_timeouts, remaining_seconds
 from .registry import RuntimeRegistry
-from .evaluation import build_evaluation_context, evaluate_data
+from .evaluation import build_evaluation_context, derive_config_shape, evaluate_data
+from .macro_stats import macro_origin
 from .state import (
     create_main_execution_context, 
     create_sub_execution_context, 
@@ -30,109 +42,71 @@ from .contracts import RuntimeInterface, SubGraphRunner
 
 logger = logging.getLogger(__name__)
 
-class NodeState(Enum):
-    PENDING = auto()
-    READY = auto()
-    RUNNING = auto()
-    SUCCEEDED = auto()
-    FAILED = auto()
-    SKIPPED = auto()
-
-class GraphRun:
-    def __init__(self, context: ExecutionContext, graph_def: GraphDefinition, dependencies: Dict[str, Set[str]]):
-        self.context = context
-        self.graph_def = graph_def
-        if not self.graph_def:
-            raise ValueError("GraphRun must be initialized with a valid GraphDefinition.")
-        
-        self.dependencies = dependencies
-        
-        self.node_map: Dict[str, GenericNode] = {n.id: n for n in self.graph_def.nodes}
-        self.node_states: Dict[str, NodeState] = {}
-        self.subscribers: Dict[str, Set[str]] = self._build_subscribers()
-        self._detect_cycles()
-        self._initialize_node_states()
-
-    def _build_subscribers(self) -> Dict[str, Set[str]]:
-        subscribers = defaultdict(set)
-        for node_id, deps in self.dependencies.items():
-            for dep_id in deps:
-                subscribers[dep_id].add(node_id)
-        return subscribers
-
-    def _detect_cycles(self):
-        path = set()
-        visited = set()
-        def visit(node_id):
-            path.add(node_id)
-            visited.add(node_id)
-            for neighbour in self.dependencies.get(node_id, set()):
-                if neighbour in path:
-                    raise ValueError(f"Cycle detected involving node {neighbour}")
-                if neighbour not in visited:
-                    visit(neighbour)
-            path.remove(node_id)
-        for node_id in self.node_map:
-            if node_id not in visited:
-                visit(node_id)
-
-    def _initialize_node_states(self):
-        for node_id in self.node_map:
-            if not self.dependencies.get(node_id):
-                self.node_states[node_id] = NodeState.READY
-            else:
-                self.node_states[node_id] = NodeState.PENDING
-
-    def get_node(self, node_id: str) -> GenericNode:
-        return self.node_map[node_id]
-    def get_node_state(self, node_id: str) -> NodeState:
-        return self.node_states.get(node_id)
-    def set_node_state(self, node_id: str, state: NodeState):
-        self.node_states[node_id] = state
-    def get_node_result(self, node_id: str) -> Dict[str, Any]:
-        return self.context.node_states.get(node_id)
-    def set_node_result(self, node_id: str, result: Dict[str, Any]):
-        self.context.node_states[node_id] = result
-    def get_nodes_in_state(self, state: NodeState) -> List[str]:
-        return [nid for nid, s in self.node_states.items() if s == state]
-    def get_dependencies(self, node_id: str) -> Set[str]:
-        return self.dependencies.get(node_id, set())
-    def get_subscribers(self, node_id: str) -> Set[str]:
-        return self.subscribers.get(node_id, set())
-    def get_execution_context(self) -> ExecutionContext:
-        return self.context
-    def get_final_node_states(self) -> Dict[str, Any]:
-        return self.context.node_states
-
 class ExecutionEngine(SubGraphRunner):
     def __init__(
         self,
         registry: RuntimeRegistry,
         container: Container,
         hook_manager: HookManager,
-        num_workers: int = 5
+        num_workers: int = 5,
+        scheduler: str = EventDrivenScheduler.name,
+        concurrency_limiter: Optional[ConcurrencyLimiter] = None,
+        prioritize_critical_path: bool = True,
+        default_step_timeout: Optional[float] = None
     ):
         self.registry = registry
         self.container = container
         self.hook_manager = hook_manager
         self.num_workers = num_workers
+        if scheduler not in SCHEDULERS:
+            raise ValueError(f"Unknown scheduler '{scheduler}'. Available: {list(SCHEDULERS.keys())}")
+        self.scheduler = scheduler
+        # 未提供时使用一个不设任何上限的限制器
+        self.concurrency_limiter = concurrency_limiter or ConcurrencyLimiter()
         self.graph_resolver = GraphResolver()
+        self.plan_cache = ExecutionPlanCache(registry)
+        # 就绪节点按剩余关键路径长度排序，而不是 FIFO
+        self.prioritize_critical_path = prioritize_critical_path
+        self.latency_tracker = NodeLatencyTracker()
+        self.memoizer = NodeMemoizer(registry)
+        # 服务端对每个 step 的时长上限（秒）；请求给出的截止时间更早时以请求为准
+        self.default_step_timeout = default_step_timeout
         
     async def step(
         self, 
         sandbox: Sandbox,
-        triggering_input: Dict[str, Any] = None
+        triggering_input: Dict[str, Any] = None,
+        event_sink: Optional[StepEventSink] = None,
+        deadline: Optional[float] = None,
+        profiler: Optional[StepProfiler] = None
     ) -> Sandbox: 
         """
         在沙盒的最新状态上执行一步计算。
+        提供 event_sink 时，主图节点的执行事件会在产生时立即推送给它。
+        deadline 是 time.monotonic() 时钟上的绝对截止时间：到期时取消所有运行中的节点，
+        抛出 StepDeadlineExceededError，不提交快照。
+        提供 profiler 时，图解析、每个节点及其指令的各阶段、快照创建与持久化的耗时都会被记录。
         """
+        with use_profiler(profiler):
+            return await self._step(sandbox, triggering_input, event_sink, deadline)
+
+    async def _step(
+        self,
+        sandbox: Sandbox,
+        triggering_input: Optional[Dict[str, Any]],
+        event_sink: Optional[StepEventSink],
+        deadline: Optional[float]
+    ) -> Sandbox:
         if triggering_input is None: triggering_input = {}
+        if self.default_step_timeout:
+            server_deadline = time.monotonic() + self.default_step_timeout
+            deadline = server_deadline if deadline is None else min(deadline, server_deadline)
         
         # 1. 获取最新的快照
         if not sandbox.head_snapshot_id:
             raise ValueError(f"Sandbox '{sandbox.name}' has no head snapshot to step from.")
         snapshot_store: SnapshotStoreInterface = self.container.resolve("snapshot_store")
-        initial_snapshot = snapshot_store.get(sandbox.head_snapshot_id)
+        initial_snapshot = await snapshot_store.load(sandbox.id, sandbox.head_snapshot_id)
         if not initial_snapshot:
             raise ValueError(f"Head snapshot '{sandbox.head_snapshot_id}' not found for sandbox '{sandbox.name}'.")
 
@@ -156,25 +130,55 @@ class ExecutionEngine(SubGraphRunner):
         await self.hook_manager.filter("before_graph_execution", context)
         
         # 3. 调用 GraphResolver 动态解析出本次要执行的图
-        graph_collection_to_run = self.graph_resolver.resolve(context)
+        with profile_span("resolve_graph", "graph"):
+            graph_collection_to_run = self.graph_resolver.resolve(context)
         main_graph_def = graph_collection_to_run.root.get("main")
         if not main_graph_def: raise ValueError("'main' graph not found in resolved collection.")
         
         # 4. 执行图
-        final_node_states = await self._internal_execute_graph(main_graph_def, context)
+        # 对声明了 metadata.memoize 的节点，输入指纹与上一个快照记录的一致时直接复用其结果
+        memo = StepMemo(initial_snapshot)
+        with profile_span("execute_graph", "graph"):
+            final_node_states = await self._internal_execute_graph(
+                main_graph_def, context, memo=memo, event_sink=event_sink, deadline=deadline
+            )
+
+        # 5-7. 提交阶段不可被中途取消（例如客户端断开连接），否则快照与沙盒头指针可能不一致。
+        # 取消请求会在提交完成后再向上传播。
+        commit = asyncio.ensure_future(
+            self._commit_step(sandbox, context, final_node_states, triggering_input, memo.fingerprints)
+        )
+        try:
+            return await asyncio.shield(commit)
+        except asyncio.CancelledError:
+            if not commit.done():
+                await commit
+            raise
+
+    async def _commit_step(
+        self,
+        sandbox: Sandbox,
+        context: ExecutionContext,
+        final_node_states: Dict[str, Any],
+        triggering_input: Dict[str, Any],
+        memo_fingerprints: Optional[Dict[str, str]] = None
+    ) -> Sandbox:
         diagnostics_log = context.run_vars.get("diagnostics_log", [])
         
         # 5. 创建新快照和更新后的 Lore
-        new_snapshot, updated_lore = await create_next_snapshot(
-            context=context, 
-            final_node_states=final_node_states, 
-            triggering_input=triggering_input
-        )
+        with profile_span("create_next_snapshot", "snapshot"):
+            new_snapshot, updated_lore = await create_next_snapshot(
+                context=context, 
+                final_node_states=final_node_states, 
+                triggering_input=triggering_input,
+                memo_fingerprints=memo_fingerprints
+            )
         
         # 6. 原子性地更新和保存状态
         # a. 保存新快照
         snapshot_store: SnapshotStoreInterface = self.container.resolve("snapshot_store")
-        await snapshot_store.save(new_snapshot) 
+        with profile_span("snapshot_store.save", "persistence"):
+            await snapshot_store.save(new_snapshot) 
 
         # b. 更新 Sandbox 对象的 Lore 和头指针
         sandbox.lore = updated_lore
@@ -183,7 +187,8 @@ class ExecutionEngine(SubGraphRunner):
         # c. 保存更新后的 Sandbox 对象
         # 使用通用接口进行类型提示
         sandbox_store: SandboxStoreInterface = self.container.resolve("sandbox_store")
-        await sandbox_store.save(sandbox)
+        with profile_span("sandbox_store.save", "persistence"):
+            await sandbox_store.save(sandbox)
         
         await self.hook_manager.trigger(
             "snapshot_committed", 
@@ -220,45 +225,64 @@ class ExecutionEngine(SubGraphRunner):
             inherited_inputs=inherited_inputs
         )
 
-    async def _internal_execute_graph(self, graph_def: GraphDefinition, context: ExecutionContext, inherited_inputs: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    async def _internal_execute_graph(
+        self,
+        graph_def: GraphDefinition,
+        context: ExecutionContext,
+        inherited_inputs: Optional[Dict[str, Any]] = None,
+        memo: Optional[StepMemo] = None,
+        event_sink: Optional[StepEventSink] = None,
+        deadline: Optional[float] = None
+    ) -> Dict[str, Any]:
         
-        dependencies = await build_dependency_graph_async(
-            nodes=[node.model_dump() for node in graph_def.nodes],
-            runtime_registry=self.registry
-        )
+        plan = await self.plan_cache.get_plan(graph_def)
+        run = GraphRun(context=context, graph_def=graph_def, plan=plan)
+        run.memo = memo
+        run.event_sink = event_sink
+        if self.prioritize_critical_path:
+            run.priorities = self.latency_tracker.critical_path_priorities(plan)
 
-        run = GraphRun(context=context, graph_def=graph_def, dependencies=dependencies)
-
-        task_queue = asyncio.Queue()
-        
         if inherited_inputs:
             for node_id, result in inherited_inputs.items():
                 run.set_node_state(node_id, NodeState.SUCCEEDED)
                 run.set_node_result(node_id, result)
         
-        for node_id in run.get_nodes_in_state(NodeState.PENDING):
-            dependencies = run.get_dependencies(node_id)
-            if all(run.get_node_state(dep_id) == NodeState.SUCCEEDED for dep_id in dependencies):
-                run.set_node_state(node_id, NodeState.READY)
-        
-        for node_id in run.get_nodes_in_state(NodeState.READY):
-            task_queue.put_nowait(node_id)
+        ready = collect_initial_ready(run)
 
-        if task_queue.empty() and not any(s == NodeState.SUCCEEDED for s in run.node_states.values()):
+        if not ready and not any(s == NodeState.SUCCEEDED for s in run.node_states.values()):
             return {}
 
-        workers = [
-            asyncio.create_task(self._worker(f"worker-{i}", run, task_queue))
-            for i in range(self.num_workers)
-        ]
-        
-        await task_queue.join()
-
-        for w in workers:
-            w.cancel()
-        
-        await asyncio.gather(*workers, return_exceptions=True)
-        
+        scheduler = self._get_scheduler(graph_def)
+        execution = scheduler.run(run, ready, lambda node_id: self._run_node(node_id, run))
+        try:
+            if deadline is None:
+                await execution
+            else:
+                # 超时后 wait_for 取消调度器，调度器再取消其所有运行中的节点任务（包括其中的子图）
+                await asyncio.wait_for(execution, timeout=remaining_seconds(deadline))
+        except asyncio.TimeoutError:
+            reason = "Step deadline exceeded."
+            self._abort_run(run, reason)
+            raise StepDeadlineExceededError(reason, node_results=self._collect_results(run))
+        except asyncio.CancelledError:
+            self._abort_run(run, "Step was cancelled.")
+            raise
+
+        self._emit_skipped(run)
+        return self._collect_results(run)
+
+    def _abort_run(self, run: GraphRun, reason: str):
+        for node_id in abort_unfinished(run, reason):
+            self._emit(run, "node_failed", {"node_id": node_id, "result": run.get_node_result(node_id)})
+        self._emit_skipped(run)
+
+    def _emit_skipped(self, run: GraphRun):
+        if run.event_sink is not None:
+            for node_id in run.get_nodes_in_state(NodeState.SKIPPED):
+                self._emit(run, "node_skipped", {"node_id": node_id, "result": run.get_node_result(node_id)})
+
+    @staticmethod
+    def _collect_results(run: GraphRun) -> Dict[str, Any]:
         final_states = {
             nid: run.get_node_result(nid)
             for nid, n in run.node_map.items()
@@ -266,124 +290,175 @@ class ExecutionEngine(SubGraphRunner):
         }
         return final_states
 
-    async def _worker(self, name: str, run: 'GraphRun', queue: asyncio.Queue):
-        while True:
-            try:
-                node_id = await queue.get()
-            except asyncio.CancelledError:
-                break
-
-            run.set_node_state(node_id, NodeState.RUNNING)
+    def _get_scheduler(self, graph_def: GraphDefinition) -> NodeScheduler:
+        """
+        图可以通过 metadata.scheduler 覆盖引擎默认的调度器，
+        并通过 metadata.max_parallelism 限制图内同时执行的节点数。
+        """
+        name = graph_def.metadata.get("scheduler") or self.scheduler
+        max_parallelism = graph_def.metadata.get("max_parallelism")
+        if max_parallelism is not None:
             try:
-                node = run.get_node(node_id)
-                context = run.get_execution_context()
-
-                await self.hook_manager.trigger(
-                    "node_execution_start",
-                    context=NodeExecutionStartContext(node=node, execution_context=context)
+                max_parallelism = int(max_parallelism)
+            except (TypeError, ValueError):
+                raise ValueError(f"metadata.max_parallelism must be an integer, got {max_parallelism!r}.")
+            if max_parallelism < 1:
+                raise ValueError(f"metadata.max_parallelism must be at least 1, got {max_parallelism}.")
+
+        if name == WorkerPoolScheduler.name:
+            return WorkerPoolScheduler(num_workers=max_parallelism or self.num_workers)
+        if name == EventDrivenScheduler.name:
+            return EventDrivenScheduler(max_parallelism=max_parallelism)
+        raise ValueError(f"Unknown scheduler '{name}'. Available: {list(SCHEDULERS.keys())}")
+
+    @staticmethod
+    def _emit(run: GraphRun, event: str, payload: Dict[str, Any]):
+        if run.event_sink is None:
+            return
+        try:
+            run.event_sink(event, payload)
+        except Exception:
+            # 事件消费方的问题不应影响图的执行
+            logger.exception(f"Step event sink failed while handling '{event}'.")
+
+    async def _run_node(self, node_id: str, run: GraphRun):
+        with profile_span(node_id, "node", node_id=node_id):
+            await self._run_node_lifecycle(node_id, run)
+
+    async def _run_node_lifecycle(self, node_id: str, run: GraphRun):
+        run.set_node_state(node_id, NodeState.RUNNING)
+        self._emit(run, "node_started", {"node_id": node_id})
+        try:
+            node = run.get_node(node_id)
+            context = run.get_execution_context()
+
+            await self.hook_manager.trigger(
+                "node_execution_start",
+                context=NodeExecutionStartContext(node=node, execution_context=context)
+            )
+            fingerprint = None
+            output = None
+            memoized = False
+            if run.memo is not None and is_memoization_requested(node, run.graph_def):
+                fingerprint = self.memoizer.fingerprint(run.plan, node, context)
+                if fingerprint is not None:
+                    output = run.memo.lookup(node_id, fingerprint)
+                    if output is not None:
+                        memoized = True
+                        context.run_vars.get("diagnostics_log", []).append({
+                            "type": "node_memoized", "node_id": node_id, "fingerprint": fingerprint
+                        })
+
+            if output is None:
+                node_timeout = get_node_timeout(node)
+                started_at = time.perf_counter()
+                # 宏热点统计按节点归属；子图中的节点会覆盖为自己的 ID
+                with macro_origin(f"node:{node_id}"):
+                    if node_timeout is None:
+                        output = await self._execute_node(node, context, plan=run.plan)
+                    else:
+                        try:
+                            output = await asyncio.wait_for(
+                                self._execute_node(node, context, plan=run.plan), timeout=node_timeout
+                            )
+                        except asyncio.TimeoutError:
+                            output = {"error": f"Node '{node_id}' timed out after {node_timeout:g}s.", "timeout": True}
+                self.latency_tracker.record(run.plan.fingerprint, node, time.perf_counter() - started_at)
+
+            if fingerprint is not None and not (isinstance(output, dict) and "error" in output):
+                run.memo.record(node_id, fingerprint)
+            
+            if isinstance(output, dict) and "error" in output:
+                # --- [新增日志] 开始 ---
+                # 这是处理"软失败"的地方 (运行时返回了错误字典)
+                failed_runtime = output.get('runtime', 'unknown')
+                error_msg = output.get('error', 'Unknown error')
+                logger.error(
+                    f"Node '{node_id}' failed in runtime '{failed_runtime}'. Reason: {error_msg}",
+                    exc_info=False # 我们不希望在这里看到完整的堆栈跟踪，因为这是预期的失败
                 )
-                output = await self._execute_node(node, context)
-                
-                if isinstance(output, dict) and "error" in output:
-                    # --- [新增日志] 开始 ---
-                    # 这是处理"软失败"的地方 (运行时返回了错误字典)
-                    failed_runtime = output.get('runtime', 'unknown')
-                    error_msg = output.get('error', 'Unknown error')
-                    logger.error(
-                        f"Node '{node_id}' failed in runtime '{failed_runtime}'. Reason: {error_msg}",
-                        exc_info=False # 我们不希望在这里看到完整的堆栈跟踪，因为这是预期的失败
-                    )
-                    # --- [新增日志] 结束 ---
+                # --- [新增日志] 结束 ---
 
-                    run.set_node_state(node_id, NodeState.FAILED)
-
-                    await self.hook_manager.trigger(
-                        "node_execution_error",
-                        context=NodeExecutionErrorContext(
-                            node=node,
-                            execution_context=context,
-                            exception=ValueError(output["error"])
-                        )
-                    )
-                else:
-                    run.set_node_state(node_id, NodeState.SUCCEEDED)
-
-                    await self.hook_manager.trigger(
-                        "node_execution_success",
-                        context=NodeExecutionSuccessContext(
-                            node=node,
-                            execution_context=context,
-                            result=output
-                        )
-                    )
-                run.set_node_result(node_id, output)
-
-            except Exception as e:
-                # --- [优化日志] 开始 ---
-                # 这是处理"硬失败"的地方 (引擎捕获了意外的Python异常)
-                logger.exception(f"UNHANDLED EXCEPTION in node '{node_id}'. The execution engine caught a critical error.")
-                # --- [优化日志] 结束 ---
-
-                error_message = f"Worker-level error for node {node_id}: {type(e).__name__}: {e}"
                 run.set_node_state(node_id, NodeState.FAILED)
-                run.set_node_result(node_id, {"error": error_message})
 
                 await self.hook_manager.trigger(
                     "node_execution_error",
                     context=NodeExecutionErrorContext(
                         node=node,
                         execution_context=context,
-                        exception=e
+                        exception=ValueError(output["error"])
+                    )
+                )
+            else:
+                run.set_node_state(node_id, NodeState.SUCCEEDED)
+
+                await self.hook_manager.trigger(
+                    "node_execution_success",
+                    context=NodeExecutionSuccessContext(
+                        node=node,
+                        execution_context=context,
+                        result=output
                     )
                 )
-            self._process_subscribers(node_id, run, queue)
-            queue.task_done()
-
-    def _process_subscribers(self, completed_node_id: str, run: 'GraphRun', queue: asyncio.Queue):
-        completed_node_state = run.get_node_state(completed_node_id)
-        for sub_id in run.get_subscribers(completed_node_id):
-            if run.get_node_state(sub_id) != NodeState.PENDING:
-                continue
-            if completed_node_state == NodeState.FAILED:
-                run.set_node_state(sub_id, NodeState.SKIPPED)
-                run.set_node_result(sub_id, {"status": "skipped", "reason": f"Upstream failure of node {completed_node_id}."})
-                self._process_subscribers(sub_id, run, queue)
-                continue
-            dependencies = run.get_dependencies(sub_id)
-            is_ready = all(
-                (dep_id not in run.node_map) or (run.get_node_state(dep_id) == NodeState.SUCCEEDED)
-                for dep_id in dependencies
+            run.set_node_result(node_id, output)
+
+            if run.get_node_state(node_id) == NodeState.SUCCEEDED:
+                self._emit(run, "node_succeeded", {"node_id": node_id, "result": output, "memoized": memoized})
+            else:
+                self._emit(run, "node_failed", {"node_id": node_id, "result": output})
+
+        except Exception as e:
+            # --- [优化日志] 开始 ---
+            # 这是处理"硬失败"的地方 (引擎捕获了意外的Python异常)
+            logger.exception(f"UNHANDLED EXCEPTION in node '{node_id}'. The execution engine caught a critical error.")
+            # --- [优化日志] 结束 ---
+
+            error_message = f"Worker-level error for node {node_id}: {type(e).__name__}: {e}"
+            run.set_node_state(node_id, NodeState.FAILED)
+            run.set_node_result(node_id, {"error": error_message})
+            self._emit(run, "node_failed", {"node_id": node_id, "result": {"error": error_message}})
+
+            await self.hook_manager.trigger(
+                "node_execution_error",
+                context=NodeExecutionErrorContext(
+                    node=node,
+                    execution_context=context,
+                    exception=e
+                )
             )
-            if is_ready:
-                run.set_node_state(sub_id, NodeState.READY)
-                queue.put_nowait(sub_id)
 
-    async def _execute_node(self, node: GenericNode, context: ExecutionContext) -> Dict[str, Any]:
+    async def _execute_node(self, node: GenericNode, context: ExecutionContext, plan: Optional[ExecutionPlan] = None) -> Dict[str, Any]:
         pipeline_state: Dict[str, Any] = {}
         if not node.run: return {}
         
-        lock = context.shared.global_write_lock
+        lock = context.shared.macro_locks
+        instruction_timeouts = get_instruction_timeouts(node)
+        # 节点级求值上下文：pipe 包装的是同一个 pipeline_state 字典，各条指令之间复用
+        eval_context = build_evaluation_context(context, pipe_vars=pipeline_state)
 
         for i, instruction in enumerate(node.run):
             runtime_name = instruction.runtime
             try:
-                eval_context = build_evaluation_context(context, pipe_vars=pipeline_state)
-                
-
                 config_to_process = instruction.config.copy()
                 as_key = config_to_process.pop("as", None)
 
-                config_to_process = await self.hook_manager.filter(
-                    "before_config_evaluation",
-                    config_to_process,
-                    context=BeforeConfigEvaluationContext(
-                        node=node,
-                        execution_context=context,
-                        instruction_config=config_to_process
+                span_attrs = {"node_id": node.id, "instruction": i, "runtime": runtime_name}
+                with profile_span("before_config_evaluation", "hook", **span_attrs):
+                    config_to_process = await self.hook_manager.filter(
+                        "before_config_evaluation",
+                        config_to_process,
+                        context=BeforeConfigEvaluationContext(
+                            node=node,
+                            execution_context=context,
+                            instruction_config=config_to_process
+                        )
                     )
-                )
 
-                runtime_instance: RuntimeInterface = self.registry.get_runtime(runtime_name)
+                runtime_class = plan.get_runtime_class(node.id, i) if plan else None
+                if runtime_class is not None:
+                    runtime_instance: RuntimeInterface = runtime_class()
+                else:
+                    runtime_instance: RuntimeInterface = self.registry.get_runtime(runtime_name)
                 
                 templates = {}
                 template_fields = getattr(runtime_instance, 'template_fields', [])
@@ -391,28 +466,55 @@ class ExecutionEngine(SubGraphRunner):
                     if field in config_to_process:
                         templates[field] = config_to_process.pop(field)
 
-                processed_config = await evaluate_data(config_to_process, eval_context, lock)
-
-                processed_config = await self.hook_manager.filter(
-                    "after_macro_evaluation",
-                    processed_config,
-                    context=AfterMacroEvaluationContext(
-                        node=node,
-                        execution_context=context,
-                        evaluated_config=processed_config
+                with profile_span("evaluate_data", "macro", **span_attrs):
+                    if plan is not None and node.id in plan.node_map:
+                        # 复用执行计划中缓存的配置形状：只有含宏的叶子会被求值
+                        shape = derive_config_shape(config_to_process, instruction.config, plan.get_config_shape(node.id, i))
+                        processed_config = await evaluate_data(config_to_process, eval_context, lock, shape=shape)
+                    else:
+                        processed_config = await evaluate_data(config_to_process, eval_context, lock)
+
+                with profile_span("after_macro_evaluation", "hook", **span_attrs):
+                    processed_config = await self.hook_manager.filter(
+                        "after_macro_evaluation",
+                        processed_config,
+                        context=AfterMacroEvaluationContext(
+                            node=node,
+                            execution_context=context,
+                            evaluated_config=processed_config
+                        )
                     )
-                )
 
                 if templates:
                     processed_config.update(templates)
 
-                output = await runtime_instance.execute(
-                    config=processed_config,
-                    context=context,
-                    subgraph_runner=self,
-                    pipeline_state=pipeline_state,
-                    node=node
-                )
+                concurrency_class = getattr(runtime_instance, 'concurrency_class', DEFAULT_CONCURRENCY_CLASS)
+                timeout = instruction_timeouts[i]
+                profiler = get_current_profiler()
+                slot_requested_ms = profiler.elapsed_ms() if profiler else 0.0
+                async with self.concurrency_limiter.slot(concurrency_class):
+                    if profiler is not None:
+                        profiler.record(
+                            "concurrency_wait", "concurrency_wait",
+                            start_ms=slot_requested_ms, duration_ms=profiler.elapsed_ms() - slot_requested_ms,
+                            **span_attrs
+                        )
+                    execution = runtime_instance.execute(
+                        config=processed_config,
+                        context=context,
+                        subgraph_runner=self,
+                        pipeline_state=pipeline_state,
+                        node=node
+                    )
+                    with profile_span("execute", "runtime", **span_attrs):
+                        if timeout is None:
+                            output = await execution
+                        else:
+                            try:
+                                output = await asyncio.wait_for(execution, timeout=timeout)
+                            except asyncio.TimeoutError:
+                                error_message = f"Step {i+1} ('{runtime_name}') timed out after {timeout:g}s."
+                                return {"error": error_message, "failed_step": i, "runtime": runtime_name, "timeout": True}
                 
                 if not isinstance(output, dict):
                     error_message = f"Runtime '{runtime_name}' did not return a dictionary. Got: {type(output).__name__}"
@@ -3,7 +3,9 @@
 import ast
 import asyncio
 import re
-from typing import Any, Dict, List, Optional   
+import time
+from types import CodeType
+from typing import Any, Dict, List, Optional, Tuple
 from functools import partial
 import random
 import math
@@ -11,8 +13,12 @@ import datetime
 import json
 import re as re_module
 
-from backend.core.utils import DotAccessibleDict 
-from .contracts import ExecutionContext
+from backend.core.utils import CopyOnWriteDict, CopyOnWriteList, DotAccessibleDict
+from .contracts import ExecutionContext, SharedContext
+from .macro_cache import MacroCodeCache
+from .macro_executor import MACRO_RESULT_VAR, MacroExecutor
+from .macro_locks import MacroAccess, MacroLock, MacroLockManager, NO_ACCESS, analyze_macro_access
+from .macro_stats import MacroStatsCollector, get_macro_origin
 
 INLINE_MACRO_REGEX = re.compile(r"{{\s*(.+?)\s*}}", re.DOTALL)
 MACRO_REGEX = re.compile(r"^{{\s*(.+)\s*}}$", re.DOTALL)
@@ -30,36 +36,137 @@ PRE_IMPORTED_MODULES = {
     "re": re_module,
 }
 
-def build_evaluation_context(
-    exec_context: ExecutionContext,
-    pipe_vars: Optional[Dict[str, Any]] = None
-) -> Dict[str, Any]:
+def _shared_layer(shared: SharedContext) -> Dict[str, Any]:
     """
-    从 ExecutionContext 构建宏的执行环境，注入新的三层作用域。
+    step 级基础层：预导入模块和三层状态、服务、会话的包装。
+    缓存在 SharedContext 上，同一步内的所有节点、子图、map 项和 codex 条目共享；
+    以被包装对象的身份作为校验，状态字典被整体替换时自动重建。
     """
-    context = {
+    sources = (shared.definition_state, shared.lore_state, shared.moment_state, shared.session_info, shared.services)
+    cached = shared._evaluation_layer
+    if cached is not None and all(a is b for a, b in zip(cached[0], sources)):
+        return cached[1]
+    layer = {
         **PRE_IMPORTED_MODULES,
         # 注入三层作用域，并用 DotAccessibleDict 包装以支持点符号访问
-        "definition": DotAccessibleDict(exec_context.shared.definition_state),
-        "lore": DotAccessibleDict(exec_context.shared.lore_state),
-        "moment": DotAccessibleDict(exec_context.shared.moment_state),
-        
+        "definition": DotAccessibleDict(shared.definition_state),
+        "lore": DotAccessibleDict(shared.lore_state),
+        "moment": DotAccessibleDict(shared.moment_state),
         # 共享服务和会话信息保持不变
-        "services": exec_context.shared.services, # services 已经是 DotAccessibleDict
-        "session": DotAccessibleDict(exec_context.shared.session_info),
-        
-        # run 和 nodes 是当前图执行所私有的
+        "services": shared.services, # services 已经是 DotAccessibleDict
+        "session": DotAccessibleDict(shared.session_info),
+    }
+    shared._evaluation_layer = (sources, layer)
+    return layer
+
+
+def _run_layer(exec_context: ExecutionContext) -> Dict[str, Any]:
+    """图执行级覆盖层：在基础层之上加入当前图执行私有的 run 和 nodes，缓存在 ExecutionContext 上。"""
+    base = _shared_layer(exec_context.shared)
+    sources = (base, exec_context.run_vars, exec_context.node_states)
+    cached = exec_context._evaluation_layer
+    if cached is not None and all(a is b for a, b in zip(cached[0], sources)):
+        return cached[1]
+    layer = {
+        **base,
         "run": DotAccessibleDict(exec_context.run_vars),
         "nodes": DotAccessibleDict(exec_context.node_states),
     }
+    exec_context._evaluation_layer = (sources, layer)
+    return layer
+
+
+def build_evaluation_context(
+    exec_context: ExecutionContext,
+    pipe_vars: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """
+    从 ExecutionContext 构建宏的执行环境，注入新的三层作用域。
+    上下文是分层复用的：step 级基础层和图执行级覆盖层只构建一次，
+    每次调用只复制这个小字典（调用方可以自由地往里添加 source/trigger 等条目），并按需加入 pipe。
+    包装器直接引用底层的状态字典，因此总能看到最新的状态。
+    """
+    context = dict(_run_layer(exec_context))
     if pipe_vars is not None:
         context['pipe'] = DotAccessibleDict(pipe_vars)
-        
     return context
 
-# ... (evaluate_expression 和 evaluate_data 函数保持不变) ...
-async def evaluate_expression(code_str: str, context: Dict[str, Any], lock: asyncio.Lock) -> Any:
-    """..."""
+_NOT_FOUND = object()
+
+
+class CompiledMacro:
+    """
+    一段宏编译后的形式。
+    纯读取的宏（一个常量，或由名称开头、只包含属性访问和常量下标的链，
+    例如 `nodes.llm.output`、`moment.player["hp"]`、`pipe.items[0]`）在编译期被识别为路径查找，
+    求值时直接在事件循环上对作用域字典解析，不经过 exec、线程池和全局写锁。
+    其余宏保留代码对象，走完整的 exec 路径。
+    """
+    __slots__ = ("code", "access", "root", "steps", "constant", "is_lookup", "cost_ms")
+
+    def __init__(self, code: Optional[CodeType], access: MacroAccess = NO_ACCESS, root: Optional[str] = None,
+                 steps: Tuple[Tuple[bool, Any], ...] = (), constant: Any = _NOT_FOUND):
+        self.code = code
+        # exec 路径需要获取的 (作用域, 顶层键) 读写锁
+        self.access = access
+        self.root = root
+        # (是否为属性访问, 属性名或下标)
+        self.steps = steps
+        self.constant = constant
+        self.is_lookup = root is not None or constant is not _NOT_FOUND
+        # exec 路径的实测耗时（毫秒，滑动平均），由 MacroExecutor 维护，用于决定是否内联执行
+        self.cost_ms: Optional[float] = None
+
+    def lookup(self, context: Dict[str, Any]) -> Any:
+        """执行路径查找；根名称不在作用域中（例如内置函数）时返回 _NOT_FOUND，由调用方回退到 exec。"""
+        if self.root is None:
+            return self.constant
+        value = context.get(self.root, _NOT_FOUND)
+        if value is _NOT_FOUND:
+            return _NOT_FOUND
+        for is_attr, key in self.steps:
+            value = getattr(value, key) if is_attr else value[key]
+        return value
+
+
+def _constant_value(node: ast.AST) -> Any:
+    if isinstance(node, ast.Constant):
+        return node.value
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub) and isinstance(node.operand, ast.Constant) \
+            and isinstance(node.operand.value, (int, float)):
+        return -node.operand.value
+    return _NOT_FOUND
+
+
+def _as_lookup_chain(expr: ast.AST) -> Optional[Tuple[str, Tuple[Tuple[bool, Any], ...]]]:
+    """若表达式是 `name(.attr | [常量])*` 形式的无副作用链，返回 (根名称, 访问步骤)。"""
+    steps: List[Tuple[bool, Any]] = []
+    node = expr
+    while True:
+        if isinstance(node, ast.Attribute):
+            steps.append((True, node.attr))
+            node = node.value
+        elif isinstance(node, ast.Subscript):
+            key = _constant_value(node.slice)
+            if key is _NOT_FOUND:
+                return None
+            steps.append((False, key))
+            node = node.value
+        elif isinstance(node, ast.Name):
+            return node.id, tuple(reversed(steps))
+        else:
+            return None
+
+
+# 进程内共享的已编译宏缓存。图配置和知识库条目中的同一段宏会在每个 step、每个 map 项上反复求值
+macro_code_cache: MacroCodeCache[CompiledMacro] = MacroCodeCache()
+# 进程内共享的宏执行器（专用线程池/进程池），执行方式由插件按环境变量配置
+macro_executor = MacroExecutor()
+# 进程内共享的宏热点统计（默认关闭）
+macro_stats = MacroStatsCollector()
+
+def compile_macro(code_str: str) -> CompiledMacro:
+    """将宏源码编译为 CompiledMacro；空代码块的 code 为 None。"""
     # ast.parse 可能会失败，需要 try...except
     try:
         tree = ast.parse(code_str, mode='exec')
@@ -68,79 +175,263 @@ async def evaluate_expression(code_str: str, context: Dict[str, Any], lock: asyn
 
     # 如果代码块为空，直接返回 None
     if not tree.body:
-        return None
+        return CompiledMacro(None)
+
+    access = analyze_macro_access(tree)
+
+    # 单个纯读取表达式：记录查找路径，完整的代码对象仍然保留以备回退
+    lookup_root, lookup_steps, constant = None, (), _NOT_FOUND
+    if len(tree.body) == 1 and isinstance(tree.body[0], ast.Expr):
+        expr = tree.body[0].value
+        constant = _constant_value(expr)
+        if constant is _NOT_FOUND:
+            chain = _as_lookup_chain(expr)
+            if chain is not None:
+                lookup_root, lookup_steps = chain
 
     # 如果最后一行是表达式，我们将其转换为一个赋值语句，以便捕获结果
-    result_var = "_macro_result"
     if isinstance(tree.body[-1], ast.Expr):
         # 包装最后一条表达式
         assign_node = ast.Assign(
-            targets=[ast.Name(id=result_var, ctx=ast.Store())],
+            targets=[ast.Name(id=MACRO_RESULT_VAR, ctx=ast.Store())],
             value=tree.body[-1].value
         )
         tree.body[-1] = ast.fix_missing_locations(assign_node)
     
     # 将 AST 编译为代码对象
     code_obj = compile(tree, filename="<macro>", mode="exec")
-    
-    # 在锁的保护下运行
-    async with lock:
-        # 在另一个线程中运行，以避免阻塞事件循环
-        # 注意：这里我们直接修改传入的 context 字典来捕获结果
-        await asyncio.get_running_loop().run_in_executor(
-            None, exec, code_obj, context
+    return CompiledMacro(code_obj, access, root=lookup_root, steps=lookup_steps, constant=constant)
+
+async def evaluate_expression(code_str: str, context: Dict[str, Any], lock: MacroLock) -> Any:
+    """编译（命中缓存时直接复用）并执行一段宏代码，返回最后一行表达式的值。"""
+    compiled = macro_code_cache.get_or_compile(code_str, compile_macro)
+    return await _evaluate_compiled(compiled, code_str, context, lock)
+
+async def _evaluate_compiled(compiled: CompiledMacro, code_str: str, context: Dict[str, Any], lock: MacroLock) -> Any:
+    if macro_stats.enabled:
+        return await _evaluate_profiled(compiled, code_str, context, lock)
+    return await _run_compiled(compiled, code_str, context, lock)
+
+async def _run_compiled(compiled: CompiledMacro, code_str: str, context: Dict[str, Any], lock: MacroLock,
+                        timings: Optional[List[float]] = None) -> Any:
+    if compiled.is_lookup:
+        # 快速路径：纯读取，不需要锁，也不需要线程池往返
+        value = compiled.lookup(context)
+        if value is not _NOT_FOUND:
+            return value
+    if compiled.code is None:
+        return None
+
+    # 只获取这段宏实际读写的作用域/键上的锁：互不冲突的宏可以在线程池中并发执行
+    guard = lock.acquire(compiled.access) if isinstance(lock, MacroLockManager) else lock
+    # 每次执行使用求值上下文的浅拷贝作为全局命名空间，
+    # 并发执行的宏各自的局部变量和结果变量不会互相覆盖；对作用域状态的修改仍然作用于共享的原始数据
+    namespace = dict(context)
+    if timings is None:
+        async with guard:
+            # 由宏执行器决定内联执行，还是交给专用线程池/进程池以避免阻塞事件循环
+            return await macro_executor.run(compiled, code_str, namespace)
+
+    # 热点统计：分别记录等待宏锁和在执行器中的时间（毫秒）
+    requested_at = time.perf_counter()
+    async with guard:
+        acquired_at = time.perf_counter()
+        timings.append((acquired_at - requested_at) * 1000)
+        try:
+            return await macro_executor.run(compiled, code_str, namespace)
+        finally:
+            timings.append((time.perf_counter() - acquired_at) * 1000)
+
+async def _evaluate_profiled(compiled: CompiledMacro, code_str: str, context: Dict[str, Any], lock: MacroLock) -> Any:
+    timings: List[float] = []
+    started_at = time.perf_counter()
+    failed = True
+    try:
+        result = await _run_compiled(compiled, code_str, context, lock, timings)
+        failed = False
+        return result
+    finally:
+        lock_wait_ms, exec_ms = (timings + [0.0, 0.0])[:2]
+        macro_stats.record(
+            code_str, get_macro_origin(), (time.perf_counter() - started_at) * 1000,
+            lock_wait_ms=lock_wait_ms, exec_ms=exec_ms, failed=failed
         )
-    
-    # 从被修改的上下文字典中获取结果
-    return context.get(result_var)
 
-async def evaluate_data(data: Any, eval_context: Dict[str, Any], lock: asyncio.Lock) -> Any:
-    if isinstance(data, str):
-        # 模式1: 检查是否为“全宏替换”
-        # 这种模式很重要，因为它允许宏返回非字符串类型（如列表、布尔值）
-        full_match = MACRO_REGEX.match(data)
-        if full_match:
-            code_to_run = full_match.group(1)
-            # 这里返回的结果可以是任何类型
-            return await evaluate_expression(code_to_run, eval_context, lock)
-
-        # 模式2: 如果不是全宏，检查是否包含“内联模板”
-        # 这种模式的结果总是字符串
-        if '{{' in data and '}}' in data:
-            matches = list(INLINE_MACRO_REGEX.finditer(data))
-            if not matches:
-                # 包含 {{ 和 }} 但格式不正确，按原样返回
-                return data
-
-            # 并发执行所有宏的求值
-            codes_to_run = [m.group(1) for m in matches]
-            tasks = [evaluate_expression(code, eval_context, lock) for code in codes_to_run]
-            evaluated_results = await asyncio.gather(*tasks)
-
-            # 将求值结果替换回原字符串
-            # 使用一个迭代器来确保替换顺序正确
-            results_iter = iter(evaluated_results)
-            # re.sub 的 lambda 每次调用时，都会从迭代器中取下一个结果
-            # 这比多次调用 str.replace() 更安全、更高效
-            final_string = INLINE_MACRO_REGEX.sub(lambda m: str(next(results_iter)), data)
-            
-            return final_string
-
-        # 如果两种模式都不匹配，说明是普通字符串
+
+class TemplatePlan:
+    """
+    一个含宏字符串编译后的渲染计划。
+    - 全宏（整个字符串就是一个 `{{ ... }}`）：full 保存这段宏，结果可以是任意类型；
+    - 内联模板：segments 是字面量片段与占位符（None）交替的列表，macros 记录每个占位符的位置和编译结果；
+    - 两者都不是（有 `{{`/`}}` 但格式不正确）：没有占位符，按原样返回。
+    """
+    __slots__ = ("full", "segments", "macros")
+
+    def __init__(self, full: Optional[Tuple[str, CompiledMacro]] = None, segments: Tuple[Optional[str], ...] = (),
+                 macros: Tuple[Tuple[int, str, CompiledMacro], ...] = ()):
+        self.full = full
+        self.segments = segments
+        self.macros = macros
+
+
+def compile_template(data: str) -> TemplatePlan:
+    """将含宏的字符串编译为 TemplatePlan；占位符的切分与 INLINE_MACRO_REGEX.sub 完全一致。"""
+    full_match = MACRO_REGEX.match(data)
+    if full_match:
+        code = full_match.group(1)
+        return TemplatePlan(full=(code, macro_code_cache.get_or_compile(code, compile_macro)))
+
+    segments: List[Optional[str]] = []
+    macros: List[Tuple[int, str, CompiledMacro]] = []
+    position = 0
+    for match in INLINE_MACRO_REGEX.finditer(data):
+        segments.append(data[position:match.start()])
+        code = match.group(1)
+        macros.append((len(segments), code, macro_code_cache.get_or_compile(code, compile_macro)))
+        segments.append(None)
+        position = match.end()
+    segments.append(data[position:])
+    return TemplatePlan(segments=tuple(segments), macros=tuple(macros))
+
+
+# 以完整字符串为键的渲染计划缓存。长提示词模板每个 step 都会被求值，不必重复扫描正则
+template_plan_cache: MacroCodeCache[TemplatePlan] = MacroCodeCache()
+
+async def render_template(plan: TemplatePlan, data: str, context: Dict[str, Any], lock: MacroLock) -> Any:
+    """
+    按渲染计划一次性拼出结果。纯读取的占位符在事件循环上同步求值；
+    其余占位符像以前一样并发求值，最后按原顺序拼接。
+    """
+    if plan.full is not None:
+        code, compiled = plan.full
+        # 这里返回的结果可以是任何类型
+        return await _evaluate_compiled(compiled, code, context, lock)
+    if not plan.macros:
+        # 包含 {{ 和 }} 但格式不正确，按原样返回
         return data
 
-    if isinstance(data, dict):
-        keys = list(data.keys())
-        # 创建异步任务列表
-        value_tasks = [evaluate_data(data[k], eval_context, lock) for k in keys]
-        # 并发执行所有值的求值
-        evaluated_values = await asyncio.gather(*value_tasks)
-        # 重新组装字典
-        return dict(zip(keys, evaluated_values))
+    parts = list(plan.segments)
+    pending: List[Tuple[int, str, CompiledMacro]] = []
+    # 开启热点统计时，所有占位符都经过 _evaluate_compiled 以便计时
+    sync_lookups = not macro_stats.enabled
+    for index, code, compiled in plan.macros:
+        if sync_lookups and compiled.is_lookup:
+            value = compiled.lookup(context)
+            if value is not _NOT_FOUND:
+                parts[index] = str(value)
+                continue
+        pending.append((index, code, compiled))
+
+    if len(pending) == 1:
+        index, code, compiled = pending[0]
+        parts[index] = str(await _evaluate_compiled(compiled, code, context, lock))
+    elif pending:
+        results = await asyncio.gather(*(_evaluate_compiled(compiled, code, context, lock) for _, code, compiled in pending))
+        for (index, _, _), value in zip(pending, results):
+            parts[index] = str(value)
+    return "".join(parts)
+
+# 数据形状：描述一个值中哪些部分含有宏。
+# None 表示整棵子树都是静态的；True 表示含宏的字符串；
+# dict 形状把键映射到其动态子形状，tuple 形状是 (下标, 子形状) 的序列。两者都只记录动态的子项。
+DataShape = Any
+_UNKNOWN_SHAPE = object()
+
+
+def _has_macro(value: str) -> bool:
+    return '{{' in value and '}}' in value
 
+
+def compile_data_shape(data: Any) -> DataShape:
+    """扫描一次数据，找出含宏的子树。只做类型判断和子串查找，不创建协程。"""
+    if isinstance(data, str):
+        return True if _has_macro(data) else None
+    if isinstance(data, dict):
+        shape = {}
+        for key, value in data.items():
+            child = compile_data_shape(value)
+            if child is not None:
+                shape[key] = child
+        return shape or None
     if isinstance(data, list):
-        # 并发执行列表中所有项的求值
-        item_tasks = [evaluate_data(item, eval_context, lock) for item in data]
-        return await asyncio.gather(*item_tasks)
+        items = []
+        for index, value in enumerate(data):
+            child = compile_data_shape(value)
+            if child is not None:
+                items.append((index, child))
+        return tuple(items) or None
+    return None
+
+
+def derive_config_shape(config: Dict[str, Any], original: Dict[str, Any], original_shape: DataShape) -> DataShape:
+    """
+    为 original 的（可能被钩子改动过的）浅拷贝 config 求形状：
+    值仍是同一对象的键直接沿用 original 的已缓存形状，被替换或新增的键重新扫描。
+    """
+    shape = {}
+    for key, value in config.items():
+        if key in original and original[key] is value:
+            child = original_shape.get(key) if original_shape else None
+        else:
+            child = compile_data_shape(value)
+        if child is not None:
+            shape[key] = child
+    return shape or None
+
+
+def _share_static(data: Any) -> Any:
+    """
+    静态的容器以写时复制的形式交出：配置数据属于 GraphResolver 缓存并跨步骤复用的 GraphCollection，
+    节点输出被宏原地修改（如 `nodes.a.output.append(...)`）时不能改到缓存的图定义上。
+    Pydantic 等 C 实现的读取方绕过 __getitem__ 直接读取字典/列表的存储，因此直接子容器在交出前就换成写时复制容器。
+    """
+    data_type = type(data)
+    if data_type is dict:
+        shared = CopyOnWriteDict(data)
+    elif data_type is list:
+        shared = CopyOnWriteList(data)
+    else:
+        return data
+    shared._own_all()
+    return shared
+
+
+async def evaluate_data(data: Any, eval_context: Dict[str, Any], lock: MacroLock, shape: DataShape = _UNKNOWN_SHAPE) -> Any:
+    """
+    对数据中的所有宏求值。完全静态的子树不再遍历、也不创建协程，只有含宏的叶子会被求值。
+    返回的容器都是写时复制容器（见 _share_static），静态部分在被修改前与原始数据共享。
+    shape 可由调用方传入预先计算并缓存的形状（见 compile_data_shape），否则就地扫描一次。
+    """
+    if shape is _UNKNOWN_SHAPE:
+        shape = compile_data_shape(data)
+    if shape is None:
+        return _share_static(data)
+    return await _evaluate_shaped(data, shape, eval_context, lock)
+
+
+async def _evaluate_shaped(data: Any, shape: DataShape, eval_context: Dict[str, Any], lock: MacroLock) -> Any:
+    if shape is True:
+        # 全宏替换（允许宏返回非字符串类型，如列表、布尔值）或内联模板（结果总是字符串）
+        plan = template_plan_cache.get_or_compile(data, compile_template)
+        return await render_template(plan, data, eval_context, lock)
+
+    # 静态子项留在写时复制容器里，第一次被取出时才复制；动态子项从原始数据读取，求值后直接替换
+    if isinstance(data, dict):
+        result = CopyOnWriteDict(data)
+        dynamic = [(key, child) for key, child in shape.items() if key in data]
+        assign = dict.__setitem__
+    else:
+        result = CopyOnWriteList(data)
+        dynamic = [(index, child) for index, child in shape if index < len(data)]
+        assign = list.__setitem__
 
-    return data
\ No newline at end of file
+    if len(dynamic) == 1:
+        key, child = dynamic[0]
+        assign(result, key, await _evaluate_shaped(data[key], child, eval_context, lock))
+    elif dynamic:
+        # 并发求值所有动态子项
+        values = await asyncio.gather(*(_evaluate_shaped(data[key], child, eval_context, lock) for key, child in dynamic))
+        for (key, _), value in zip(dynamic, values):
+            assign(result, key, value)
+    result._own_all()
+    return result
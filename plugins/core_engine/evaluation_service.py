@@ -5,6 +5,7 @@ from typing import Any, Dict, Optional
 from .contracts import ExecutionContext, MacroEvaluationServiceInterface
 from .evaluation import build_evaluation_context as build_context_impl
 from .evaluation import evaluate_data as evaluate_data_impl
+from .macro_locks import MacroLock
 
 class MacroEvaluationService(MacroEvaluationServiceInterface):
     """
@@ -24,7 +25,7 @@ class MacroEvaluationService(MacroEvaluationServiceInterface):
         self,
         data: Any,
         eval_context: Dict[str, Any],
-        lock: asyncio.Lock
+        lock: MacroLock
     ) -> Any:
         """
         代理调用原始的 evaluate_data 函数。
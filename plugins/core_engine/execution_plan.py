@@ -0,0 +1,172 @@
+# plugins/core_engine/execution_plan.py
+
+import hashlib
+import logging
+import weakref
+from collections import OrderedDict, defaultdict
+from typing import Any, Dict, List, Set, Tuple, Type, Optional
+
+from .contracts import GraphDefinition, GenericNode, RuntimeInterface
+from .dependency_parser import build_dependency_graph_async
+from .evaluation import compile_data_shape
+from .registry import RuntimeRegistry
+
+logger = logging.getLogger(__name__)
+
+
+class ExecutionPlan:
+    """
+    一个图定义的“编译产物”。
+    包含所有只依赖于图结构本身的信息：依赖表、订阅者表、拓扑序、每条指令的运行时类，
+    以及（按需计算的）每条指令配置中含宏子树的形状。
+    它是只读的，可以在任意多次 GraphRun 之间安全共享。
+    """
+    def __init__(
+        self,
+        fingerprint: str,
+        node_map: Dict[str, GenericNode],
+        dependencies: Dict[str, Set[str]],
+        runtime_classes: Dict[str, List[Type[RuntimeInterface]]]
+    ):
+        self.fingerprint = fingerprint
+        self.node_map = node_map
+        self.dependencies = dependencies
+        self.runtime_classes = runtime_classes
+        self.subscribers: Dict[str, Set[str]] = self._build_subscribers()
+        self._detect_cycles()
+        self.topological_order: List[str] = self._build_topological_order()
+        # 没有任何依赖的节点，在每次运行开始时即为 READY
+        self.entry_nodes: List[str] = [
+            nid for nid in self.node_map if not self.dependencies.get(nid)
+        ]
+        self._config_shapes: Dict[Tuple[str, int], Any] = {}
+
+    def _build_subscribers(self) -> Dict[str, Set[str]]:
+        subscribers = defaultdict(set)
+        for node_id, deps in self.dependencies.items():
+            for dep_id in deps:
+                subscribers[dep_id].add(node_id)
+        return dict(subscribers)
+
+    def _detect_cycles(self):
+        path = set()
+        visited = set()
+        def visit(node_id):
+            path.add(node_id)
+            visited.add(node_id)
+            for neighbour in self.dependencies.get(node_id, set()):
+                if neighbour in path:
+                    raise ValueError(f"Cycle detected involving node {neighbour}")
+                if neighbour not in visited:
+                    visit(neighbour)
+            path.remove(node_id)
+        for node_id in self.node_map:
+            if node_id not in visited:
+                visit(node_id)
+
+    def _build_topological_order(self) -> List[str]:
+        """Kahn 算法。只考虑图内节点之间的边（图外依赖由调用方通过 inherited_inputs 满足）。"""
+        in_degree = {
+            nid: sum(1 for dep in self.dependencies.get(nid, set()) if dep in self.node_map)
+            for nid in self.node_map
+        }
+        order = [nid for nid, degree in in_degree.items() if degree == 0]
+        i = 0
+        while i < len(order):
+            for sub_id in self.subscribers.get(order[i], set()):
+                if sub_id not in in_degree:
+                    continue
+                in_degree[sub_id] -= 1
+                if in_degree[sub_id] == 0:
+                    order.append(sub_id)
+            i += 1
+        return order
+
+    def get_runtime_class(self, node_id: str, instruction_index: int) -> Optional[Type[RuntimeInterface]]:
+        return self.runtime_classes[node_id][instruction_index]
+
+    def get_config_shape(self, node_id: str, instruction_index: int) -> Any:
+        """指令配置的数据形状（见 evaluation.compile_data_shape），首次访问时计算。"""
+        key = (node_id, instruction_index)
+        if key not in self._config_shapes:
+            config = self.node_map[node_id].run[instruction_index].config
+            self._config_shapes[key] = compile_data_shape(config)
+        return self._config_shapes[key]
+
+
+class ExecutionPlanCache:
+    """
+    按图定义的内容哈希缓存 ExecutionPlan。
+    同一个 GraphDefinition 对象的哈希只计算一次（按对象身份记忆），
+    内容相同的不同对象共享同一个计划。
+    注意：这要求图定义在交给引擎后不再被原地修改。
+    """
+    def __init__(self, registry: RuntimeRegistry, max_size: int = 256):
+        self._registry = registry
+        self._max_size = max_size
+        self._plans: "OrderedDict[Tuple[str, int], ExecutionPlan]" = OrderedDict()
+        # id(graph_def) -> (弱引用, 指纹)。弱引用用于在对象被回收后清理条目，避免 id 复用导致误命中。
+        self._fingerprints: Dict[int, Tuple[weakref.ref, str]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def fingerprint(self, graph_def: GraphDefinition) -> str:
+        key = id(graph_def)
+        entry = self._fingerprints.get(key)
+        if entry is not None and entry[0]() is graph_def:
+            return entry[1]
+
+        digest = hashlib.sha256(graph_def.model_dump_json().encode("utf-8")).hexdigest()
+        try:
+            ref = weakref.ref(graph_def, lambda _, k=key: self._fingerprints.pop(k, None))
+            self._fingerprints[key] = (ref, digest)
+        except TypeError:
+            # 对象不支持弱引用时，只是放弃身份记忆
+            pass
+        return digest
+
+    async def get_plan(self, graph_def: GraphDefinition) -> ExecutionPlan:
+        fingerprint = self.fingerprint(graph_def)
+        # 运行时注册表发生变化时，旧计划中的运行时类可能已失效
+        cache_key = (fingerprint, self._registry.version)
+
+        plan = self._plans.get(cache_key)
+        if plan is not None:
+            self._plans.move_to_end(cache_key)
+            self.hits += 1
+            return plan
+
+        self.misses += 1
+        plan = await self._compile(graph_def, fingerprint)
+        self._plans[cache_key] = plan
+        if len(self._plans) > self._max_size:
+            self._plans.popitem(last=False)
+        return plan
+
+    async def _compile(self, graph_def: GraphDefinition, fingerprint: str) -> ExecutionPlan:
+        logger.debug(f"Compiling execution plan for graph {fingerprint[:12]}...")
+        dependencies = await build_dependency_graph_async(
+            nodes=[node.model_dump() for node in graph_def.nodes],
+            runtime_registry=self._registry
+        )
+        runtime_classes = {
+            node.id: [self._resolve_runtime_class(instr.runtime) for instr in node.run]
+            for node in graph_def.nodes
+        }
+        return ExecutionPlan(
+            fingerprint=fingerprint,
+            node_map={n.id: n for n in graph_def.nodes},
+            dependencies=dependencies,
+            runtime_classes=runtime_classes
+        )
+
+    def _resolve_runtime_class(self, runtime_name: str) -> Optional[Type[RuntimeInterface]]:
+        # 查找失败时留空，让错误在节点执行时以节点级失败的形式暴露（与编译前的行为一致）
+        try:
+            return self._registry.get_runtime_class(runtime_name)
+        except ValueError:
+            return None
+
+    def clear(self):
+        self._plans.clear()
+        self._fingerprints.clear()
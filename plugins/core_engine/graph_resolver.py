@@ -1,40 +1,104 @@
 # plugins/core_engine/graph_resolver.py
 
+import hashlib
+import json
 import logging
-from typing import Dict, Any
+from collections import OrderedDict
+from typing import Dict, Any, Tuple
 from copy import deepcopy
 
+from backend.core.utils import get_original_if_unchanged
 from .contracts import ExecutionContext, GraphCollection
 
 logger = logging.getLogger(__name__)
 
+
+def fingerprint_graph_data(graph_data: Dict[str, Any]) -> str:
+    """
+    为一个原始的图定义子树计算内容指纹。
+    开销与图库的大小成正比，只在按对象身份无法命中缓存时使用（见 GraphResolver）。
+    键顺序不同的等价数据会得到不同的指纹，这只会造成一次缓存未命中，不影响正确性。
+    """
+    if not graph_data:
+        return ""
+    encoded = json.dumps(
+        graph_data, separators=(",", ":"), ensure_ascii=False,
+        check_circular=False, default=repr
+    )
+    return hashlib.blake2b(encoded.encode("utf-8"), digest_size=16).hexdigest()
+
+
 class GraphResolver:
     """
     负责在每次图执行前，根据上下文动态地“组装”出最终要执行的图集合。
+    已验证的图集合有两级缓存：
+    - 按对象身份：写时复制状态中本步未改动的 lore/moment 图子树就是沙盒和快照中原始的那个对象，
+      原始数据不会被修改，因此每步、每次子图调用和每个 map 项的查找都是 O(1)。
+    - 按内容指纹：图子树在本步被修改过、或状态不是写时复制字典时才计算，同时让内容相同的新对象复用已有模型。
+    返回的 GraphCollection 是共享的，调用方不得原地修改它。
     """
+    def __init__(self, max_cache_size: int = 64):
+        self._max_cache_size = max_cache_size
+        self._cache: "OrderedDict[Tuple[str, str], GraphCollection]" = OrderedDict()
+        # (id(lore 图子树), id(moment 图子树)) -> (lore 图子树, moment 图子树, 图集合)；
+        # 条目持有子树的引用，保证 id 在条目存活期间不会被其他对象复用
+        self._by_identity: "OrderedDict[Tuple[int, int], Tuple[Any, Any, GraphCollection]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.fingerprints = 0
+
     def resolve(self, context: ExecutionContext) -> GraphCollection:
         """
         根据上下文中的 Lore 和 Moment 作用域，合并和验证图定义。
         Moment 中的图会覆盖 Lore 中的同名图。
         """
+        lore_graphs, lore_unchanged = get_original_if_unchanged(context.shared.lore_state, 'graphs')
+        moment_graphs, moment_unchanged = get_original_if_unchanged(context.shared.moment_state, 'graphs')
+
+        identity_key = None
+        if lore_unchanged and moment_unchanged:
+            identity_key = (id(lore_graphs), id(moment_graphs))
+            entry = self._by_identity.get(identity_key)
+            if entry is not None and entry[0] is lore_graphs and entry[1] is moment_graphs:
+                self._by_identity.move_to_end(identity_key)
+                self.hits += 1
+                return entry[2]
+
+        collection = self._resolve_by_content(lore_graphs or {}, moment_graphs or {})
+        if identity_key is not None:
+            self._by_identity[identity_key] = (lore_graphs, moment_graphs, collection)
+            if len(self._by_identity) > self._max_cache_size:
+                self._by_identity.popitem(last=False)
+        return collection
+
+    def _resolve_by_content(self, lore_graphs: Dict[str, Any], moment_graphs: Dict[str, Any]) -> GraphCollection:
+        self.fingerprints += 1
+        cache_key = (fingerprint_graph_data(lore_graphs), fingerprint_graph_data(moment_graphs))
+        cached = self._cache.get(cache_key)
+        if cached is not None:
+            self._cache.move_to_end(cache_key)
+            self.hits += 1
+            return cached
+
+        self.misses += 1
         logger.debug("Resolving graph collection from Lore and Moment states...")
 
         # 1. 从 lore_state 获取基础图集合，如果没有则为空字典
-        # 使用 deepcopy 以避免意外修改原始上下文
-        base_graphs = deepcopy(context.shared.lore_state.get('graphs', {}))
-        
+        # 使用 deepcopy，使缓存的模型不会与执行期间可能被宏修改的上下文状态共享可变对象
+        base_graphs = deepcopy(lore_graphs)
+
         # 2. 从 moment_state 获取覆盖图集合
-        override_graphs = deepcopy(context.shared.moment_state.get('graphs', {}))
+        override_graphs = deepcopy(moment_graphs)
 
         # 3. 将两者合并。字典的 update 方法天然地实现了覆盖逻辑。
         # 如果 override_graphs 中有与 base_graphs 同名的键，其值将覆盖 base_graphs 中的值。
         final_graph_data = {**base_graphs, **override_graphs}
-        
+
         if not final_graph_data:
             raise ValueError("No graph definitions found in 'lore.graphs' or 'moment.graphs'.")
 
         logger.debug(f"Final merged graph keys: {list(final_graph_data.keys())}")
-        
+
         # 4. 使用 Pydantic 模型进行验证
         try:
             validated_collection = GraphCollection.model_validate(final_graph_data)
@@ -42,4 +106,12 @@ class GraphResolver:
             logger.error(f"Failed to validate the final merged graph collection: {e}")
             raise ValueError(f"Invalid graph structure after merging Lore and Moment. Error: {e}")
 
-        return validated_collection
\ No newline at end of file
+        self._cache[cache_key] = validated_collection
+        if len(self._cache) > self._max_cache_size:
+            self._cache.popitem(last=False)
+
+        return validated_collection
+
+    def clear(self):
+        self._cache.clear()
+        self._by_identity.clear()
@@ -0,0 +1,64 @@
+# plugins/core_engine/graph_run.py
+
+from enum import Enum, auto
+from typing import Dict, Any, Set, List, Optional
+
+from .contracts import GraphDefinition, GenericNode, ExecutionContext
+from .execution_plan import ExecutionPlan
+
+class NodeState(Enum):
+    PENDING = auto()
+    READY = auto()
+    RUNNING = auto()
+    SUCCEEDED = auto()
+    FAILED = auto()
+    SKIPPED = auto()
+
+class GraphRun:
+    def __init__(self, context: ExecutionContext, graph_def: GraphDefinition, plan: ExecutionPlan):
+        self.context = context
+        self.graph_def = graph_def
+        if not self.graph_def:
+            raise ValueError("GraphRun must be initialized with a valid GraphDefinition.")
+        
+        # 结构信息全部来自（可能被缓存共享的）执行计划，这里只持有本次运行的可变状态
+        self.plan = plan
+        self.dependencies = plan.dependencies
+        self.node_map: Dict[str, GenericNode] = plan.node_map
+        self.subscribers: Dict[str, Set[str]] = plan.subscribers
+        self.node_states: Dict[str, NodeState] = {}
+        # 节点的调度优先级（剩余关键路径长度），越大越先执行；为 None 时按就绪顺序执行
+        self.priorities: Optional[Dict[str, float]] = None
+        # 仅在 step() 的主图运行中设置，用于复用上一个快照中输入未变的节点结果
+        self.memo = None
+        # 仅在 step() 的主图运行中设置，实时接收节点执行事件（见 StepEventSink）
+        self.event_sink = None
+        self._initialize_node_states()
+
+    def _initialize_node_states(self):
+        self.node_states = dict.fromkeys(self.node_map, NodeState.PENDING)
+        for node_id in self.plan.entry_nodes:
+            self.node_states[node_id] = NodeState.READY
+
+    def get_node(self, node_id: str) -> GenericNode:
+        return self.node_map[node_id]
+    def get_node_state(self, node_id: str) -> NodeState:
+        return self.node_states.get(node_id)
+    def set_node_state(self, node_id: str, state: NodeState):
+        self.node_states[node_id] = state
+    def get_node_result(self, node_id: str) -> Dict[str, Any]:
+        return self.context.node_states.get(node_id)
+    def set_node_result(self, node_id: str, result: Dict[str, Any]):
+        self.context.node_states[node_id] = result
+    def get_priority(self, node_id: str) -> float:
+        return self.priorities.get(node_id, 0.0) if self.priorities else 0.0
+    def get_nodes_in_state(self, state: NodeState) -> List[str]:
+        return [nid for nid, s in self.node_states.items() if s == state]
+    def get_dependencies(self, node_id: str) -> Set[str]:
+        return self.dependencies.get(node_id, set())
+    def get_subscribers(self, node_id: str) -> Set[str]:
+        return self.subscribers.get(node_id, set())
+    def get_execution_context(self) -> ExecutionContext:
+        return self.context
+    def get_final_node_states(self) -> Dict[str, Any]:
+        return self.context.node_states
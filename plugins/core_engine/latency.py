@@ -0,0 +1,76 @@
+# plugins/core_engine/latency.py
+
+import logging
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from .contracts import GenericNode
+from .execution_plan import ExecutionPlan
+
+logger = logging.getLogger(__name__)
+
+
+class NodeLatencyTracker:
+    """
+    为节点维护滚动的执行耗时估计（指数加权移动平均），并据此计算关键路径优先级。
+
+    估计按两级键记录：
+    - (图指纹, 节点 ID)：同一个图中同一个节点的历史耗时，最精确；
+    - 运行时签名（节点 run 列表中的运行时名称序列）：用于从未执行过的节点，
+      例如新编辑的图中一个普通的 llm.default 节点会继承其他 LLM 节点的耗时估计。
+    两者都没有时，使用所有已知节点估计的均值；完全没有历史时每个节点的代价为 1，
+    此时优先级退化为纯拓扑的“剩余最长链长度”。
+    """
+    def __init__(self, alpha: float = 0.3, max_entries: int = 4096):
+        self.alpha = alpha
+        self.max_entries = max_entries
+        self._node_estimates: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self._signature_estimates: "OrderedDict[Tuple[str, ...], float]" = OrderedDict()
+
+    @staticmethod
+    def _signature(node: GenericNode) -> Tuple[str, ...]:
+        return tuple(instruction.runtime for instruction in node.run)
+
+    def _update(self, table: OrderedDict, key, duration: float):
+        previous = table.get(key)
+        table[key] = duration if previous is None else previous + self.alpha * (duration - previous)
+        table.move_to_end(key)
+        if len(table) > self.max_entries:
+            table.popitem(last=False)
+
+    def record(self, plan_fingerprint: str, node: GenericNode, duration: float):
+        """记录一次节点执行的耗时（秒）。"""
+        self._update(self._node_estimates, (plan_fingerprint, node.id), duration)
+        self._update(self._signature_estimates, self._signature(node), duration)
+
+    def estimate(self, plan_fingerprint: str, node: GenericNode, default: Optional[float] = None) -> float:
+        estimate = self._node_estimates.get((plan_fingerprint, node.id))
+        if estimate is None:
+            estimate = self._signature_estimates.get(self._signature(node))
+        if estimate is None:
+            estimate = default if default is not None else self._default_cost()
+        return estimate
+
+    def _default_cost(self) -> float:
+        if not self._node_estimates:
+            return 1.0
+        return sum(self._node_estimates.values()) / len(self._node_estimates)
+
+    def critical_path_priorities(self, plan: ExecutionPlan) -> Dict[str, float]:
+        """
+        计算每个节点的剩余关键路径长度：节点自身的估计耗时加上其下游最长链的耗时。
+        按拓扑序的逆序计算，每条边只访问一次。
+        """
+        default = self._default_cost()
+        priorities: Dict[str, float] = {}
+        for node_id in reversed(plan.topological_order):
+            downstream = max(
+                (priorities[sub_id] for sub_id in plan.subscribers.get(node_id, ()) if sub_id in priorities),
+                default=0.0
+            )
+            priorities[node_id] = self.estimate(plan.fingerprint, plan.node_map[node_id], default) + downstream
+        return priorities
+
+    def clear(self):
+        self._node_estimates.clear()
+        self._signature_estimates.clear()
@@ -0,0 +1,77 @@
+# plugins/core_engine/macro_cache.py
+
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Generic, Optional, TypeVar
+
+T = TypeVar("T")
+
+_MISSING = object()
+
+
+class MacroCodeCache(Generic[T]):
+    """
+    以宏源码为键的有界 LRU 缓存，存放编译后的宏。
+    同时受条目数和源码总字节数约束（编译产物的大小与源码长度大致成正比），
+    超长的源码不会被缓存，以免一个巨型宏挤掉大量常用的小宏。
+    """
+    def __init__(self, max_entries: int = 4096, max_bytes: int = 8 * 1024 * 1024, max_source_bytes: int = 64 * 1024):
+        self._entries: "OrderedDict[str, T]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.configure(max_entries, max_bytes, max_source_bytes)
+
+    def configure(self, max_entries: int, max_bytes: int, max_source_bytes: Optional[int] = None):
+        """调整上限；0 表示关闭缓存。"""
+        self.max_entries = max(max_entries, 0)
+        self.max_bytes = max(max_bytes, 0)
+        if max_source_bytes is not None:
+            self.max_source_bytes = max_source_bytes
+        if self._entries:
+            self._evict()
+
+    def get_or_compile(self, source: str, compile_fn: Callable[[str], T]) -> T:
+        entry = self._entries.get(source, _MISSING)
+        if entry is not _MISSING:
+            self._entries.move_to_end(source)
+            self.hits += 1
+            return entry
+
+        self.misses += 1
+        entry = compile_fn(source)
+        size = len(source.encode("utf-8"))
+        if self.max_entries and size <= min(self.max_source_bytes, self.max_bytes):
+            self._entries[source] = entry
+            self._sizes[source] = size
+            self.current_bytes += size
+            self._evict()
+        return entry
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries or self.current_bytes > self.max_bytes):
+            source, _ = self._entries.popitem(last=False)
+            self.current_bytes -= self._sizes.pop(source)
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+        self._sizes.clear()
+        self.current_bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.current_bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+        }
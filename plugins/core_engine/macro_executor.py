@@ -0,0 +1,239 @@
+# plugins/core_engine/macro_executor.py
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from types import CodeType, ModuleType
+from typing import Any, Dict, Optional, Set, Tuple
+
+from backend.core.utils import unwrap_dot_accessible_dicts
+
+logger = logging.getLogger(__name__)
+
+# 宏的结果变量：最后一行表达式会被改写为对它的赋值
+MACRO_RESULT_VAR = "_macro_result"
+
+MACRO_EXECUTION_MODES = ("inline", "thread", "process")
+
+# 实测耗时的指数滑动平均系数
+_COST_SMOOTHING = 0.2
+# pickle.dumps 遇到无法序列化的对象时抛出的异常。只用于包裹序列化本身，宏执行中抛出的同类异常照常传播
+_PICKLING_ERRORS = (pickle.PicklingError, TypeError, AttributeError)
+
+
+class _NotPicklable(Exception):
+    """作用域无法序列化到工作进程，或宏的结果无法序列化回主进程。纯宏没有副作用，可以回退到线程池重新执行。"""
+
+
+def _timed_exec(code: CodeType, namespace: Dict[str, Any], submitted_at: float) -> Tuple[float, float]:
+    """执行宏并返回 (排队耗时, 执行耗时)，单位毫秒。"""
+    started_at = time.perf_counter()
+    exec(code, namespace)
+    return (started_at - submitted_at) * 1000, (time.perf_counter() - started_at) * 1000
+
+
+def _run_pure_macro(source: str, scopes_payload: bytes, submitted_at: float) -> Tuple[float, bytes]:
+    """
+    在工作进程中执行纯读取的宏，返回 (排队耗时毫秒, 序列化后的结果)。
+    作用域由主进程预先序列化为普通 dict，在这里重新包装以支持点符号访问；跨进程计时使用墙上时钟。
+    结果也在这里序列化，以便区分“结果无法传回”和宏本身抛出的异常。
+    """
+    queue_wait_ms = (time.time() - submitted_at) * 1000
+    from backend.core.utils import DotAccessibleDict
+    from .evaluation import PRE_IMPORTED_MODULES, compile_macro, macro_code_cache
+
+    compiled = macro_code_cache.get_or_compile(source, compile_macro)
+    namespace = dict(PRE_IMPORTED_MODULES)
+    for name, value in pickle.loads(scopes_payload).items():
+        namespace[name] = DotAccessibleDict(value) if isinstance(value, dict) else value
+    exec(compiled.code, namespace)
+    try:
+        result_payload = pickle.dumps(namespace.get(MACRO_RESULT_VAR))
+    except _PICKLING_ERRORS as e:
+        raise _NotPicklable(str(e)) from None
+    return queue_wait_ms, result_payload
+
+
+def _referenced_names(code: CodeType) -> Set[str]:
+    """代码对象（包括其中的推导式、lambda 等嵌套代码）引用的全部名称。"""
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, CodeType):
+            names |= _referenced_names(const)
+    return names
+
+
+class _PoolStats:
+    """一个执行器池的排队统计。"""
+    __slots__ = ("max_workers", "submitted", "in_flight", "peak_queue_depth", "queue_wait_ms")
+
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self.submitted = 0
+        self.in_flight = 0
+        self.peak_queue_depth = 0
+        self.queue_wait_ms = 0.0
+
+    @property
+    def queue_depth(self) -> int:
+        return max(self.in_flight - self.max_workers, 0)
+
+    def enter(self):
+        self.submitted += 1
+        self.in_flight += 1
+        self.peak_queue_depth = max(self.peak_queue_depth, self.queue_depth)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "max_workers": self.max_workers,
+            "submitted": self.submitted,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "peak_queue_depth": self.peak_queue_depth,
+            "avg_queue_wait_ms": round(self.queue_wait_ms / self.submitted, 3) if self.submitted else None,
+        }
+
+
+class MacroExecutor:
+    """
+    决定一段需要 exec 的宏在哪里执行。不再使用事件循环的默认线程池：
+    它与 aiofiles、asyncio.to_thread 的持久化 I/O 共用，宏和磁盘写入会互相拖慢。
+    - inline:  实测耗时低于阈值的宏直接在事件循环上执行，省去线程往返；其余（以及首次执行、尚无测量值的宏）进入专用线程池；
+    - thread:  全部进入专用的有界线程池；
+    - process: 纯读取的宏（MacroAccess.is_pure）进入进程池，绕开 GIL；其余进入专用线程池。
+      进程池只接收宏实际引用的作用域数据；作用域或结果无法序列化、或进程池损坏时回退到线程池，
+      宏自身抛出的异常照常传播，不会重新执行。
+    """
+    def __init__(self, mode: str = "inline", max_threads: int = 0, max_processes: int = 0,
+                 inline_threshold_ms: float = 0.5):
+        self._thread_pool: Optional[ThreadPoolExecutor] = None
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+        self.inline_runs = 0
+        self.thread_runs = 0
+        self.process_runs = 0
+        self.process_fallbacks = 0
+        self.configure(mode, max_threads, max_processes, inline_threshold_ms)
+
+    def configure(self, mode: str, max_threads: int = 0, max_processes: int = 0, inline_threshold_ms: float = 0.5):
+        """调整执行方式与池大小（0 表示按 CPU 数自动确定）；已创建的池会被关闭并按需重建。"""
+        if mode not in MACRO_EXECUTION_MODES:
+            raise ValueError(f"Unknown macro execution mode '{mode}'. Expected one of: {', '.join(MACRO_EXECUTION_MODES)}.")
+        self.shutdown()
+        cpus = os.cpu_count() or 1
+        self.mode = mode
+        self.max_threads = max_threads or min(32, cpus + 4)
+        self.max_processes = max_processes or cpus
+        self.inline_threshold_ms = max(inline_threshold_ms, 0.0)
+        self._thread_stats = _PoolStats(self.max_threads)
+        self._process_stats = _PoolStats(self.max_processes)
+
+    async def run(self, compiled: Any, source: str, namespace: Dict[str, Any]) -> Any:
+        """执行编译后的宏（CompiledMacro）并返回结果变量的值。调用方负责在此之前获取宏锁。"""
+        if self.mode == "process" and compiled.access.is_pure:
+            try:
+                return await self._run_in_process(compiled, source, namespace)
+            except _NotPicklable:
+                self.process_fallbacks += 1
+            except BrokenProcessPool:
+                logger.warning("Macro process pool is broken; recreating it on next use.")
+                self._process_pool = None
+                self.process_fallbacks += 1
+        elif self.mode == "inline" and compiled.cost_ms is not None and compiled.cost_ms < self.inline_threshold_ms:
+            self.inline_runs += 1
+            started_at = time.perf_counter()
+            try:
+                exec(compiled.code, namespace)
+            finally:
+                self._record_cost(compiled, (time.perf_counter() - started_at) * 1000)
+            return namespace.get(MACRO_RESULT_VAR)
+
+        await self._run_in_thread(compiled, namespace)
+        return namespace.get(MACRO_RESULT_VAR)
+
+    async def _run_in_thread(self, compiled: Any, namespace: Dict[str, Any]):
+        if self._thread_pool is None:
+            self._thread_pool = ThreadPoolExecutor(max_workers=self.max_threads, thread_name_prefix="hevno-macro")
+        stats = self._thread_stats
+        stats.enter()
+        self.thread_runs += 1
+        try:
+            queue_wait_ms, cost_ms = await asyncio.get_running_loop().run_in_executor(
+                self._thread_pool, _timed_exec, compiled.code, namespace, time.perf_counter()
+            )
+        finally:
+            stats.in_flight -= 1
+        stats.queue_wait_ms += queue_wait_ms
+        self._record_cost(compiled, cost_ms)
+
+    async def _run_in_process(self, compiled: Any, source: str, namespace: Dict[str, Any]) -> Any:
+        # 在提交之前序列化作用域：工作进程中抛出的任何异常都来自宏本身
+        try:
+            scopes_payload = pickle.dumps(self._collect_scopes(compiled, namespace))
+        except _PICKLING_ERRORS as e:
+            raise _NotPicklable(str(e)) from None
+        if self._process_pool is None:
+            # spawn：不要在持有事件循环和线程池的进程里 fork
+            self._process_pool = ProcessPoolExecutor(
+                max_workers=self.max_processes, mp_context=multiprocessing.get_context("spawn")
+            )
+        stats = self._process_stats
+        stats.enter()
+        try:
+            queue_wait_ms, result_payload = await asyncio.get_running_loop().run_in_executor(
+                self._process_pool, _run_pure_macro, source, scopes_payload, time.time()
+            )
+        finally:
+            stats.in_flight -= 1
+        self.process_runs += 1
+        stats.queue_wait_ms += max(queue_wait_ms, 0.0)
+        return pickle.loads(result_payload)
+
+    @staticmethod
+    def _collect_scopes(compiled: Any, namespace: Dict[str, Any]) -> Dict[str, Any]:
+        """只序列化宏引用到的名称；对于能确定顶层键的作用域，只传递这些键。"""
+        keys_by_scope: Dict[str, Set[Optional[str]]] = {}
+        for scope, key in compiled.access.reads:
+            keys_by_scope.setdefault(scope, set()).add(key)
+
+        scopes: Dict[str, Any] = {}
+        for name in _referenced_names(compiled.code):
+            if name not in namespace or name == "services":
+                continue
+            if isinstance(namespace[name], ModuleType):
+                continue
+            value = unwrap_dot_accessible_dicts(namespace[name])
+            keys = keys_by_scope.get(name)
+            if isinstance(value, dict) and keys and None not in keys:
+                value = {key: value[key] for key in keys if key in value}
+            scopes[name] = value
+        return scopes
+
+    @staticmethod
+    def _record_cost(compiled: Any, cost_ms: float):
+        previous = compiled.cost_ms
+        compiled.cost_ms = cost_ms if previous is None else previous + _COST_SMOOTHING * (cost_ms - previous)
+
+    def shutdown(self):
+        if self._thread_pool is not None:
+            self._thread_pool.shutdown(wait=False)
+            self._thread_pool = None
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait=False, cancel_futures=True)
+            self._process_pool = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "mode": self.mode,
+            "inline_threshold_ms": self.inline_threshold_ms,
+            "inline_runs": self.inline_runs,
+            "thread_runs": self.thread_runs,
+            "process_runs": self.process_runs,
+            "process_fallbacks": self.process_fallbacks,
+            "thread_pool": self._thread_stats.to_dict(),
+            "process_pool": self._process_stats.to_dict(),
+        }
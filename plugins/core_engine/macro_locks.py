@@ -0,0 +1,257 @@
+# plugins/core_engine/macro_locks.py
+
+import ast
+import asyncio
+import builtins
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, FrozenSet, List, Optional, Set, Tuple, Union
+
+# 需要加锁的共享作用域。锁的粒度是 (作用域, 顶层键)；键为 None 表示整个作用域
+LOCKED_SCOPES = frozenset({"moment", "lore", "definition", "session", "run", "nodes", "pipe"})
+
+# 可以访问任意状态或绕过静态分析的名称：出现即需要独占访问
+_EXCLUSIVE_NAMES = frozenset({"services", "eval", "exec", "globals", "locals", "vars", "__import__", "compile"})
+
+# 不会修改其参数的内置函数：把状态作为参数传给它们只算读取
+_PURE_FUNCTIONS = frozenset({
+    "len", "str", "int", "float", "bool", "repr", "abs", "round", "min", "max", "sum", "any", "all",
+    "sorted", "reversed", "enumerate", "zip", "range", "list", "tuple", "set", "frozenset", "dict",
+    "isinstance", "type", "hash", "format", "ord", "chr", "bin", "hex", "print",
+})
+# 预导入模块中会原地修改参数的函数
+_MUTATING_MODULE_FUNCTIONS = frozenset({("random", "shuffle")})
+_PRE_IMPORTED_MODULE_NAMES = frozenset({"random", "math", "datetime", "json", "re"})
+
+# 作为“读取”使用状态值的父节点类型；其他位置（赋值、迭代、传给未知函数……）都可能产生别名，按写入处理
+_READ_PARENTS = (ast.BinOp, ast.UnaryOp, ast.BoolOp, ast.Compare, ast.FormattedValue, ast.JoinedStr, ast.Expr)
+_DICT_METHODS = frozenset(dir(dict))
+
+LockKey = Tuple[str, Optional[str]]
+
+
+class MacroAccess:
+    """一段宏可能读取和写入的 (作用域, 顶层键) 集合。exclusive 表示无法分析，需要独占所有状态。"""
+    __slots__ = ("reads", "writes", "exclusive")
+
+    def __init__(self, reads: FrozenSet[LockKey] = frozenset(), writes: FrozenSet[LockKey] = frozenset(), exclusive: bool = False):
+        self.reads = reads - writes
+        self.writes = writes
+        self.exclusive = exclusive
+
+    @property
+    def is_pure(self) -> bool:
+        """只读（或根本不访问共享状态）的宏。"""
+        return not self.exclusive and not self.writes
+
+    def conflicts_with(self, other: "MacroAccess") -> bool:
+        if self.exclusive or other.exclusive:
+            return True
+        return (
+            _overlaps(self.writes, other.writes)
+            or _overlaps(self.writes, other.reads)
+            or _overlaps(self.reads, other.writes)
+        )
+
+    def __repr__(self) -> str:
+        if self.exclusive:
+            return "MacroAccess(exclusive)"
+        return f"MacroAccess(reads={sorted(self.reads, key=str)}, writes={sorted(self.writes, key=str)})"
+
+
+EXCLUSIVE_ACCESS = MacroAccess(exclusive=True)
+NO_ACCESS = MacroAccess()
+
+
+def _overlaps(a: FrozenSet[LockKey], b: FrozenSet[LockKey]) -> bool:
+    if not a or not b:
+        return False
+    for scope, key in a:
+        for other_scope, other_key in b:
+            if scope == other_scope and (key is None or other_key is None or key == other_key):
+                return True
+    return False
+
+
+def _local_names(tree: ast.AST) -> Set[str]:
+    """宏中被绑定过的名称（赋值目标、函数参数、推导式变量、import、def/class）。"""
+    names: Set[str] = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and isinstance(node.ctx, (ast.Store, ast.Del)):
+            names.add(node.id)
+        elif isinstance(node, ast.arg):
+            names.add(node.arg)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names.add(node.name)
+        elif isinstance(node, ast.alias):
+            names.add((node.asname or node.name).split(".")[0])
+    return names
+
+
+def _is_pure_call(call: ast.Call) -> bool:
+    func = call.func
+    if isinstance(func, ast.Name):
+        return func.id in _PURE_FUNCTIONS
+    if isinstance(func, ast.Attribute) and isinstance(func.value, ast.Name):
+        module = func.value.id
+        return module in _PRE_IMPORTED_MODULE_NAMES and (module, func.attr) not in _MUTATING_MODULE_FUNCTIONS
+    return False
+
+
+def analyze_macro_access(tree: ast.AST) -> MacroAccess:
+    """
+    静态分析宏对共享作用域的访问。分析是保守的：
+    - `moment.x = ...`、`del lore.y`、`moment.items.append(...)` 等是对 (作用域, 顶层键) 的写入；
+    - 把状态值赋给变量、迭代它或传给未知函数时可能通过别名修改它，同样按写入处理；
+    - 无法确定顶层键时（`moment[k]`、`moment.get(...)`、直接使用 `moment`）锁住整个作用域；
+    - 使用 services/eval/globals 等，或修改无法追溯来源的对象时，需要独占访问。
+    """
+    parents: Dict[ast.AST, ast.AST] = {}
+    for parent in ast.walk(tree):
+        for child in ast.iter_child_nodes(parent):
+            parents[child] = parent
+    local_names = _local_names(tree)
+
+    reads: Set[LockKey] = set()
+    writes: Set[LockKey] = set()
+
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Attribute, ast.Subscript)) and isinstance(node.ctx, (ast.Store, ast.Del)):
+            root = node.value
+            while isinstance(root, (ast.Attribute, ast.Subscript)):
+                root = root.value
+            if not isinstance(root, ast.Name):
+                # 修改一个由表达式求得的对象，无法知道它属于哪个作用域
+                return EXCLUSIVE_ACCESS
+            continue
+
+        if not isinstance(node, ast.Name):
+            continue
+        name = node.id
+        if name in _EXCLUSIVE_NAMES and name not in local_names:
+            return EXCLUSIVE_ACCESS
+
+        # 沿着属性/下标链向外走，得到整条访问链的最外层节点
+        top = node
+        steps: List[ast.AST] = []
+        while True:
+            parent = parents.get(top)
+            if isinstance(parent, (ast.Attribute, ast.Subscript)) and parent.value is top:
+                steps.append(parent)
+                top = parent
+            else:
+                break
+        mutated = _is_mutating_use(top, steps, parents)
+
+        if name in LOCKED_SCOPES:
+            key = _first_key(steps)
+            if isinstance(node.ctx, ast.Load):
+                (writes if mutated else reads).add((name, key))
+        elif name in local_names or name in _PRE_IMPORTED_MODULE_NAMES or hasattr(builtins, name):
+            continue
+        elif mutated and steps:
+            # 通过其他上下文变量（如 map 的 source.item）修改数据：它可能引用任何作用域中的对象
+            return EXCLUSIVE_ACCESS
+
+    return MacroAccess(reads=frozenset(reads), writes=frozenset(writes))
+
+
+def _first_key(steps: List[ast.AST]) -> Optional[str]:
+    if not steps:
+        return None
+    first = steps[0]
+    if isinstance(first, ast.Attribute):
+        return None if first.attr in _DICT_METHODS else first.attr
+    if isinstance(first.slice, ast.Constant) and isinstance(first.slice.value, str):
+        return first.slice.value
+    return None
+
+
+def _is_mutating_use(top: ast.AST, steps: List[ast.AST], parents: Dict[ast.AST, ast.AST]) -> bool:
+    if isinstance(getattr(top, "ctx", None), (ast.Store, ast.Del)):
+        return bool(steps)
+    parent = parents.get(top)
+    if isinstance(parent, ast.Call):
+        if parent.func is top:
+            # 调用状态上的方法（append/update/pop……）
+            return bool(steps)
+        return not _is_pure_call(parent)
+    if isinstance(parent, ast.keyword):
+        call = parents.get(parent)
+        return not (isinstance(call, ast.Call) and _is_pure_call(call))
+    if isinstance(parent, ast.AugAssign):
+        return parent.target is top
+    if isinstance(parent, ast.Subscript) and parent.slice is top:
+        return False
+    if isinstance(parent, (ast.If, ast.While, ast.Assert, ast.IfExp)) and parent.test is top:
+        return False
+    return not isinstance(parent, _READ_PARENTS)
+
+
+class MacroLockManager:
+    """
+    按 (作用域, 顶层键) 加锁的读写锁管理器，替代原先串行化所有宏的全局锁。
+    - 一次性获取宏所需的全部锁（要么全部获得，要么等待），因此不会出现持有部分锁时的死锁；
+    - 互不冲突的访问（只读宏之间、写入不同键的宏之间）并发执行；
+    - 等待者严格按到达顺序放行：与更早的等待者冲突的请求不会插队，写入者不会被持续的读取者饿死。
+    """
+    def __init__(self):
+        self._holders: List[MacroAccess] = []
+        self._waiters: Deque[Tuple[MacroAccess, asyncio.Future]] = deque()
+
+    @asynccontextmanager
+    async def acquire(self, access: MacroAccess) -> AsyncIterator[None]:
+        if not access.exclusive and not access.reads and not access.writes:
+            yield
+            return
+        # 用一个新对象作为持有凭证：同一段宏的多次并发求值共享同一个 MacroAccess
+        token = MacroAccess(access.reads, access.writes, access.exclusive)
+        if not self._waiters and not self._conflicts_with_holders(token):
+            self._holders.append(token)
+        else:
+            future = asyncio.get_running_loop().create_future()
+            entry = (token, future)
+            self._waiters.append(entry)
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # 已被授予但等待者被取消：归还
+                    self._release(token)
+                else:
+                    self._waiters.remove(entry)
+                    self._wake()
+                raise
+        try:
+            yield
+        finally:
+            self._release(token)
+
+    def _conflicts_with_holders(self, access: MacroAccess) -> bool:
+        return any(access.conflicts_with(holder) for holder in self._holders)
+
+    def _release(self, token: MacroAccess):
+        self._holders.remove(token)
+        self._wake()
+
+    def _wake(self):
+        still_waiting: List[MacroAccess] = []
+        remaining: Deque[Tuple[MacroAccess, asyncio.Future]] = deque()
+        for access, future in self._waiters:
+            if future.done():
+                continue
+            blocked = self._conflicts_with_holders(access) or any(access.conflicts_with(w) for w in still_waiting)
+            if blocked:
+                still_waiting.append(access)
+                remaining.append((access, future))
+            else:
+                self._holders.append(access)
+                future.set_result(None)
+        self._waiters = remaining
+
+    def get_stats(self) -> Dict[str, int]:
+        return {"holders": len(self._holders), "waiters": len(self._waiters)}
+
+
+# 宏求值函数接受的锁：MacroLockManager 按访问集合加锁；普通 asyncio.Lock 则串行化所有宏
+MacroLock = Union[MacroLockManager, asyncio.Lock]
@@ -0,0 +1,108 @@
+# plugins/core_engine/macro_stats.py
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+
+# 当前正在求值的宏来自哪里："node:<节点ID>" 或 "codex:<法典名>/<条目ID>"。
+# 引擎在执行节点时设置，codex.invoke 在求值单个条目时覆盖；节点任务和子图任务会继承它
+_current_origin: ContextVar[Optional[str]] = ContextVar("hevno_macro_origin", default=None)
+
+SORT_FIELDS = ("total_ms", "max_ms", "avg_ms", "calls", "lock_wait_ms", "exec_ms")
+# 每个宏最多记录的来源数量
+_MAX_ORIGINS = 16
+_SOURCE_PREVIEW_CHARS = 200
+
+
+def get_macro_origin() -> Optional[str]:
+    return _current_origin.get()
+
+
+@contextmanager
+def macro_origin(origin: str) -> Iterator[None]:
+    """在当前上下文中标记后续宏求值的来源。"""
+    token = _current_origin.set(origin)
+    try:
+        yield
+    finally:
+        _current_origin.reset(token)
+
+
+class _MacroStat:
+    __slots__ = ("calls", "errors", "total_ms", "max_ms", "lock_wait_ms", "exec_ms", "origins")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.lock_wait_ms = 0.0
+        self.exec_ms = 0.0
+        self.origins: Dict[str, int] = {}
+
+
+class MacroStatsCollector:
+    """
+    按宏源码汇总求值开销：调用次数、总耗时与最大耗时、等待宏锁的时间、在执行器中的时间，以及宏来自哪些节点或 codex 条目。
+    默认关闭；关闭时求值路径上只多一次属性检查。
+    所有记录都发生在事件循环线程上，不需要加锁。跟踪的宏数量有上限，超出后新的宏只计入 dropped。
+    """
+    def __init__(self, enabled: bool = False, max_entries: int = 2048):
+        self.enabled = enabled
+        self.max_entries = max_entries
+        self._stats: Dict[str, _MacroStat] = {}
+        self.dropped = 0
+
+    def record(self, source: str, origin: Optional[str], total_ms: float,
+               lock_wait_ms: float = 0.0, exec_ms: float = 0.0, failed: bool = False):
+        stat = self._stats.get(source)
+        if stat is None:
+            if len(self._stats) >= self.max_entries:
+                self.dropped += 1
+                return
+            stat = self._stats[source] = _MacroStat()
+        stat.calls += 1
+        stat.errors += failed
+        stat.total_ms += total_ms
+        stat.max_ms = max(stat.max_ms, total_ms)
+        stat.lock_wait_ms += lock_wait_ms
+        stat.exec_ms += exec_ms
+        if origin is not None and (origin in stat.origins or len(stat.origins) < _MAX_ORIGINS):
+            stat.origins[origin] = stat.origins.get(origin, 0) + 1
+
+    def top(self, n: int = 20, sort_by: str = "total_ms") -> List[Dict[str, Any]]:
+        """按指定字段降序返回开销最大的 n 个宏。"""
+        if sort_by not in SORT_FIELDS:
+            raise ValueError(f"Unknown sort field '{sort_by}'. Expected one of: {', '.join(SORT_FIELDS)}.")
+        rows = [self._to_dict(source, stat) for source, stat in self._stats.items()]
+        rows.sort(key=lambda row: row[sort_by], reverse=True)
+        return rows[:max(n, 0)]
+
+    @staticmethod
+    def _to_dict(source: str, stat: _MacroStat) -> Dict[str, Any]:
+        origins = sorted(stat.origins.items(), key=lambda item: item[1], reverse=True)
+        return {
+            "source": source if len(source) <= _SOURCE_PREVIEW_CHARS else source[:_SOURCE_PREVIEW_CHARS] + "...",
+            "calls": stat.calls,
+            "errors": stat.errors,
+            "total_ms": round(stat.total_ms, 3),
+            "avg_ms": round(stat.total_ms / stat.calls, 3) if stat.calls else 0.0,
+            "max_ms": round(stat.max_ms, 3),
+            "lock_wait_ms": round(stat.lock_wait_ms, 3),
+            "exec_ms": round(stat.exec_ms, 3),
+            "origins": [{"origin": origin, "calls": calls} for origin, calls in origins],
+        }
+
+    def reset(self):
+        self._stats.clear()
+        self.dropped = 0
+
+    def get_stats(self, top_n: int = 10) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "tracked_macros": len(self._stats),
+            "dropped": self.dropped,
+            "total_calls": sum(stat.calls for stat in self._stats.values()),
+            "total_ms": round(sum(stat.total_ms for stat in self._stats.values()), 3),
+            "top": self.top(top_n),
+        }
@@ -0,0 +1,47 @@
+# plugins/core_engine/macro_stats_api.py
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from pydantic import BaseModel
+
+from backend.core.dependencies import Service
+from .macro_stats import MacroStatsCollector, SORT_FIELDS
+
+macro_stats_router = APIRouter(
+    prefix="/api/system/macros",
+    tags=["System", "Diagnostics"]
+)
+
+
+class MacroStatsToggle(BaseModel):
+    enabled: bool
+
+
+@macro_stats_router.get("/top", summary="Get the most expensive macros")
+async def get_top_macros(
+    n: int = Query(20, ge=1, le=500, description="返回的宏数量"),
+    sort_by: str = Query("total_ms", description=f"排序字段：{', '.join(SORT_FIELDS)}"),
+    stats: MacroStatsCollector = Depends(Service("macro_stats"))
+):
+    """按开销返回前 N 个宏，每个宏附带它来自的节点或 codex 条目。"""
+    try:
+        macros = stats.top(n, sort_by)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"enabled": stats.enabled, "sort_by": sort_by, "macros": macros}
+
+
+@macro_stats_router.put("/stats", summary="Enable or disable macro hot-spot stats")
+async def set_macro_stats_enabled(
+    toggle: MacroStatsToggle,
+    stats: MacroStatsCollector = Depends(Service("macro_stats"))
+):
+    stats.enabled = toggle.enabled
+    return {"enabled": stats.enabled}
+
+
+@macro_stats_router.delete("/stats", summary="Reset macro hot-spot stats")
+async def reset_macro_stats(
+    stats: MacroStatsCollector = Depends(Service("macro_stats"))
+):
+    stats.reset()
+    return {"enabled": stats.enabled, "tracked_macros": 0}
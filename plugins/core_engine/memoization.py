@@ -0,0 +1,205 @@
+# plugins/core_engine/memoization.py
+
+import hashlib
+import json
+import logging
+import re
+from copy import deepcopy
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from .contracts import ExecutionContext, GenericNode, GraphDefinition, StateSnapshot
+from .evaluation import INLINE_MACRO_REGEX
+from .execution_plan import ExecutionPlan
+from .registry import RuntimeRegistry
+
+logger = logging.getLogger(__name__)
+
+# 宏中可被静态追踪的只读作用域
+_TRACKED_SCOPES = ("lore", "moment", "definition", "session", "run")
+_READ_PATH_REGEX = re.compile(
+    r"(?<![\w.])(" + "|".join(_TRACKED_SCOPES) + r")((?:\s*\.\s*[A-Za-z_]\w*)*)"
+)
+# 出现这些名称的宏被视为非确定性的（随机数、当前时间、任意服务调用），所在节点不做记忆化
+_NON_DETERMINISTIC_REGEX = re.compile(r"(?<![\w.])(random|datetime|services)\b")
+
+_MISSING = "<missing>"
+
+ReadPath = Tuple[str, Tuple[str, ...]]
+
+
+def is_memoization_requested(node: GenericNode, graph_def: GraphDefinition) -> bool:
+    """节点的 metadata.memoize 优先于图的 metadata.memoize；两者默认都关闭。"""
+    if "memoize" in node.metadata:
+        return bool(node.metadata["memoize"])
+    return bool(graph_def.metadata.get("memoize", False))
+
+
+def _iter_macro_sources(data: Any) -> Iterable[str]:
+    """遍历任意嵌套数据中所有字符串里的 {{ ... }} 宏代码。"""
+    if isinstance(data, str):
+        if "{{" in data:
+            for match in INLINE_MACRO_REGEX.finditer(data):
+                yield match.group(1)
+    elif isinstance(data, dict):
+        for value in data.values():
+            yield from _iter_macro_sources(value)
+    elif isinstance(data, (list, tuple)):
+        for item in data:
+            yield from _iter_macro_sources(item)
+
+
+def extract_macro_reads(data: Any) -> Tuple[Set[ReadPath], bool]:
+    """
+    静态提取宏代码读取的状态路径，例如 `moment.player.hp` -> ("moment", ("player", "hp"))。
+    返回 (读取路径集合, 是否确定性)。提取是保守的：无法静态确定的访问
+    （下标、方法调用、把作用域赋给变量等）在解析时会退化为读取已知前缀的整棵子树。
+    """
+    reads: Set[ReadPath] = set()
+    deterministic = True
+    for code in _iter_macro_sources(data):
+        if _NON_DETERMINISTIC_REGEX.search(code):
+            deterministic = False
+        for match in _READ_PATH_REGEX.finditer(code):
+            path = tuple(part.strip() for part in match.group(2).split(".") if part.strip())
+            reads.add((match.group(1), path))
+    return reads, deterministic
+
+
+def _parse_declared_read(declared: str) -> ReadPath:
+    scope, *path = declared.split(".")
+    return scope, tuple(path)
+
+
+def _resolve_read(roots: Dict[str, Any], read: ReadPath) -> Any:
+    scope, path = read
+    value = roots.get(scope)
+    for key in path:
+        if isinstance(value, dict):
+            if key in value:
+                value = value[key]
+                continue
+            if hasattr(dict, key):
+                # 字典方法（如 .get/.items）：无法知道具体读取了哪些键，使用整个子树
+                break
+            return _MISSING
+        break
+    return value
+
+
+def _digest(payload: Any) -> str:
+    encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=repr, separators=(",", ":"))
+    return hashlib.blake2b(encoded.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class NodeReadSpec:
+    """一个节点的静态读取分析结果，按执行计划缓存。"""
+    def __init__(self, node_digest: str, reads: Set[ReadPath], declared_reads: Set[ReadPath], memoizable: bool, reason: str = ""):
+        self.node_digest = node_digest
+        self.reads = reads
+        self.declared_reads = declared_reads
+        self.memoizable = memoizable
+        self.reason = reason
+
+
+class NodeMemoizer:
+    """
+    计算节点的输入指纹。指纹由以下部分组成：
+    - 节点定义本身（所有指令的配置模板）；
+    - 上游依赖节点的结果；
+    - 宏静态读取的 lore/moment/definition/session/run 路径上的当前值；
+    - 运行时通过 get_dependency_config() 的 `state_reads` 声明的隐式读取
+      （其中值内嵌的宏所读取的路径也会被递归纳入）。
+
+    在宏是纯函数的前提下，这些输入唯一决定了节点求值后的配置，
+    因此无需预先求值（那会让有副作用的宏执行两次）即可判断节点能否复用上一步的结果。
+    运行时可以声明 `memoizable: False` 来禁止记忆化（例如会写入状态或执行子图的运行时）。
+    """
+    def __init__(self, registry: RuntimeRegistry, max_specs: int = 1024):
+        self._registry = registry
+        self._max_specs = max_specs
+        self._specs: Dict[Tuple[str, str], NodeReadSpec] = {}
+
+    def get_read_spec(self, plan: ExecutionPlan, node: GenericNode) -> NodeReadSpec:
+        key = (plan.fingerprint, node.id)
+        spec = self._specs.get(key)
+        if spec is None:
+            spec = self._analyze(plan, node)
+            if len(self._specs) >= self._max_specs:
+                self._specs.clear()
+            self._specs[key] = spec
+        return spec
+
+    def _analyze(self, plan: ExecutionPlan, node: GenericNode) -> NodeReadSpec:
+        node_digest = _digest(node.model_dump(mode="json"))
+        reads, deterministic = extract_macro_reads([instruction.config for instruction in node.run])
+        if not deterministic:
+            return NodeReadSpec(node_digest, reads, set(), False, "macros use random/datetime/services")
+
+        declared: Set[ReadPath] = set()
+        for i, instruction in enumerate(node.run):
+            runtime_class = plan.get_runtime_class(node.id, i)
+            if runtime_class is None:
+                return NodeReadSpec(node_digest, reads, declared, False, f"runtime '{instruction.runtime}' not found")
+            dep_config = runtime_class.get_dependency_config()
+            if not dep_config.get("memoizable", True):
+                return NodeReadSpec(node_digest, reads, declared, False, f"runtime '{instruction.runtime}' is not memoizable")
+            declared.update(_parse_declared_read(path) for path in dep_config.get("state_reads", []))
+        return NodeReadSpec(node_digest, reads, declared, True)
+
+    def fingerprint(self, plan: ExecutionPlan, node: GenericNode, context: ExecutionContext) -> Optional[str]:
+        """返回节点当前输入的指纹；节点不可记忆化时返回 None。"""
+        spec = self.get_read_spec(plan, node)
+        if not spec.memoizable:
+            logger.debug(f"Node '{node.id}' requested memoization but is not memoizable: {spec.reason}.")
+            return None
+
+        roots = {
+            "lore": context.shared.lore_state,
+            "moment": context.shared.moment_state,
+            "definition": context.shared.definition_state,
+            "session": context.shared.session_info,
+            "run": {k: v for k, v in context.run_vars.items() if k != "diagnostics_log"},
+        }
+        read_values: Dict[str, Any] = {}
+        pending: List[Tuple[ReadPath, bool]] = [(read, False) for read in spec.reads]
+        pending.extend((read, True) for read in spec.declared_reads)
+        seen: Set[ReadPath] = set()
+        while pending:
+            read, scan_nested = pending.pop()
+            if read in seen:
+                continue
+            seen.add(read)
+            value = _resolve_read(roots, read)
+            read_values[".".join((read[0],) + read[1])] = value
+            if scan_nested:
+                # 运行时隐式读取的数据（如知识库条目）中可能内嵌宏，它们读取的路径同样是输入
+                nested_reads, deterministic = extract_macro_reads(value)
+                if not deterministic:
+                    return None
+                pending.extend((nested, True) for nested in nested_reads)
+
+        upstream = {dep_id: context.node_states.get(dep_id) for dep_id in sorted(plan.dependencies.get(node.id, ()))}
+        return _digest([spec.node_digest, upstream, read_values])
+
+
+class StepMemo:
+    """
+    一次 step 内的记忆化记录：持有上一个快照的输出与指纹，并收集本次执行的指纹。
+    """
+    def __init__(self, previous_snapshot: StateSnapshot):
+        self._previous_output: Dict[str, Any] = previous_snapshot.run_output or {}
+        self._previous_fingerprints: Dict[str, str] = previous_snapshot.memo_fingerprints or {}
+        self.fingerprints: Dict[str, str] = {}
+        self.reused: List[str] = []
+
+    def lookup(self, node_id: str, fingerprint: str) -> Optional[Dict[str, Any]]:
+        if self._previous_fingerprints.get(node_id) != fingerprint:
+            return None
+        previous = self._previous_output.get(node_id)
+        if not isinstance(previous, dict) or "error" in previous:
+            return None
+        self.reused.append(node_id)
+        return deepcopy(previous)
+
+    def record(self, node_id: str, fingerprint: str):
+        self.fingerprints[node_id] = fingerprint
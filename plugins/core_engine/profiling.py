@@ -0,0 +1,88 @@
+# plugins/core_engine/profiling.py
+
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+
+from .contracts import ProfileSpan, StepProfile
+
+# 当前 step 的分析器。节点任务与子图任务在创建时复制上下文，因此会自动继承它
+_current_profiler: ContextVar[Optional["StepProfiler"]] = ContextVar("hevno_step_profiler", default=None)
+
+
+class StepProfiler:
+    """
+    记录一次 step 的耗时区间（span）。所有时间都相对于分析器创建的时刻，
+    因此 API 层在入队前创建分析器，排队等待也能出现在同一条时间线上。
+    """
+    def __init__(self):
+        self._origin = time.perf_counter()
+        self._spans: List[Dict[str, Any]] = []
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self._origin) * 1000
+
+    def record(self, name: str, category: str, start_ms: float, duration_ms: float, **attrs: Any):
+        self._spans.append({
+            "name": name, "category": category,
+            "start_ms": start_ms, "duration_ms": duration_ms, **attrs
+        })
+
+    @contextmanager
+    def span(self, name: str, category: str, **attrs: Any) -> Iterator[None]:
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            finished_at = time.perf_counter()
+            self.record(
+                name, category,
+                start_ms=(started_at - self._origin) * 1000,
+                duration_ms=(finished_at - started_at) * 1000,
+                **attrs
+            )
+
+    def timeline(self) -> StepProfile:
+        spans = sorted(self._spans, key=lambda s: s["start_ms"])
+        # 按节点汇总各类别的耗时；节点自身的 span 包含了其中的各个阶段
+        nodes: Dict[str, Dict[str, float]] = {}
+        for s in spans:
+            node_id = s.get("node_id")
+            if node_id is None:
+                continue
+            totals = nodes.setdefault(node_id, {})
+            totals[s["category"]] = round(totals.get(s["category"], 0.0) + s["duration_ms"], 3)
+        return StepProfile(
+            total_ms=round(self.elapsed_ms(), 3),
+            spans=[
+                ProfileSpan(**{**s, "start_ms": round(s["start_ms"], 3), "duration_ms": round(s["duration_ms"], 3)})
+                for s in spans
+            ],
+            nodes=nodes
+        )
+
+
+def get_current_profiler() -> Optional[StepProfiler]:
+    return _current_profiler.get()
+
+
+@contextmanager
+def use_profiler(profiler: Optional[StepProfiler]) -> Iterator[None]:
+    """在当前上下文中激活分析器；profiler 为 None 时关闭分析。"""
+    token = _current_profiler.set(profiler)
+    try:
+        yield
+    finally:
+        _current_profiler.reset(token)
+
+
+@contextmanager
+def profile_span(name: str, category: str, **attrs: Any) -> Iterator[None]:
+    """记录一个 span；未启用分析时几乎没有开销。"""
+    profiler = _current_profiler.get()
+    if profiler is None:
+        yield
+        return
+    with profiler.span(name, category, **attrs):
+        yield
@@ -10,6 +10,8 @@ logger = logging.getLogger(__name__)
 class RuntimeRegistry:
     def __init__(self):
         self._registry: Dict[str, Type[RuntimeInterface]] = {}
+        # 每次注册都会递增，供执行计划缓存判断其中的运行时类是否仍然有效
+        self.version = 0
 
     def register(self, name: str, runtime_class: Type[RuntimeInterface]):
         """
@@ -18,6 +20,7 @@ class RuntimeRegistry:
         if name in self._registry:
             logger.warning(f"Overwriting runtime registration for '{name}'.")
         self._registry[name] = runtime_class
+        self.version += 1
         logger.debug(f"Runtime '{name}' registered to the registry.")
 
     def get_runtime(self, name: str) -> RuntimeInterface:
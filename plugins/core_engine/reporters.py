@@ -0,0 +1,64 @@
+# plugins/core_engine/reporters.py
+from typing import Any, Optional
+from plugins.core_diagnostics.contracts import Reportable
+from .macro_cache import MacroCodeCache
+from .macro_executor import MacroExecutor
+from .macro_stats import MacroStatsCollector
+
+
+class MacroCacheReporter(Reportable):
+    """报告已编译宏缓存（以及模板渲染计划缓存）的容量与命中情况。"""
+
+    def __init__(self, cache: MacroCodeCache, template_cache: Optional[MacroCodeCache] = None):
+        self._cache = cache
+        self._template_cache = template_cache
+
+    @property
+    def report_key(self) -> str:
+        return "macro_cache"
+
+    @property
+    def is_static(self) -> bool:
+        return False
+
+    async def generate_report(self) -> Any:
+        report = self._cache.get_stats()
+        if self._template_cache is not None:
+            report["template_plans"] = self._template_cache.get_stats()
+        return report
+
+
+class MacroExecutorReporter(Reportable):
+    """报告宏执行方式的分布，以及专用线程池/进程池的排队深度。"""
+
+    def __init__(self, executor: MacroExecutor):
+        self._executor = executor
+
+    @property
+    def report_key(self) -> str:
+        return "macro_executor"
+
+    @property
+    def is_static(self) -> bool:
+        return False
+
+    async def generate_report(self) -> Any:
+        return self._executor.get_stats()
+
+
+class MacroStatsReporter(Reportable):
+    """报告宏热点统计的汇总和开销最大的几个宏。"""
+
+    def __init__(self, stats: MacroStatsCollector):
+        self._stats = stats
+
+    @property
+    def report_key(self) -> str:
+        return "macro_stats"
+
+    @property
+    def is_static(self) -> bool:
+        return False
+
+    async def generate_report(self) -> Any:
+        return self._stats.get_stats()
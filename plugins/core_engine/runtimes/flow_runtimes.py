@@ -13,6 +13,7 @@ class ExecuteRuntime(RuntimeInterface):
     system.execute: 对一个字符串形式的宏代码进行二次求值和执行。
     作为宏系统的终极“逃生舱口”。
     """
+    concurrency_class = "macro"
     class ConfigModel(BaseModel):
         code: str = Field(..., description="包含要执行的宏代码的字符串。例如 '{{ moment.player_hp -= 10 }}'。")
 
@@ -20,6 +21,11 @@ class ExecuteRuntime(RuntimeInterface):
     def get_config_model(cls) -> Type[BaseModel]:
         return cls.ConfigModel
 
+    @classmethod
+    def get_dependency_config(cls) -> Dict[str, Any]:
+        # 二次求值的代码在运行时才确定，无法静态分析其读写
+        return {"memoizable": False}
+
     async def execute(
         self, 
         config: Dict[str, Any], 
@@ -35,7 +41,7 @@ class ExecuteRuntime(RuntimeInterface):
                 return {"output": code_to_execute}
 
             eval_context = build_evaluation_context(context, pipe_vars=pipeline_state)
-            lock = context.shared.global_write_lock
+            lock = context.shared.macro_locks
             result = await evaluate_expression(code_to_execute, eval_context, lock)
             return {"output": result}
         except Exception as e:
@@ -45,6 +51,7 @@ class CallRuntime(RuntimeInterface):
     """
     system.flow.call: 调用并执行一个可复用的子图。
     """
+    concurrency_class = None
     class ConfigModel(BaseModel):
         graph: str = Field(..., description="要调用的子图的名称。")
         using: Optional[Dict[str, Any]] = Field(
@@ -56,6 +63,11 @@ class CallRuntime(RuntimeInterface):
     def get_config_model(cls) -> Type[BaseModel]:
         return cls.ConfigModel
 
+    @classmethod
+    def get_dependency_config(cls) -> Dict[str, Any]:
+        # 子图中的节点可能读写任意状态
+        return {"memoizable": False}
+
     async def execute(self, config: Dict[str, Any], context: ExecutionContext, subgraph_runner: Optional[SubGraphRunner] = None, **kwargs) -> Dict[str, Any]:
         try:
             validated_config = self.ConfigModel.model_validate(config)
@@ -82,6 +94,7 @@ class MapRuntime(RuntimeInterface):
     """
     system.flow.map: 对一个列表进行并行迭代，为每个元素执行一次子图。
     """
+    concurrency_class = None
     class ConfigModel(BaseModel):
         list: List[Any] = Field(..., description="要迭代的列表。")
         graph: str = Field(..., description="为每个列表项执行的子图的名称。")
@@ -103,7 +116,8 @@ class MapRuntime(RuntimeInterface):
     @classmethod
     def get_dependency_config(cls) -> Dict[str, Any]:
         return {
-            "ignore_fields": ["using", "collect"]
+            "ignore_fields": ["using", "collect"],
+            "memoizable": False
         }
 
     async def execute(self, config: Dict[str, Any], context: ExecutionContext, subgraph_runner: Optional[SubGraphRunner] = None, **kwargs) -> Dict[str, Any]:
@@ -119,7 +133,7 @@ class MapRuntime(RuntimeInterface):
 
             tasks = []
             base_eval_context = build_evaluation_context(context)
-            lock = context.shared.global_write_lock
+            lock = context.shared.macro_locks
 
             for index, item in enumerate(list_to_iterate):
                 using_eval_context = {
@@ -147,9 +161,8 @@ class MapRuntime(RuntimeInterface):
             if collect_template is not None:
                 collected_outputs = []
                 for result in subgraph_results:
-                    collect_eval_context = build_evaluation_context(context)
-                    collect_eval_context["nodes"] = DotAccessibleDict(result)
-                    
+                    collect_eval_context = {**base_eval_context, "nodes": DotAccessibleDict(result)}
+
                     collected_value = await evaluate_data(collect_template, collect_eval_context, lock)
                     collected_outputs.append(collected_value)
                 
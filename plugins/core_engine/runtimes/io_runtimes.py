@@ -51,6 +51,11 @@ class LogRuntime(RuntimeInterface):
     def get_config_model(cls) -> Type[BaseModel]:
         return cls.ConfigModel
 
+    @classmethod
+    def get_dependency_config(cls) -> Dict[str, Any]:
+        # 每次执行都会向 moment._log_info 追加日志
+        return {"memoizable": False}
+
     async def execute(self, config: Dict[str, Any], context: ExecutionContext, **kwargs) -> Dict[str, Any]:
         try:
             validated_config = self.ConfigModel.model_validate(config)
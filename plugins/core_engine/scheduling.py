@@ -0,0 +1,219 @@
+# plugins/core_engine/scheduling.py
+
+import asyncio
+import heapq
+import itertools
+import logging
+from abc import ABC, abstractmethod
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from .graph_run import GraphRun, NodeState
+
+logger = logging.getLogger(__name__)
+
+# 调度器调用它来真正执行一个节点；返回时节点状态已被设置为 SUCCEEDED 或 FAILED
+NodeExecutor = Callable[[str], Awaitable[None]]
+
+
+def collect_initial_ready(run: GraphRun) -> List[str]:
+    """
+    计算一次运行开始时可以立即执行的节点。
+    PENDING 节点只有在其所有依赖（包括通过 inherited_inputs 注入的图外依赖）都已成功时才就绪。
+    """
+    for node_id, state in run.node_states.items():
+        if state != NodeState.PENDING:
+            continue
+        if all(run.get_node_state(dep_id) == NodeState.SUCCEEDED for dep_id in run.get_dependencies(node_id)):
+            run.set_node_state(node_id, NodeState.READY)
+    return run.get_nodes_in_state(NodeState.READY)
+
+
+def skip_subscribers(failed_node_id: str, run: GraphRun) -> None:
+    """将失败节点的直接下游标记为 SKIPPED。"""
+    for sub_id in run.get_subscribers(failed_node_id):
+        if run.get_node_state(sub_id) != NodeState.PENDING:
+            continue
+        run.set_node_state(sub_id, NodeState.SKIPPED)
+        run.set_node_result(sub_id, {"status": "skipped", "reason": f"Upstream failure of node {failed_node_id}."})
+
+
+def abort_unfinished(run: GraphRun, reason: str) -> List[str]:
+    """
+    在运行被取消（如 step 超过截止时间）后收尾：仍处于 RUNNING 的节点标记为 FAILED，
+    尚未开始的节点标记为 SKIPPED。返回被中断的节点 ID 列表。
+    """
+    interrupted = run.get_nodes_in_state(NodeState.RUNNING)
+    for node_id in interrupted:
+        run.set_node_state(node_id, NodeState.FAILED)
+        run.set_node_result(node_id, {"error": f"Node '{node_id}' was cancelled: {reason}", "cancelled": True})
+    for node_id in run.get_nodes_in_state(NodeState.PENDING) + run.get_nodes_in_state(NodeState.READY):
+        run.set_node_state(node_id, NodeState.SKIPPED)
+        run.set_node_result(node_id, {"status": "skipped", "reason": reason})
+    return interrupted
+
+
+def priority_entry(run: GraphRun, node_id: str, counter: itertools.count) -> Tuple[float, int, str]:
+    """
+    就绪队列中的条目：优先级高（剩余关键路径长）的节点先出队，
+    优先级相同时按就绪顺序出队，因此没有优先级信息时行为与 FIFO 一致。
+    """
+    return (-run.get_priority(node_id), next(counter), node_id)
+
+
+class NodeScheduler(ABC):
+    """定义图内节点调度策略的接口。"""
+    name: str = "abstract"
+
+    @abstractmethod
+    async def run(self, run: GraphRun, ready: List[str], execute_node: NodeExecutor) -> None:
+        """执行所有可达的节点，直到没有节点可以再被调度为止。"""
+        raise NotImplementedError
+
+
+class WorkerPoolScheduler(NodeScheduler):
+    """
+    经典调度器：固定数量的工作者协程从就绪队列中取出节点（按关键路径优先级，其次按就绪顺序）。
+    每个节点完成后，通过检查下游节点的全部依赖来判断其是否就绪。
+    """
+    name = "worker_pool"
+
+    def __init__(self, num_workers: int = 5):
+        self.num_workers = num_workers
+
+    async def run(self, run: GraphRun, ready: List[str], execute_node: NodeExecutor) -> None:
+        task_queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self._counter = itertools.count()
+        for node_id in ready:
+            task_queue.put_nowait(priority_entry(run, node_id, self._counter))
+
+        workers = [
+            asyncio.create_task(self._worker(f"worker-{i}", run, task_queue, execute_node))
+            for i in range(self.num_workers)
+        ]
+        try:
+            await task_queue.join()
+        finally:
+            for w in workers:
+                w.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    async def _worker(self, name: str, run: GraphRun, queue: asyncio.Queue, execute_node: NodeExecutor):
+        while True:
+            try:
+                _, _, node_id = await queue.get()
+            except asyncio.CancelledError:
+                break
+            try:
+                await execute_node(node_id)
+                self._process_subscribers(node_id, run, queue)
+            finally:
+                queue.task_done()
+
+    def _process_subscribers(self, completed_node_id: str, run: GraphRun, queue: asyncio.Queue):
+        completed_node_state = run.get_node_state(completed_node_id)
+        for sub_id in run.get_subscribers(completed_node_id):
+            if run.get_node_state(sub_id) != NodeState.PENDING:
+                continue
+            if completed_node_state == NodeState.FAILED:
+                run.set_node_state(sub_id, NodeState.SKIPPED)
+                run.set_node_result(sub_id, {"status": "skipped", "reason": f"Upstream failure of node {completed_node_id}."})
+                self._process_subscribers(sub_id, run, queue)
+                continue
+            dependencies = run.get_dependencies(sub_id)
+            is_ready = all(
+                (dep_id not in run.node_map) or (run.get_node_state(dep_id) == NodeState.SUCCEEDED)
+                for dep_id in dependencies
+            )
+            if is_ready:
+                run.set_node_state(sub_id, NodeState.READY)
+                queue.put_nowait(priority_entry(run, sub_id, self._counter))
+
+
+class EventDrivenScheduler(NodeScheduler):
+    """
+    事件驱动调度器：为每个节点维护“剩余未完成的图内依赖”计数器。
+    上游节点成功时只对其订阅者做 O(1) 的递减，计数归零的节点立即作为独立任务启动。
+    没有轮询、没有对依赖集合的重复扫描，也没有固定的工作者数量。
+    就绪节点总是按关键路径优先级（其次按就绪顺序）启动；
+    设置 max_parallelism 时，超出上限的就绪节点在优先队列中等待空出的槽位。
+    """
+    name = "event"
+
+    def __init__(self, max_parallelism: Optional[int] = None):
+        self.max_parallelism = max_parallelism
+
+    async def run(self, run: GraphRun, ready: List[str], execute_node: NodeExecutor) -> None:
+        remaining = self._count_remaining_dependencies(run)
+        counter = itertools.count()
+        pending = [priority_entry(run, node_id, counter) for node_id in ready]
+        heapq.heapify(pending)
+        running: set = set()
+        finished = asyncio.Event()
+
+        def launch():
+            while pending and (self.max_parallelism is None or len(running) < self.max_parallelism):
+                _, _, node_id = heapq.heappop(pending)
+                task = asyncio.create_task(execute_node(node_id))
+                running.add(task)
+                task.add_done_callback(lambda t, nid=node_id: on_done(nid, t))
+
+        def on_done(node_id: str, task: asyncio.Task):
+            running.discard(task)
+            if not task.cancelled():
+                if task.exception() is not None:
+                    logger.error(f"Scheduler task for node '{node_id}' raised: {task.exception()!r}")
+                for sub_id in self._release_subscribers(node_id, run, remaining):
+                    heapq.heappush(pending, priority_entry(run, sub_id, counter))
+            launch()
+            if not running:
+                finished.set()
+
+        launch()
+        if not running:
+            return
+
+        try:
+            await finished.wait()
+        finally:
+            for task in list(running):
+                task.cancel()
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
+
+    @staticmethod
+    def _count_remaining_dependencies(run: GraphRun) -> Dict[str, int]:
+        node_map = run.node_map
+        remaining: Dict[str, int] = {}
+        for node_id, state in run.node_states.items():
+            if state != NodeState.PENDING:
+                continue
+            remaining[node_id] = sum(
+                1 for dep_id in run.get_dependencies(node_id)
+                if dep_id in node_map and run.get_node_state(dep_id) != NodeState.SUCCEEDED
+            )
+        return remaining
+
+    @staticmethod
+    def _release_subscribers(completed_node_id: str, run: GraphRun, remaining: Dict[str, int]) -> List[str]:
+        completed_state = run.get_node_state(completed_node_id)
+        if completed_state == NodeState.FAILED:
+            skip_subscribers(completed_node_id, run)
+            return []
+        if completed_state != NodeState.SUCCEEDED:
+            return []
+
+        newly_ready = []
+        for sub_id in run.get_subscribers(completed_node_id):
+            if run.get_node_state(sub_id) != NodeState.PENDING:
+                continue
+            remaining[sub_id] -= 1
+            if remaining[sub_id] == 0:
+                run.set_node_state(sub_id, NodeState.READY)
+                newly_ready.append(sub_id)
+        return newly_ready
+
+
+SCHEDULERS = {
+    WorkerPoolScheduler.name: WorkerPoolScheduler,
+    EventDrivenScheduler.name: EventDrivenScheduler,
+}
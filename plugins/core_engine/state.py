@@ -3,7 +3,6 @@
 from __future__ import annotations
 import asyncio
 import json
-from copy import deepcopy
 from uuid import UUID
 from typing import Dict, Any, List, Optional, Tuple
 
@@ -19,8 +18,9 @@ from .contracts import (
     BeforeSnapshotCreateContext,
     GraphCollection
 )
-from backend.core.utils import DotAccessibleDict, unwrap_dot_accessible_dicts
-from .utils import ServiceResolverProxy 
+from backend.core.utils import CopyOnWriteDict, DotAccessibleDict, unwrap_dot_accessible_dicts
+from .utils import ServiceResolverProxy
+from .macro_locks import MacroLockManager 
 
 # --- Section 1: 状态存储类 ---
 
@@ -61,7 +61,8 @@ def create_main_execution_context(
 ) -> ExecutionContext:
     """
     从持久化的 Snapshot 和 Sandbox 中，为一次安全的、隔离的执行准备运行时上下文。
-    使用深拷贝来防止执行过程意外修改原始状态。
+    使用写时复制包装来防止执行过程修改原始状态：只有被触及的路径才会被复制，
+    开销取决于这一步读写了多少状态，而不是沙盒的总大小。
     """
     # 在 run_vars 中添加一个 diagnostics_log 列表
     initial_run_vars = {
@@ -71,20 +72,20 @@ def create_main_execution_context(
     if run_vars:
         initial_run_vars.update(run_vars)
         
-    mutable_moment = deepcopy(snapshot.moment)
+    mutable_moment = CopyOnWriteDict(snapshot.moment)
 
     mutable_moment['_log_info'] = []
         
     shared_context = SharedContext(
-        definition_state=deepcopy(sandbox.definition),
-        lore_state=deepcopy(sandbox.lore),
+        definition_state=CopyOnWriteDict(sandbox.definition),
+        lore_state=CopyOnWriteDict(sandbox.lore),
         moment_state=mutable_moment,
         
         session_info={
             "start_time": snapshot.created_at,
             "turn_count": 0
         },
-        global_write_lock=asyncio.Lock(),
+        macro_locks=MacroLockManager(),
         services=DotAccessibleDict(ServiceResolverProxy(container))
     )
     return ExecutionContext(
@@ -109,7 +110,8 @@ def create_sub_execution_context(
 async def create_next_snapshot(
     context: ExecutionContext,
     final_node_states: Dict[str, Any],
-    triggering_input: Dict[str, Any]
+    triggering_input: Dict[str, Any],
+    memo_fingerprints: Optional[Dict[str, str]] = None
 ) -> Tuple[StateSnapshot, Dict[str, Any]]: 
     """
     从执行完毕的上下文中，创建新的 StateSnapshot 并分离出更新后的 Lore。
@@ -117,7 +119,8 @@ async def create_next_snapshot(
     final_moment_state = context.shared.moment_state
     final_lore_state = context.shared.lore_state
     
-    # 调用从 backend.core.utils 导入的官方函数
+    # 调用从 backend.core.utils 导入的官方函数；
+    # 写时复制的状态在这里被还原为普通字典，未被修改的子树与上一个快照和原 Lore 共享
     unwrapped_moment = unwrap_dot_accessible_dicts(final_moment_state)
     unwrapped_lore = unwrap_dot_accessible_dicts(final_lore_state)
     unwrapped_node_states = unwrap_dot_accessible_dicts(final_node_states)
@@ -128,6 +131,7 @@ async def create_next_snapshot(
         "parent_snapshot_id": context.initial_snapshot.id,
         "run_output": unwrapped_node_states,
         "triggering_input": triggering_input,
+        "memo_fingerprints": memo_fingerprints or None,
     }
 
     filtered_snapshot_data = await context.hook_manager.filter(
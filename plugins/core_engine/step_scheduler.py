@@ -0,0 +1,230 @@
+# plugins/core_engine/step_scheduler.py
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+from uuid import UUID
+
+from .contracts import StepQueueFullError, StepSchedulerInterface
+
+logger = logging.getLogger(__name__)
+
+
+class StepTicket:
+    """一次 step 请求在调度器中的票据。"""
+    __slots__ = ("sandbox_id", "enqueued_at", "admitted_at", "_future")
+
+    def __init__(self, sandbox_id: UUID):
+        self.sandbox_id = sandbox_id
+        self.enqueued_at = time.monotonic()
+        self.admitted_at: Optional[float] = None
+        self._future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    @property
+    def queue_wait_ms(self) -> float:
+        end = self.admitted_at if self.admitted_at is not None else time.monotonic()
+        return (end - self.enqueued_at) * 1000
+
+
+class _SandboxQueue:
+    """单个沙盒的 FIFO 队列与其公平调度状态。"""
+    __slots__ = ("sandbox_id", "waiting", "running", "weight", "pass_value", "in_heap")
+
+    def __init__(self, sandbox_id: UUID, weight: float):
+        self.sandbox_id = sandbox_id
+        self.waiting: Deque[StepTicket] = deque()
+        self.running = False
+        self.weight = weight
+        self.pass_value = 0.0
+        self.in_heap = False
+
+    @property
+    def eligible(self) -> bool:
+        return not self.running and bool(self.waiting)
+
+
+class StepAdmission:
+    """已入队的 step 请求。进入时等待执行许可，退出时释放许可并调度下一个请求。"""
+    __slots__ = ("_scheduler", "ticket")
+
+    def __init__(self, scheduler: "StepScheduler", ticket: StepTicket):
+        self._scheduler = scheduler
+        self.ticket = ticket
+
+    async def __aenter__(self) -> StepTicket:
+        try:
+            await self.ticket._future
+        except asyncio.CancelledError:
+            self._scheduler._abandon(self.ticket)
+            raise
+        return self.ticket
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        self._scheduler._release(self.ticket.sandbox_id)
+
+
+class StepScheduler(StepSchedulerInterface):
+    """
+    多租户 step 调度器。
+
+    - 每个沙盒一个 FIFO 队列，同一沙盒任意时刻最多只有一个 step 在执行，
+      因此并发的 step 不会从同一个头快照出发、也不会在保存沙盒时相互覆盖。
+    - 不同沙盒之间使用步幅调度（stride scheduling）做加权公平准入：
+      每次准入后沙盒的 pass 值增加 1/weight，空出的全局槽位总是分配给 pass 最小的可运行沙盒。
+      重新变为可运行的沙盒的 pass 会被提升到当前虚拟时间，空闲期间不会积攒额度。
+    - max_concurrent_steps 限制整个进程同时执行的 step 数；
+      单沙盒排队深度和全局排队总数超限时立即以 StepQueueFullError 拒绝。
+    """
+    def __init__(
+        self,
+        max_concurrent_steps: int = 32,
+        max_queue_depth: int = 16,
+        max_total_queued: int = 1024,
+        default_weight: float = 1.0
+    ):
+        if max_concurrent_steps < 1:
+            raise ValueError("max_concurrent_steps must be at least 1.")
+        self.max_concurrent_steps = max_concurrent_steps
+        self.max_queue_depth = max_queue_depth
+        self.max_total_queued = max_total_queued
+        self.default_weight = default_weight
+
+        self._queues: Dict[UUID, _SandboxQueue] = {}
+        self._weights: Dict[UUID, float] = {}
+        self._heap: List[Tuple[float, int, UUID]] = []
+        self._seq = itertools.count()
+        self._virtual_time = 0.0
+        self._running = 0
+        self._waiting = 0
+
+        self.admitted_total = 0
+        self.rejected_total = 0
+        self.max_queue_wait_ms = 0.0
+
+    def set_weight(self, sandbox_id: UUID, weight: float):
+        """设置沙盒的调度权重（越大获得的全局额度份额越多）。"""
+        if weight <= 0:
+            raise ValueError("Weight must be positive.")
+        self._weights[sandbox_id] = weight
+        queue = self._queues.get(sandbox_id)
+        if queue is not None:
+            queue.weight = weight
+
+    def admit(self, sandbox_id: UUID, weight: Optional[float] = None) -> "StepAdmission":
+        """
+        立即入队（队列已满时在这里同步抛出 StepQueueFullError），
+        返回的 StepAdmission 必须随后通过 `async with` 进入以等待许可。
+        """
+        return StepAdmission(self, self._enqueue(sandbox_id, weight))
+
+    # --- 内部实现 ---
+
+    def _enqueue(self, sandbox_id: UUID, weight: Optional[float]) -> StepTicket:
+        queue = self._queues.get(sandbox_id)
+        depth = (len(queue.waiting) + int(queue.running)) if queue else 0
+        if depth >= self.max_queue_depth:
+            self.rejected_total += 1
+            raise StepQueueFullError(
+                f"Too many pending steps for sandbox {sandbox_id} (limit {self.max_queue_depth}).", sandbox_id
+            )
+        if self._waiting >= self.max_total_queued:
+            self.rejected_total += 1
+            raise StepQueueFullError(
+                f"Step queue is full ({self.max_total_queued} pending steps).", sandbox_id
+            )
+
+        if queue is None:
+            queue = _SandboxQueue(sandbox_id, self._weights.get(sandbox_id, self.default_weight))
+            self._queues[sandbox_id] = queue
+        if weight is not None:
+            queue.weight = weight
+
+        ticket = StepTicket(sandbox_id)
+        queue.waiting.append(ticket)
+        self._waiting += 1
+        self._make_eligible(queue)
+        self._dispatch()
+        return ticket
+
+    def _make_eligible(self, queue: _SandboxQueue):
+        if queue.in_heap or not queue.eligible:
+            return
+        queue.pass_value = max(queue.pass_value, self._virtual_time)
+        heapq.heappush(self._heap, (queue.pass_value, next(self._seq), queue.sandbox_id))
+        queue.in_heap = True
+
+    def _dispatch(self):
+        while self._running < self.max_concurrent_steps and self._heap:
+            pass_value, _, sandbox_id = heapq.heappop(self._heap)
+            queue = self._queues.get(sandbox_id)
+            if queue is None:
+                continue
+            queue.in_heap = False
+            if not queue.eligible:
+                # 排队的请求已被取消
+                self._discard_if_idle(queue)
+                continue
+
+            ticket = queue.waiting.popleft()
+            self._waiting -= 1
+            if ticket._future.cancelled():
+                # 等待者已被取消但尚未恢复执行去调用 _abandon：丢弃这张票据，重新评估该沙盒
+                self._make_eligible(queue)
+                self._discard_if_idle(queue)
+                continue
+            queue.running = True
+            self._running += 1
+            self._virtual_time = pass_value
+            queue.pass_value = pass_value + 1.0 / queue.weight
+
+            ticket.admitted_at = time.monotonic()
+            self.admitted_total += 1
+            self.max_queue_wait_ms = max(self.max_queue_wait_ms, ticket.queue_wait_ms)
+            ticket._future.set_result(None)
+
+    def _release(self, sandbox_id: UUID):
+        queue = self._queues.get(sandbox_id)
+        if queue is None or not queue.running:
+            return
+        queue.running = False
+        self._running -= 1
+        self._make_eligible(queue)
+        self._discard_if_idle(queue)
+        self._dispatch()
+
+    def _abandon(self, ticket: StepTicket):
+        """处理在排队期间被取消的请求（例如客户端断开）。"""
+        queue = self._queues.get(ticket.sandbox_id)
+        if queue is None:
+            return
+        if ticket._future.done() and not ticket._future.cancelled():
+            # 许可已经发放，但等待者在拿到它之前被取消：归还槽位
+            self._release(ticket.sandbox_id)
+            return
+        try:
+            queue.waiting.remove(ticket)
+            self._waiting -= 1
+        except ValueError:
+            pass
+        self._discard_if_idle(queue)
+
+    def _discard_if_idle(self, queue: _SandboxQueue):
+        if not queue.running and not queue.waiting and not queue.in_heap:
+            self._queues.pop(queue.sandbox_id, None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "running": self._running,
+            "waiting": self._waiting,
+            "active_sandboxes": len(self._queues),
+            "max_concurrent_steps": self.max_concurrent_steps,
+            "max_queue_depth": self.max_queue_depth,
+            "max_total_queued": self.max_total_queued,
+            "admitted_total": self.admitted_total,
+            "rejected_total": self.rejected_total,
+            "max_queue_wait_ms": round(self.max_queue_wait_ms, 3),
+        }
@@ -1,12 +1,20 @@
 # plugins/core_engine/tests/conftest.py
 
+import asyncio
 import pytest
-from typing import List, Tuple
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Type
 from uuid import UUID
 from httpx import AsyncClient
 
+from backend.container import Container
+from backend.core.hooks import HookManager
 # 导入这个文件需要的 Pydantic 模型
-from plugins.core_engine.contracts import GraphCollection
+from plugins.core_engine.contracts import (
+    GraphCollection, GraphDefinition, RuntimeInterface, Sandbox, StateSnapshot
+)
+from plugins.core_engine.engine import ExecutionEngine
+from plugins.core_engine.registry import RuntimeRegistry
+from plugins.core_engine.state import create_main_execution_context
 
 
 # ---- 这里只定义本模块（core_engine）测试专属的、可复用的fixtures ----
@@ -65,4 +73,100 @@ def query_resource_api():
         )
         assert response.status_code == 200, f"Query failed: {response.text}"
         return response.json()["results"]
-    return _query_resource
\ No newline at end of file
+    return _query_resource
+
+
+# ---- 独立引擎与探针运行时：调度、并发限制和超时测试共用 ----
+
+class RuntimeProbe:
+    """
+    记录探针运行时（test.probe）的执行情况：节点开始执行的顺序、同时执行数的峰值和被取消的次数。
+    状态保存在实例上，每个 IsolatedEngine 拥有自己的探针。
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.started: List[str] = []
+        self.active = 0
+        self.peak = 0
+        self.cancelled = 0
+
+    def runtime_class(self) -> Type[RuntimeInterface]:
+        """返回一个绑定到本探针的运行时类（运行时由注册表按类实例化，无法直接传入实例）。"""
+        probe = self
+
+        class ProbeRuntime(RuntimeInterface):
+            """按 config.delay sleep 一段时间后返回 config.value（默认为节点 ID）。"""
+            concurrency_class = "probe"
+
+            @classmethod
+            def get_config_model(cls):
+                return super().get_config_model()
+
+            async def execute(self, config: Dict[str, Any], context, node=None, **kwargs) -> Dict[str, Any]:
+                probe.started.append(node.id)
+                probe.active += 1
+                probe.peak = max(probe.peak, probe.active)
+                try:
+                    await asyncio.sleep(config.get("delay", 0))
+                except asyncio.CancelledError:
+                    probe.cancelled += 1
+                    raise
+                finally:
+                    probe.active -= 1
+                return {"output": config.get("value", node.id)}
+
+        return ProbeRuntime
+
+
+class IsolatedEngine:
+    """不依赖应用生命周期的 ExecutionEngine，注册了 test.probe 运行时。"""
+    def __init__(self, **engine_kwargs):
+        self.probe = RuntimeProbe()
+        container = Container()
+        registry = RuntimeRegistry()
+        registry.register("test.probe", self.probe.runtime_class())
+        self.engine = ExecutionEngine(
+            registry=registry, container=container, hook_manager=HookManager(container), **engine_kwargs
+        )
+
+    async def run(self, graph_def: GraphDefinition, **kwargs) -> Dict[str, Any]:
+        """在新的沙盒上下文中执行一张图；探针在每次运行前清零，kwargs 透传给引擎（如 deadline）。"""
+        self.probe.reset()
+        sandbox = Sandbox(name="isolated", definition={})
+        context = create_main_execution_context(
+            StateSnapshot(sandbox_id=sandbox.id), sandbox, self.engine.container, self.engine.hook_manager
+        )
+        return await self.engine._internal_execute_graph(graph_def, context, **kwargs)
+
+
+@pytest.fixture
+def runtime_probe() -> RuntimeProbe:
+    """一个新的探针；用 runtime_probe.runtime_class() 把 test.probe 注册到其他引擎上。"""
+    return RuntimeProbe()
+
+
+@pytest.fixture
+def isolated_engine() -> Callable[..., IsolatedEngine]:
+    """创建 IsolatedEngine 的工厂，参数透传给 ExecutionEngine（如 scheduler、concurrency_limiter）。"""
+    return IsolatedEngine
+
+
+@pytest.fixture(scope="session")
+def probe_node() -> Callable[..., Dict[str, Any]]:
+    """生成一个由 test.probe 指令组成的节点定义：delays 中的每一项对应一条指令。"""
+    def _probe_node(
+        node_id: str,
+        depends_on: Sequence[str] = (),
+        delays: Sequence[float] = (0.0,),
+        metadata: Optional[Dict[str, Any]] = None,
+        **config: Any
+    ) -> Dict[str, Any]:
+        return {
+            "id": node_id,
+            "depends_on": list(depends_on),
+            "metadata": metadata or {},
+            "run": [{"runtime": "test.probe", "config": {"delay": delay, **config}} for delay in delays]
+        }
+    return _probe_node
@@ -0,0 +1,75 @@
+# plugins/core_engine/tests/test_concurrency_limits.py
+
+import asyncio
+import pytest
+from typing import Any, Callable, Dict
+
+from plugins.core_engine.concurrency import ConcurrencyLimiter, parse_concurrency_limits
+from plugins.core_engine.contracts import GraphDefinition
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest.fixture
+def fan_out_graph(probe_node: Callable[..., Dict[str, Any]]) -> Callable[..., GraphDefinition]:
+    def _fan_out_graph(width: int, metadata: Dict[str, Any] = None) -> GraphDefinition:
+        return GraphDefinition.model_validate({
+            "metadata": metadata or {},
+            "nodes": [probe_node(f"n{i}", delays=(0.01,), value=i) for i in range(width)]
+        })
+    return _fan_out_graph
+
+
+class TestConcurrencyLimits:
+    """
+    【集成测试】
+    测试声明式并发限制：图级别的 max_parallelism、运行时并发类别的信号量以及进程级全局上限。
+    """
+
+    async def test_unlimited_by_default(self, isolated_engine, fan_out_graph):
+        harness = isolated_engine()
+        results = await harness.run(fan_out_graph(6))
+        assert len(results) == 6
+        assert harness.probe.peak == 6
+
+    @pytest.mark.parametrize("scheduler", ["event", "worker_pool"])
+    async def test_graph_max_parallelism(self, scheduler: str, isolated_engine, fan_out_graph):
+        harness = isolated_engine(scheduler=scheduler)
+        results = await harness.run(fan_out_graph(6, {"max_parallelism": 2}))
+        assert [results[f"n{i}"]["output"] for i in range(6)] == list(range(6))
+        assert harness.probe.peak == 2
+
+    async def test_invalid_max_parallelism_is_rejected(self, isolated_engine, fan_out_graph):
+        with pytest.raises(ValueError, match="max_parallelism"):
+            await isolated_engine().run(fan_out_graph(2, {"max_parallelism": 0}))
+
+    async def test_concurrency_class_limit(self, isolated_engine, fan_out_graph):
+        limiter = ConcurrencyLimiter(class_limits={"probe": 1, "llm": 8})
+        harness = isolated_engine(concurrency_limiter=limiter)
+        results = await harness.run(fan_out_graph(4))
+        assert len(results) == 4
+        assert harness.probe.peak == 1
+        assert limiter.get_stats()["probe"] == {"limit": 1, "in_flight": 0, "waiting": 0}
+
+    async def test_global_limit(self, isolated_engine, fan_out_graph):
+        harness = isolated_engine(concurrency_limiter=ConcurrencyLimiter(global_limit=3))
+        await harness.run(fan_out_graph(8))
+        assert harness.probe.peak == 3
+
+    async def test_unclassed_runtimes_bypass_limits(self):
+        limiter = ConcurrencyLimiter(global_limit=1)
+        entered = []
+
+        async def hold(i):
+            async with limiter.slot(None):
+                entered.append(i)
+                await asyncio.sleep(0.01)
+
+        async with limiter.slot("default"):
+            # 全局槽位已被占满，但不受限的调用（如 system.flow.*）仍可立即进入
+            await asyncio.wait_for(asyncio.gather(hold(1), hold(2)), timeout=1)
+        assert entered == [1, 2]
+
+    async def test_parse_concurrency_limits(self):
+        assert parse_concurrency_limits("llm=4, macro=2,,bad,x=y") == {"llm": 4, "macro": 2}
+        assert parse_concurrency_limits(None) == {}
@@ -0,0 +1,155 @@
+# plugins/core_engine/tests/test_copy_on_write.py
+
+import copy
+import pickle
+import pytest
+from typing import Tuple
+
+from backend.core.contracts import Container, HookManager
+from backend.core.utils import CopyOnWriteDict, DotAccessibleDict, unwrap_dot_accessible_dicts
+from plugins.core_engine.contracts import ExecutionEngineInterface, GraphCollection
+
+pytestmark = pytest.mark.asyncio
+
+
+def make_base():
+    return {
+        "player": {"hp": 10, "inventory": [{"name": "sword"}, {"name": "shield"}]},
+        "memoria": {"stream": [{"id": i} for i in range(50)]},
+        "turn": 1,
+    }
+
+
+class TestCopyOnWriteDict:
+    """
+    【单元测试】
+    写时复制容器：原始数据不被修改，还原时未改变的子树与原始数据共享。
+    """
+
+    async def test_writes_never_reach_the_base(self):
+        base = make_base()
+        reference = copy.deepcopy(base)
+        state = CopyOnWriteDict(base)
+        moment = DotAccessibleDict(state)
+
+        moment.player.hp -= 3
+        moment.player.inventory.append({"name": "potion"})
+        moment.player.inventory[0]["name"] = "broken sword"
+        state.setdefault("flags", {})["seen"] = True
+        for entry in state["memoria"]["stream"]:
+            entry["read"] = True
+
+        assert base == reference
+        assert state["player"]["hp"] == 7 and len(state["player"]["inventory"]) == 3
+
+    async def test_untouched_subtrees_are_shared(self):
+        base = make_base()
+        state = CopyOnWriteDict(base)
+        DotAccessibleDict(state).player.hp = 1
+
+        result = unwrap_dot_accessible_dicts(state)
+        assert type(result) is dict and result is not base
+        assert result["player"]["hp"] == 1
+        assert result["memoria"] is base["memoria"]
+        assert result["player"]["inventory"] is base["player"]["inventory"]
+
+    async def test_reads_alone_return_the_base(self):
+        base = make_base()
+        state = CopyOnWriteDict(base)
+        assert [entry["id"] for entry in state["memoria"]["stream"]][:2] == [0, 1]
+        assert dict(state)["player"]["hp"] == 10
+        assert unwrap_dot_accessible_dicts(state) is base
+
+    async def test_copies_and_pickling_produce_plain_data(self):
+        base = make_base()
+        state = CopyOnWriteDict(base)
+        state["player"]["hp"] = 5
+
+        for duplicate in (copy.deepcopy(state), pickle.loads(pickle.dumps(state))):
+            assert type(duplicate) is dict and duplicate["player"]["hp"] == 5
+        shallow = copy.copy(state)
+        shallow["player"]["inventory"].clear()
+        assert base["player"]["inventory"] == [{"name": "sword"}, {"name": "shield"}]
+
+    async def test_list_concatenation_copies_base_elements(self):
+        base = make_base()
+        reference = copy.deepcopy(base)
+        moment = DotAccessibleDict(CopyOnWriteDict(base))
+
+        # 写时复制列表在 + 的右侧、以及 sum(..., []) 拼接时，取出的元素同样必须先复制
+        items = [] + moment.player.inventory
+        items[0]["name"] = "broken sword"
+        merged = sum([moment.player.inventory, moment.memoria.stream], [])
+        merged[1]["name"] = "broken shield"
+        merged[2]["read"] = True
+        (moment.player.inventory + [])[0]["name"] = "rusty sword"
+
+        assert base == reference
+
+    async def test_custom_objects_are_copied_on_access(self):
+        class Counter:
+            def __init__(self):
+                self.value = 0
+
+        counter = Counter()
+        state = CopyOnWriteDict({"counter": counter})
+        state["counter"].value += 1
+        assert counter.value == 0
+        assert unwrap_dot_accessible_dicts(state)["counter"].value == 1
+
+
+class TestCopyOnWriteExecution:
+    """
+    【集成测试】
+    引擎的每一步都在写时复制的状态上执行：之前的快照保持不变，新快照与它共享未修改的子树。
+    """
+
+    async def test_step_shares_untouched_state_with_previous_snapshot(
+        self,
+        test_engine_setup: Tuple[ExecutionEngineInterface, Container, HookManager],
+        sandbox_factory: callable
+    ):
+        engine, container, _ = test_engine_setup
+        graph = GraphCollection.model_validate({"main": {"nodes": [
+            {"id": "hit", "run": [{"runtime": "system.execute", "config": {
+                "code": "moment.player.hp -= 1\nmoment.player.hp"
+            }}]}
+        ]}})
+        sandbox = await sandbox_factory(graph_collection=graph, initial_moment=make_base())
+        snapshot_store = container.resolve("snapshot_store")
+        genesis = snapshot_store.get(sandbox.head_snapshot_id)
+        lore_before = sandbox.lore
+
+        updated_sandbox = await engine.step(sandbox, {})
+        head = snapshot_store.get(updated_sandbox.head_snapshot_id)
+
+        assert head.run_output["hit"]["output"] == 9
+        assert genesis.moment["player"]["hp"] == 10
+        assert head.moment["player"]["hp"] == 9
+        assert head.moment["memoria"] is genesis.moment["memoria"]
+        assert head.moment["player"]["inventory"] is genesis.moment["player"]["inventory"]
+        # 这一步没有修改 Lore，沙盒继续使用同一份数据
+        assert updated_sandbox.lore["graphs"] is lore_before["graphs"]
+
+    async def test_node_outputs_do_not_alias_cached_graph_config(
+        self,
+        test_engine_setup: Tuple[ExecutionEngineInterface, Container, HookManager],
+        sandbox_factory: callable
+    ):
+        """静态配置作为节点输出交出后被宏原地修改，不能改到跨步骤缓存的图定义上。"""
+        engine, container, _ = test_engine_setup
+        graph = GraphCollection.model_validate({"main": {"nodes": [
+            {"id": "a", "run": [{"runtime": "system.io.input", "config": {"value": [1, 2]}}]},
+            {"id": "b", "depends_on": ["a"], "run": [{"runtime": "system.execute", "config": {
+                "code": "nodes.a.output.append(3)\nnodes.a.output"
+            }}]},
+        ]}})
+        sandbox = await sandbox_factory(graph_collection=graph)
+        snapshot_store = container.resolve("snapshot_store")
+
+        for _ in range(3):
+            sandbox = await engine.step(sandbox, {})
+            head = snapshot_store.get(sandbox.head_snapshot_id)
+            assert head.run_output["a"]["output"] == [1, 2, 3]
+            assert head.run_output["b"]["output"] == [1, 2, 3]
+        assert sandbox.lore["graphs"]["main"]["nodes"][0]["run"][0]["config"]["value"] == [1, 2]
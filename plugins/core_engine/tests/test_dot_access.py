@@ -0,0 +1,67 @@
+# plugins/core_engine/tests/test_dot_access.py
+
+import copy
+import pytest
+
+from backend.core.utils import DotAccessibleDict, unwrap_dot_accessible_dicts
+
+pytestmark = pytest.mark.asyncio
+
+
+class TestDotAccessibleDict:
+    """
+    【单元测试】
+    测试点符号代理的子代理缓存，以及缓存在底层数据被替换后的失效。
+    """
+
+    async def test_child_proxies_are_reused(self):
+        moment = DotAccessibleDict({"player": {"stats": {"hp": 10}}})
+        assert moment.player.stats is moment.player.stats
+        assert moment["player"] is moment.player
+        assert moment.player.stats.hp == 10
+
+    async def test_replaced_values_are_rewrapped(self):
+        data = {"player": {"hp": 10}}
+        moment = DotAccessibleDict(data)
+        old = moment.player
+        data["player"] = {"hp": 1}
+        assert moment.player is not old and moment.player.hp == 1
+        moment.player = {"hp": 2}
+        assert moment.player.hp == 2
+
+    async def test_assigning_a_proxy_stores_its_dict(self):
+        data = {"a": {"x": 1}}
+        moment = DotAccessibleDict(data)
+        moment.b = moment.a
+        moment["c"] = moment.a
+        assert data["b"] is data["a"] and data["c"] is data["a"]
+
+    async def test_dict_methods_and_copying(self):
+        moment = DotAccessibleDict({"a": {"x": 1}})
+        assert list(moment.keys()) == ["a"]
+        assert not hasattr(moment, "missing")
+        assert copy.deepcopy(moment).a.x == 1
+
+
+class TestUnwrap:
+    """
+    【单元测试】
+    解包只复制通往代理对象的路径，未触及的子树原样共享。
+    """
+
+    async def test_untouched_trees_are_returned_as_is(self):
+        data = {"memoria": {"stream": [{"text": "hi"}] * 3}, "name": "Ann"}
+        assert unwrap_dot_accessible_dicts(data) is data
+
+    async def test_only_paths_to_proxies_are_copied(self):
+        shared = {"big": list(range(100))}
+        inner = {"x": 1}
+        data = {"shared": shared, "bag": {"items": [DotAccessibleDict(inner), {"y": 2}]}}
+
+        result = unwrap_dot_accessible_dicts(DotAccessibleDict(data))
+        assert result == {"shared": shared, "bag": {"items": [{"x": 1}, {"y": 2}]}}
+        assert result["shared"] is shared
+        assert result["bag"]["items"][0] is inner
+        assert result["bag"]["items"][1] is data["bag"]["items"][1]
+        # 原数据不被修改
+        assert isinstance(data["bag"]["items"][0], DotAccessibleDict)
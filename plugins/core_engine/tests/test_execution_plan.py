@@ -0,0 +1,127 @@
+# plugins/core_engine/tests/test_execution_plan.py
+
+import pytest
+from typing import Tuple
+
+from plugins.core_engine.contracts import GraphCollection, ExecutionEngineInterface
+from backend.core.contracts import Container, HookManager
+
+pytestmark = pytest.mark.asyncio
+
+
+class TestExecutionPlanCache:
+    """
+    【集成测试】
+    测试执行计划的编译与缓存：同一个图定义只应被编译一次，
+    且缓存的计划在多次 step 之间复用时结果保持一致。
+    """
+
+    async def test_plan_is_compiled_once_across_steps(
+        self,
+        test_engine_setup: Tuple[ExecutionEngineInterface, Container, HookManager],
+        sandbox_factory: callable,
+        linear_collection: GraphCollection
+    ):
+        engine, container, _ = test_engine_setup
+        engine.plan_cache.clear()
+        sandbox = await sandbox_factory(graph_collection=linear_collection)
+        misses_before = engine.plan_cache.misses
+
+        sandbox = await engine.step(sandbox, {})
+        misses_after_first_step = engine.plan_cache.misses
+        sandbox = await engine.step(sandbox, {})
+
+        assert misses_after_first_step - misses_before == 1
+        assert engine.plan_cache.misses == misses_after_first_step
+
+        snapshot_store = container.resolve("snapshot_store")
+        final_snapshot = snapshot_store.get(sandbox.head_snapshot_id)
+        assert "The story is: a story about a cat" in final_snapshot.run_output["B"]["output"]
+
+    async def test_plan_structure(
+        self,
+        test_engine_setup: Tuple[ExecutionEngineInterface, Container, HookManager],
+        linear_collection: GraphCollection
+    ):
+        engine, _, _ = test_engine_setup
+        plan = await engine.plan_cache.get_plan(linear_collection.root["main"])
+
+        assert plan.entry_nodes == ["A"]
+        assert plan.topological_order == ["A", "B", "C"]
+        assert plan.subscribers["A"] == {"B"}
+        assert plan.dependencies["C"] == {"B"}
+        assert plan.get_runtime_class("B", 0) is engine.registry.get_runtime_class("llm.default")
+
+    async def test_changed_definition_gets_new_plan(
+        self,
+        test_engine_setup: Tuple[ExecutionEngineInterface, Container, HookManager],
+        linear_collection: GraphCollection
+    ):
+        engine, _, _ = test_engine_setup
+        graph_def = linear_collection.root["main"]
+        plan_a = await engine.plan_cache.get_plan(graph_def)
+
+        changed = graph_def.model_copy(deep=True)
+        changed.nodes[2].depends_on = ["A"]
+        plan_b = await engine.plan_cache.get_plan(changed)
+
+        assert plan_a is not plan_b
+        assert plan_a.fingerprint != plan_b.fingerprint
+        assert "A" in plan_b.dependencies["C"]
+
+
+class TestGraphResolverCache:
+    """
+    【集成测试】
+    测试 GraphResolver 的已验证图集合缓存：
+    图子树未变化时复用同一组模型，图被修改后能解析出新版本。
+    """
+
+    async def test_map_items_reuse_resolved_collection(
+        self,
+        test_engine_setup: Tuple[ExecutionEngineInterface, Container, HookManager],
+        sandbox_factory: callable,
+        map_collection_basic: GraphCollection
+    ):
+        engine, _, _ = test_engine_setup
+        engine.graph_resolver.clear()
+        misses_before = engine.graph_resolver.misses
+        sandbox = await sandbox_factory(graph_collection=map_collection_basic)
+
+        await engine.step(sandbox, {})
+
+        # step() 本身和两次 map 子图调用只应触发一次真正的解析
+        assert engine.graph_resolver.misses - misses_before == 1
+
+    async def test_unchanged_graphs_are_resolved_by_identity(
+        self,
+        test_engine_setup: Tuple[ExecutionEngineInterface, Container, HookManager],
+        sandbox_factory: callable,
+        map_collection_basic: GraphCollection
+    ):
+        engine, _, _ = test_engine_setup
+        engine.graph_resolver.clear()
+        fingerprints_before = engine.graph_resolver.fingerprints
+        sandbox = await sandbox_factory(graph_collection=map_collection_basic)
+
+        sandbox = await engine.step(sandbox, {})
+        sandbox = await engine.step(sandbox, {})
+
+        # 图子树未被修改：只有第一次解析需要计算内容指纹，之后的步骤和 map 子图调用都按对象身份命中
+        assert engine.graph_resolver.fingerprints - fingerprints_before == 1
+
+    async def test_graph_change_is_picked_up(
+        self,
+        test_engine_setup: Tuple[ExecutionEngineInterface, Container, HookManager],
+        sandbox_factory: callable,
+        graph_evolution_collection: GraphCollection
+    ):
+        engine, container, _ = test_engine_setup
+        sandbox = await sandbox_factory(graph_collection=graph_evolution_collection)
+
+        sandbox = await engine.step(sandbox, {})
+        sandbox = await engine.step(sandbox, {})
+
+        snapshot_store = container.resolve("snapshot_store")
+        final_snapshot = snapshot_store.get(sandbox.head_snapshot_id)
+        assert final_snapshot.run_output["new_node"]["output"] == "This is the evolved graph!"
@@ -0,0 +1,260 @@
+# plugins/core_engine/tests/test_macro_cache.py
+
+import asyncio
+import pytest
+from httpx import AsyncClient
+
+from backend.core.utils import unwrap_dot_accessible_dicts
+from plugins.core_engine.evaluation import (
+    INLINE_MACRO_REGEX, build_evaluation_context, compile_data_shape, compile_macro, compile_template, derive_config_shape,
+    evaluate_data, evaluate_expression, macro_code_cache, template_plan_cache
+)
+from plugins.core_engine.macro_cache import MacroCodeCache
+
+pytestmark = pytest.mark.asyncio
+
+
+class TestMacroCodeCache:
+    """
+    【单元测试】
+    测试已编译宏缓存的 LRU 淘汰、字节上限以及命中统计。
+    """
+
+    async def test_lru_eviction_by_entry_count(self):
+        cache = MacroCodeCache(max_entries=2)
+        for source in ("a", "b", "a", "c"):
+            cache.get_or_compile(source, compile_macro)
+
+        # "b" 是最久未使用的条目
+        stats = cache.get_stats()
+        assert (stats["hits"], stats["misses"], stats["evictions"], stats["entries"]) == (1, 3, 1, 2)
+        cache.get_or_compile("a", compile_macro)
+        assert cache.get_stats()["hits"] == 2
+
+    async def test_byte_budget_and_oversized_sources(self):
+        cache = MacroCodeCache(max_entries=100, max_bytes=10, max_source_bytes=6)
+        cache.get_or_compile("x = 1", compile_macro)
+        cache.get_or_compile("y = 22", compile_macro)
+        assert cache.get_stats()["bytes"] <= 10
+        assert len(cache) == 1
+
+        cache.get_or_compile("zzzzzz = 1", compile_macro)
+        assert "zzzzzz = 1" not in cache._entries
+
+    async def test_empty_macro_is_cached(self):
+        cache = MacroCodeCache()
+        assert cache.get_or_compile("", compile_macro).code is None
+        assert cache.get_or_compile("", compile_macro).code is None
+        assert cache.get_stats()["hits"] == 1
+
+    async def test_evaluate_expression_reuses_compiled_code(self):
+        code = "value = 20\nvalue + 22  # test_evaluate_expression_reuses_compiled_code"
+        hits_before = macro_code_cache.hits
+        for _ in range(3):
+            assert await evaluate_expression(code, {}, asyncio.Lock()) == 42
+        assert macro_code_cache.hits - hits_before >= 2
+
+    async def test_syntax_errors_are_not_cached(self):
+        with pytest.raises(ValueError, match="Macro syntax error"):
+            await evaluate_expression("1 +", {}, asyncio.Lock())
+        assert "1 +" not in macro_code_cache._entries
+
+
+@pytest.mark.e2e
+async def test_macro_cache_stats_in_system_report(client: AsyncClient):
+    response = await client.get("/api/system/report")
+    assert response.status_code == 200
+    stats = response.json()["macro_cache"]
+    assert {"entries", "bytes", "hits", "misses", "evictions"} <= set(stats)
+
+
+class TestLookupFastPath:
+    """
+    【单元测试】
+    纯读取宏在编译期被识别为路径查找，直接在事件循环上求值，不获取全局写锁。
+    """
+
+    @pytest.mark.parametrize("code, is_lookup", [
+        ("nodes.llm.output", True),
+        ("moment.player['hp']", True),
+        ("pipe.items[-1]", True),
+        ("42", True),
+        ("moment.items[i]", False),
+        ("moment.player.hp + 1", False),
+        ("len(moment.items)", False),
+        ("x = 1\nx", False),
+    ])
+    async def test_lookup_detection(self, code: str, is_lookup: bool):
+        assert compile_macro(code).is_lookup is is_lookup
+
+    async def test_lookup_bypasses_lock(self):
+        from backend.core.utils import DotAccessibleDict
+        lock = asyncio.Lock()
+        await lock.acquire()
+        context = {"moment": DotAccessibleDict({"player": {"hp": 7, "tags": ["a", "b"]}})}
+        try:
+            assert await asyncio.wait_for(evaluate_expression("moment.player.hp", context, lock), 1) == 7
+            assert await asyncio.wait_for(evaluate_expression("moment.player['tags'][-1]", context, lock), 1) == "b"
+        finally:
+            lock.release()
+
+    async def test_unknown_root_falls_back_to_exec(self):
+        assert await evaluate_expression("len", {}, asyncio.Lock()) is len
+
+    async def test_lookup_errors_match_exec_path(self):
+        from backend.core.utils import DotAccessibleDict
+        context = {"moment": DotAccessibleDict({})}
+        with pytest.raises(AttributeError):
+            await evaluate_expression("moment.missing", context, asyncio.Lock())
+
+
+class TestTemplatePlans:
+    """
+    【单元测试】
+    含宏字符串被编译为渲染计划并缓存；渲染结果与逐次正则替换完全一致。
+    """
+
+    @staticmethod
+    async def reference_render(data: str, context: dict) -> str:
+        """原先的实现：finditer 求值后再用 sub 拼回。"""
+        matches = list(INLINE_MACRO_REGEX.finditer(data))
+        results = iter([await evaluate_expression(m.group(1), context, asyncio.Lock()) for m in matches])
+        return INLINE_MACRO_REGEX.sub(lambda m: str(next(results)), data)
+
+    @pytest.mark.parametrize("template", [
+        "Hello {{ moment.name }}!",
+        "name={{moment.name}}{{ moment.hp }}",
+        "HP: {{ moment.hp + 1 }} / {{ 100 }}, tags={{ moment.tags }} {{ moment.missing_ok if False else 'x' }}",
+        "multi {{ x = 2\nx * moment.hp }} line",
+        "no closing {{ here",
+    ])
+    async def test_render_matches_regex_substitution(self, template: str):
+        from backend.core.utils import DotAccessibleDict
+        context = {"moment": DotAccessibleDict({"name": "Ann", "hp": 9, "tags": ["a"]})}
+        expected = await self.reference_render(template, context) if "}}" in template else template
+        assert await evaluate_data(template, context, asyncio.Lock()) == expected
+
+    async def test_full_macro_keeps_result_type(self):
+        assert await evaluate_data("{{ [1, 2] }}", {}, asyncio.Lock()) == [1, 2]
+
+    async def test_plan_is_compiled_once(self):
+        template = "A {{ 1 }} B {{ 2 }} C  # test_plan_is_compiled_once"
+        misses_before = template_plan_cache.misses
+        for _ in range(3):
+            assert await evaluate_data(template, {}, asyncio.Lock()) == "A 1 B 2 C  # test_plan_is_compiled_once"
+        assert template_plan_cache.misses - misses_before == 1
+
+        plan = compile_template(template)
+        assert plan.segments == ("A ", None, " B ", None, " C  # test_plan_is_compiled_once")
+        assert [index for index, _, _ in plan.macros] == [1, 3]
+
+    async def test_simple_placeholders_render_without_lock(self):
+        from backend.core.utils import DotAccessibleDict
+        lock = asyncio.Lock()
+        await lock.acquire()
+        context = {"nodes": DotAccessibleDict({"a": {"output": "x"}})}
+        try:
+            rendered = await asyncio.wait_for(evaluate_data("out: {{ nodes.a.output }}-{{ 3 }}", context, lock), 1)
+        finally:
+            lock.release()
+        assert rendered == "out: x-3"
+
+
+class TestStaticSubtrees:
+    """
+    【单元测试】
+    evaluate_data 只对含宏的叶子求值，完全静态的子树以写时复制的形式与原始数据共享。
+    """
+
+    async def test_shape_records_only_dynamic_paths(self):
+        data = {"static": {"a": [1, "x"]}, "messages": [{"role": "user"}, {"content": "{{ 1 }}"}], "n": 3}
+        assert compile_data_shape(data) == {"messages": ((1, {"content": True}),)}
+        assert compile_data_shape({"a": ["{{ only open"]}) is None
+
+    async def test_static_subtrees_are_shared_until_modified(self):
+        lore_blob = {"entries": [{"text": "plain"}] * 50}
+        config = {"value": lore_blob, "title": "{{ 'T' }}", "messages": [{"content": "hi"}, "{{ 2 }}"]}
+        result = await evaluate_data(config, {}, asyncio.Lock())
+
+        assert result == {"value": lore_blob, "title": "T", "messages": [{"content": "hi"}, 2]}
+        # 未被修改的静态子树还原后仍是原始对象
+        unwrapped = unwrap_dot_accessible_dicts(result)
+        assert unwrapped["value"] is lore_blob
+        assert unwrapped["messages"][0] is config["messages"][0]
+        # 含动态子项的容器是新对象，原始配置不被修改
+        assert result is not config and result["messages"] is not config["messages"]
+        assert config["title"] == "{{ 'T' }}"
+
+    async def test_static_data_cannot_be_modified_through_the_result(self):
+        config = {"value": [{"a": 1}, "text"]}
+        result = await evaluate_data(config, {}, asyncio.Lock())
+        assert result == config and unwrap_dot_accessible_dicts(result) is config
+
+        result["value"].append(3)
+        result["value"][0]["a"] = 2
+        assert config == {"value": [{"a": 1}, "text"]}
+
+        # 含动态子项的容器中的静态子项同样受保护
+        items = [1, 2]
+        partly_dynamic = await evaluate_data({"items": items, "n": "{{ 1 }}"}, {}, asyncio.Lock())
+        partly_dynamic["items"].append(3)
+        assert items == [1, 2]
+
+    async def test_derived_shape_rescans_replaced_values(self):
+        original = {"keep": "{{ 1 }}", "static": "a", "swapped": "b"}
+        original_shape = compile_data_shape(original)
+        config = dict(original, swapped="{{ 3 }}", added="{{ 4 }}")
+        shape = derive_config_shape(config, original, original_shape)
+        assert shape == {"keep": True, "swapped": True, "added": True}
+        result = await evaluate_data(config, {}, asyncio.Lock(), shape=shape)
+        assert result == {"keep": 1, "static": "a", "swapped": 3, "added": 4}
+
+
+class TestLayeredEvaluationContext:
+    """
+    【单元测试】
+    求值上下文分层复用：step 级基础层与图执行级覆盖层只构建一次，每次调用只复制小字典。
+    """
+
+    @staticmethod
+    def make_context():
+        from backend.container import Container
+        from backend.core.hooks import HookManager
+        from plugins.core_engine.contracts import Sandbox, StateSnapshot
+        from plugins.core_engine.state import create_main_execution_context
+
+        container = Container()
+        sandbox = Sandbox(name="layers", definition={}, lore={"world": "Hevno"})
+        snapshot = StateSnapshot(sandbox_id=sandbox.id, moment={"hp": 1})
+        return create_main_execution_context(snapshot, sandbox, container, HookManager(container))
+
+    async def test_wrappers_are_shared_and_see_live_state(self):
+        from plugins.core_engine.state import create_sub_execution_context
+        context = self.make_context()
+        first, second = build_evaluation_context(context), build_evaluation_context(context, pipe_vars={"x": 1})
+        assert first is not second
+        assert first["moment"] is second["moment"] and first["run"] is second["run"]
+        assert "pipe" not in first and second["pipe"].x == 1
+
+        context.shared.moment_state["hp"] = 5
+        context.node_states["A"] = {"output": "a"}
+        assert await evaluate_expression("moment.hp", first, asyncio.Lock()) == 5
+        assert await evaluate_expression("nodes.A.output", first, asyncio.Lock()) == "a"
+
+        # 子图共享基础层，但拥有自己的 run/nodes
+        sub = build_evaluation_context(create_sub_execution_context(context, {"depth": 1}))
+        assert sub["lore"] is first["lore"]
+        assert sub["run"] is not first["run"] and sub["run"].depth == 1
+
+    async def test_per_call_context_can_be_extended_without_leaking(self):
+        context = self.make_context()
+        extended = build_evaluation_context(context)
+        extended["trigger"] = "t"
+        assert "trigger" not in build_evaluation_context(context)
+
+    async def test_replaced_state_rebuilds_layer(self):
+        context = self.make_context()
+        before = build_evaluation_context(context)
+        context.shared.moment_state = {"hp": 9}
+        after = build_evaluation_context(context)
+        assert after["moment"] is not before["moment"] and after["moment"].hp == 9
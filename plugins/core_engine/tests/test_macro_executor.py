@@ -0,0 +1,112 @@
+# plugins/core_engine/tests/test_macro_executor.py
+
+import asyncio
+import threading
+import pytest
+
+from backend.core.utils import DotAccessibleDict
+from plugins.core_engine import evaluation
+from plugins.core_engine.evaluation import evaluate_expression
+from plugins.core_engine.macro_executor import MacroExecutor
+from plugins.core_engine.macro_locks import MacroLockManager
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest.fixture
+def use_executor(monkeypatch):
+    """把模块级的宏执行器替换为测试专用的实例，测试结束后关闭它的池。"""
+    executors = []
+
+    def _use(**kwargs) -> MacroExecutor:
+        executor = MacroExecutor(**kwargs)
+        executors.append(executor)
+        monkeypatch.setattr(evaluation, "macro_executor", executor)
+        return executor
+
+    yield _use
+    for executor in executors:
+        executor.shutdown()
+
+
+class TestMacroExecutor:
+    """
+    【单元测试】
+    测试三种宏执行方式的路由以及排队统计。
+    """
+
+    async def test_unknown_mode_is_rejected(self):
+        with pytest.raises(ValueError, match="Unknown macro execution mode"):
+            MacroExecutor(mode="fiber")
+
+    async def test_cheap_macros_move_inline_after_first_measurement(self, use_executor):
+        executor = use_executor(mode="inline", inline_threshold_ms=50)
+        context = {"moment": DotAccessibleDict({"hp": 10})}
+        lock = MacroLockManager()
+
+        # 首次执行没有测量值，进入线程池；之后在事件循环上直接执行
+        for _ in range(3):
+            assert await evaluate_expression("x = moment.hp\nx * 2", context, lock) == 20
+        stats = executor.get_stats()
+        assert (stats["thread_runs"], stats["inline_runs"]) == (1, 2)
+
+    async def test_expensive_macros_stay_in_thread_pool(self, use_executor):
+        executor = use_executor(mode="inline", inline_threshold_ms=0)
+        for _ in range(2):
+            await evaluate_expression("sum(range(1000))", {}, MacroLockManager())
+        assert executor.get_stats()["inline_runs"] == 0
+
+    async def test_thread_mode_reports_queue_depth(self, use_executor):
+        executor = use_executor(mode="thread", max_threads=1)
+        context = {"moment": DotAccessibleDict({})}
+        macros = [f"moment.k{i} = 1" for i in range(4)]
+        await asyncio.gather(*(evaluate_expression(code, context, MacroLockManager()) for code in macros))
+
+        pool = executor.get_stats()["thread_pool"]
+        assert pool["submitted"] == 4
+        assert pool["max_workers"] == 1
+        assert pool["in_flight"] == 0 and pool["queue_depth"] == 0
+        assert pool["peak_queue_depth"] == 3
+        assert context["moment"]._data == {f"k{i}": 1 for i in range(4)}
+
+    async def test_process_mode_runs_only_pure_macros_in_processes(self, use_executor):
+        executor = use_executor(mode="process", max_processes=1)
+        moment = {"values": [1, 2, 3], "unrelated": "x" * 100}
+        context = {**evaluation.PRE_IMPORTED_MODULES, "moment": DotAccessibleDict(moment)}
+        lock = MacroLockManager()
+
+        assert await evaluate_expression("total = sum(moment.values)\ntotal * 2", context, lock) == 12
+        await evaluate_expression("moment.total = len(moment.values)", context, lock)
+
+        stats = executor.get_stats()
+        assert (stats["process_runs"], stats["thread_runs"]) == (1, 1)
+        assert moment["total"] == 3
+
+    async def test_macro_errors_in_process_propagate_without_fallback(self, use_executor):
+        executor = use_executor(mode="process", max_processes=1)
+        context = {**evaluation.PRE_IMPORTED_MODULES, "moment": DotAccessibleDict({"hp": 3})}
+
+        # 宏自身抛出的 TypeError 不是序列化失败，不应回退到线程池再执行一次
+        with pytest.raises(TypeError):
+            await evaluate_expression("len(moment.hp) + 1", context, MacroLockManager())
+        stats = executor.get_stats()
+        assert (stats["process_fallbacks"], stats["thread_runs"]) == (0, 0)
+
+    async def test_unpicklable_scopes_fall_back_to_thread_pool(self, use_executor):
+        executor = use_executor(mode="process", max_processes=1)
+        context = {**evaluation.PRE_IMPORTED_MODULES, "moment": DotAccessibleDict({"lock": threading.Lock(), "hp": 3})}
+
+        assert await evaluate_expression("moment.hp + (1 if moment.lock else 0)", context, MacroLockManager()) == 4
+        stats = executor.get_stats()
+        assert (stats["process_runs"], stats["process_fallbacks"], stats["thread_runs"]) == (0, 1, 1)
+
+    async def test_scopes_sent_to_process_are_trimmed_to_read_keys(self):
+        compiled = evaluation.compile_macro("moment.player.hp + len(lore.world)")
+        context = {
+            **evaluation.PRE_IMPORTED_MODULES,
+            "moment": DotAccessibleDict({"player": {"hp": 1}, "big": [0] * 1000}),
+            "lore": DotAccessibleDict({"world": {"name": "Hevno"}}),
+            "services": object(),
+        }
+        scopes = MacroExecutor._collect_scopes(compiled, context)
+        assert scopes == {"moment": {"player": {"hp": 1}}, "lore": {"world": {"name": "Hevno"}}}
@@ -0,0 +1,124 @@
+# plugins/core_engine/tests/test_macro_locks.py
+
+import ast
+import asyncio
+import pytest
+
+from plugins.core_engine.macro_locks import MacroAccess, MacroLockManager, analyze_macro_access
+
+pytestmark = pytest.mark.asyncio
+
+
+def access_of(code: str) -> MacroAccess:
+    return analyze_macro_access(ast.parse(code))
+
+
+class TestMacroAccessAnalysis:
+    """
+    【单元测试】
+    测试宏读写集合的静态分析。
+    """
+
+    async def test_reads_are_keyed_by_scope_and_top_level_key(self):
+        access = access_of("moment.player.hp + lore['world'].name")
+        assert access.is_pure
+        assert access.reads == {("moment", "player"), ("lore", "world")}
+
+    async def test_assignments_and_mutating_calls_are_writes(self):
+        assert access_of("moment.counter += 1").writes == {("moment", "counter")}
+        assert access_of("moment.inventory.append(1)").writes == {("moment", "inventory")}
+        assert access_of("del lore.old").writes == {("lore", "old")}
+
+    async def test_aliasing_is_treated_as_write(self):
+        access = access_of("inv = moment.inventory\ninv.append('x')")
+        assert ("moment", "inventory") in access.writes
+
+    async def test_pure_function_arguments_are_reads(self):
+        assert access_of("len(moment.items)").is_pure
+        assert not access_of("random.shuffle(moment.deck)").is_pure
+
+    async def test_dynamic_keys_lock_whole_scope(self):
+        assert access_of("moment[k]").reads == {("moment", None)}
+        # 对作用域本身调用方法时既无法确定键，也无法排除修改
+        assert access_of("moment.get('hp')").writes == {("moment", None)}
+        # 与 dict 方法同名的键同样按整个作用域处理
+        assert access_of("moment.items").reads == {("moment", None)}
+
+    async def test_unanalyzable_macros_are_exclusive(self):
+        assert access_of("services.x").exclusive
+        assert access_of("eval('1')").exclusive
+        assert access_of("source.item.value = 1").exclusive
+        assert access_of("f().x = 1").exclusive
+
+    async def test_conflicts(self):
+        reader = access_of("moment.a")
+        writer_a = access_of("moment.a = 1")
+        writer_b = access_of("moment.b = 1")
+        whole = access_of("moment[k] = 1")
+        assert not reader.conflicts_with(access_of("moment.a + 1"))
+        assert reader.conflicts_with(writer_a)
+        assert not writer_a.conflicts_with(writer_b)
+        assert whole.conflicts_with(writer_b)
+
+
+class TestMacroLockManager:
+    """
+    【单元测试】
+    测试按 (作用域, 键) 加锁的读写锁：读者并发、写者互斥、不相关的写者并发、公平排队。
+    """
+
+    async def _hold(self, manager: MacroLockManager, access: MacroAccess, log: list, name: str, delay: float = 0.02):
+        async with manager.acquire(access):
+            log.append(("start", name))
+            await asyncio.sleep(delay)
+            log.append(("end", name))
+
+    @staticmethod
+    def overlapped(log: list, a: str, b: str) -> bool:
+        return log.index(("start", b)) < log.index(("end", a)) and log.index(("start", a)) < log.index(("end", b))
+
+    async def test_readers_run_concurrently(self):
+        manager, log = MacroLockManager(), []
+        reader = access_of("moment.a")
+        await asyncio.gather(self._hold(manager, reader, log, "r1"), self._hold(manager, reader, log, "r2"))
+        assert self.overlapped(log, "r1", "r2")
+        assert manager.get_stats() == {"holders": 0, "waiters": 0}
+
+    async def test_writers_on_same_key_are_serialized(self):
+        manager, log = MacroLockManager(), []
+        writer = access_of("moment.a = 1")
+        await asyncio.gather(self._hold(manager, writer, log, "w1"), self._hold(manager, writer, log, "w2"))
+        assert not self.overlapped(log, "w1", "w2")
+
+    async def test_writers_on_disjoint_keys_run_concurrently(self):
+        manager, log = MacroLockManager(), []
+        await asyncio.gather(
+            self._hold(manager, access_of("moment.a = 1"), log, "a"),
+            self._hold(manager, access_of("moment.b = 1"), log, "b"),
+        )
+        assert self.overlapped(log, "a", "b")
+
+    async def test_waiting_writer_is_not_starved_by_later_readers(self):
+        manager, log = MacroLockManager(), []
+        reader, writer = access_of("moment.a"), access_of("moment.a = 1")
+        first = asyncio.create_task(self._hold(manager, reader, log, "r1"))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(self._hold(manager, writer, log, "w"))
+        await asyncio.sleep(0)
+        third = asyncio.create_task(self._hold(manager, reader, log, "r2"))
+        await asyncio.gather(first, second, third)
+        assert log.index(("start", "w")) < log.index(("start", "r2"))
+
+    async def test_cancelled_waiter_is_removed(self):
+        manager, log = MacroLockManager(), []
+        writer = access_of("moment.a = 1")
+        holder = asyncio.create_task(self._hold(manager, writer, log, "w1"))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(self._hold(manager, writer, log, "w2"))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        await holder
+        assert manager.get_stats() == {"holders": 0, "waiters": 0}
+        assert ("start", "w2") not in log
@@ -0,0 +1,128 @@
+# plugins/core_engine/tests/test_macro_stats.py
+
+import asyncio
+import pytest
+from typing import Tuple
+from httpx import AsyncClient
+
+from backend.core.contracts import Container, HookManager
+from plugins.core_engine import evaluation
+from plugins.core_engine.contracts import ExecutionEngineInterface, GraphCollection, Sandbox
+from plugins.core_engine.evaluation import evaluate_data, evaluate_expression
+from plugins.core_engine.macro_stats import MacroStatsCollector, macro_origin
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest.fixture
+def enabled_stats():
+    """在测试期间开启模块级的宏热点统计，结束后恢复原状。"""
+    stats = evaluation.macro_stats
+    was_enabled = stats.enabled
+    stats.reset()
+    stats.enabled = True
+    yield stats
+    stats.enabled = was_enabled
+    stats.reset()
+
+
+class TestMacroStatsCollector:
+    """
+    【单元测试】
+    测试按宏源码汇总的统计、排序与容量上限。
+    """
+
+    async def test_record_and_top(self):
+        stats = MacroStatsCollector(enabled=True)
+        stats.record("a", "node:A", 5.0, lock_wait_ms=1.0, exec_ms=3.0)
+        stats.record("a", "node:B", 1.0)
+        stats.record("b", "codex:lore/e1", 4.0, failed=True)
+
+        top = stats.top(1)
+        assert [row["source"] for row in top] == ["a"]
+        assert top[0]["calls"] == 2 and top[0]["max_ms"] == 5.0 and top[0]["avg_ms"] == 3.0
+        assert {o["origin"] for o in top[0]["origins"]} == {"node:A", "node:B"}
+        assert stats.top(1, sort_by="max_ms")[0]["source"] == "a"
+        assert stats.top(5, sort_by="calls")[1]["errors"] == 1
+
+    async def test_bounded_entries_and_invalid_sort(self):
+        stats = MacroStatsCollector(enabled=True, max_entries=1)
+        stats.record("a", None, 1.0)
+        stats.record("b", None, 1.0)
+        assert stats.get_stats()["tracked_macros"] == 1 and stats.dropped == 1
+        with pytest.raises(ValueError):
+            stats.top(sort_by="nope")
+
+    async def test_disabled_by_default(self):
+        assert MacroStatsCollector().enabled is False
+
+
+class TestMacroStatsInstrumentation:
+    """
+    【集成测试】
+    evaluate_expression 在统计开启时记录耗时、锁等待和执行时间，并按来源归属。
+    """
+
+    async def test_expression_timings_and_origin(self, enabled_stats: MacroStatsCollector):
+        with macro_origin("codex:lore/dragon"):
+            await evaluate_expression("x = 1\nx + 1", {}, asyncio.Lock())
+            await evaluate_data("HP {{ 3 }}", {}, asyncio.Lock())
+
+        rows = {row["source"]: row for row in enabled_stats.top(10)}
+        assert rows["x = 1\nx + 1"]["exec_ms"] > 0
+        assert rows["x = 1\nx + 1"]["origins"] == [{"origin": "codex:lore/dragon", "calls": 1}]
+        # 模板中的查找式占位符同样被计入
+        assert rows["3"]["calls"] == 1
+
+    async def test_lock_wait_is_measured(self, enabled_stats: MacroStatsCollector):
+        lock = asyncio.Lock()
+        await lock.acquire()
+        task = asyncio.create_task(evaluate_expression("y = 2\ny", {}, lock))
+        await asyncio.sleep(0.05)
+        lock.release()
+        assert await task == 2
+        assert enabled_stats.top(1)[0]["lock_wait_ms"] >= 40
+
+    async def test_engine_attributes_macros_to_nodes(
+        self,
+        enabled_stats: MacroStatsCollector,
+        test_engine_setup: Tuple[ExecutionEngineInterface, Container, HookManager],
+        sandbox_factory: callable,
+        linear_collection: GraphCollection
+    ):
+        engine, _, _ = test_engine_setup
+        sandbox = await sandbox_factory(graph_collection=linear_collection)
+        await engine.step(sandbox, {})
+
+        # 全宏的源码保留了右花括号前的空白
+        origins = {row["source"].strip(): [o["origin"] for o in row["origins"]] for row in enabled_stats.top(50)}
+        assert origins["f'The story is: {nodes.A.output}'"] == ["node:B"]
+        assert origins["nodes.B.output"] == ["node:C"]
+
+
+@pytest.mark.e2e
+class TestMacroStatsAPI:
+    """
+    【E2E测试】
+    热点统计通过 /api/system/macros 开关、查询与重置，并出现在系统报告中。
+    """
+
+    async def test_toggle_query_and_report(self, client: AsyncClient, sandbox_in_db: Sandbox):
+        try:
+            response = await client.put("/api/system/macros/stats", json={"enabled": True})
+            assert response.json() == {"enabled": True}
+
+            await client.post(f"/api/sandboxes/{sandbox_in_db.id}/step", json={})
+            response = await client.get("/api/system/macros/top", params={"n": 1})
+            assert response.status_code == 200
+            body = response.json()
+            assert body["enabled"] is True and len(body["macros"]) <= 1
+
+            report = (await client.get("/api/system/report")).json()["macro_stats"]
+            assert report["enabled"] is True
+
+            response = await client.get("/api/system/macros/top", params={"sort_by": "bogus"})
+            assert response.status_code == 400
+        finally:
+            await client.put("/api/system/macros/stats", json={"enabled": False})
+            await client.delete("/api/system/macros/stats")
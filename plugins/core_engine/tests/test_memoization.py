@@ -0,0 +1,115 @@
+# plugins/core_engine/tests/test_memoization.py
+
+import pytest
+from typing import Tuple
+
+from plugins.core_engine.contracts import GraphCollection, ExecutionEngineInterface
+from plugins.core_engine.memoization import extract_macro_reads
+from backend.core.contracts import Container, HookManager
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest.fixture
+def memoized_persona_collection() -> GraphCollection:
+    return GraphCollection.model_validate({"main": {"nodes": [
+        {"id": "setter", "run": [{"runtime": "system.io.input", "config": {
+            "value": "{{ moment.persona = run.triggering_input.persona }}"
+        }}]},
+        {"id": "persona", "depends_on": ["setter"], "metadata": {"memoize": True}, "run": [
+            {"runtime": "system.io.input", "config": {"value": "Persona: {{ moment.persona }}"}}
+        ]},
+        {"id": "lucky", "metadata": {"memoize": True}, "run": [
+            {"runtime": "system.io.input", "config": {"value": "{{ random.randint(1, 6) }}"}}
+        ]},
+        {"id": "plain", "run": [{"runtime": "system.io.input", "config": {"value": "{{ moment.persona }}"}}]}
+    ]}})
+
+
+def _memoized_node_ids(sandbox) -> list:
+    log = getattr(sandbox, "_temp_diagnostics_log", None) or []
+    return [entry["node_id"] for entry in log if entry.get("type") == "node_memoized"]
+
+
+class TestIncrementalMemoization:
+    """
+    【集成测试】
+    测试可选的节点记忆化：输入指纹（节点定义 + 上游结果 + 宏读取的状态路径）
+    与上一个快照中记录的一致时，节点直接复用上一步的结果。
+    """
+
+    async def test_unchanged_inputs_reuse_previous_output(
+        self,
+        test_engine_setup: Tuple[ExecutionEngineInterface, Container, HookManager],
+        sandbox_factory: callable,
+        memoized_persona_collection: GraphCollection
+    ):
+        engine, container, _ = test_engine_setup
+        snapshot_store = container.resolve("snapshot_store")
+        sandbox = await sandbox_factory(graph_collection=memoized_persona_collection)
+
+        sandbox = await engine.step(sandbox, {"persona": "cat"})
+        first = snapshot_store.get(sandbox.head_snapshot_id)
+        assert _memoized_node_ids(sandbox) == []
+        assert first.run_output["persona"]["output"] == "Persona: cat"
+        # 只有请求了记忆化且确定性的节点才会记录指纹
+        assert set(first.memo_fingerprints) == {"persona"}
+        # 指纹不属于节点输出，不应混入 run_output
+        assert "__memo__" not in first.run_output
+
+        sandbox = await engine.step(sandbox, {"persona": "cat"})
+        second = snapshot_store.get(sandbox.head_snapshot_id)
+        assert _memoized_node_ids(sandbox) == ["persona"]
+        assert second.run_output["persona"] == first.run_output["persona"]
+        assert second.memo_fingerprints == first.memo_fingerprints
+
+    async def test_changed_state_invalidates_fingerprint(
+        self,
+        test_engine_setup: Tuple[ExecutionEngineInterface, Container, HookManager],
+        sandbox_factory: callable,
+        memoized_persona_collection: GraphCollection
+    ):
+        engine, container, _ = test_engine_setup
+        snapshot_store = container.resolve("snapshot_store")
+        sandbox = await sandbox_factory(graph_collection=memoized_persona_collection)
+
+        sandbox = await engine.step(sandbox, {"persona": "cat"})
+        fingerprint_cat = snapshot_store.get(sandbox.head_snapshot_id).memo_fingerprints["persona"]
+
+        sandbox = await engine.step(sandbox, {"persona": "dog"})
+        snapshot = snapshot_store.get(sandbox.head_snapshot_id)
+        assert _memoized_node_ids(sandbox) == []
+        assert snapshot.run_output["persona"]["output"] == "Persona: dog"
+        assert snapshot.memo_fingerprints["persona"] != fingerprint_cat
+
+    async def test_memoization_is_opt_in(
+        self,
+        test_engine_setup: Tuple[ExecutionEngineInterface, Container, HookManager],
+        sandbox_factory: callable,
+        linear_collection: GraphCollection
+    ):
+        engine, container, _ = test_engine_setup
+        sandbox = await sandbox_factory(graph_collection=linear_collection)
+
+        sandbox = await engine.step(sandbox, {})
+        sandbox = await engine.step(sandbox, {})
+
+        snapshot = container.resolve("snapshot_store").get(sandbox.head_snapshot_id)
+        assert snapshot.memo_fingerprints is None
+        assert _memoized_node_ids(sandbox) == []
+
+
+async def test_extract_macro_reads():
+    reads, deterministic = extract_macro_reads({
+        "a": "Hello {{ moment.player.name }}, at this moment {{ lore.world['era'] }}",
+        "b": ["{{ run.triggering_input.user_message }}", "plain moment.text is ignored"],
+    })
+    assert deterministic
+    assert reads == {
+        ("moment", ("player", "name")),
+        ("lore", ("world",)),
+        ("run", ("triggering_input", "user_message")),
+    }
+
+    _, deterministic = extract_macro_reads("{{ services.llm_service }}")
+    assert not deterministic
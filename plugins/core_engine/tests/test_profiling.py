@@ -0,0 +1,89 @@
+# plugins/core_engine/tests/test_profiling.py
+
+import pytest
+from typing import Tuple
+from httpx import AsyncClient
+
+from backend.core.contracts import Container, HookManager
+from plugins.core_engine.contracts import ExecutionEngineInterface, GraphCollection, Sandbox
+from plugins.core_engine.profiling import StepProfiler, get_current_profiler, profile_span, use_profiler
+
+pytestmark = pytest.mark.asyncio
+
+
+class TestStepProfiler:
+    """
+    【单元测试】
+    测试 span 的记录、按节点汇总以及未启用时的空操作。
+    """
+
+    async def test_spans_are_recorded_and_aggregated(self):
+        profiler = StepProfiler()
+        with use_profiler(profiler):
+            with profile_span("A", "node", node_id="A"):
+                with profile_span("evaluate_data", "macro", node_id="A", instruction=0):
+                    pass
+            with profile_span("save", "persistence"):
+                pass
+        assert get_current_profiler() is None
+
+        timeline = profiler.timeline()
+        assert [s.name for s in timeline.spans] == ["A", "evaluate_data", "save"]
+        assert timeline.spans[1].instruction == 0
+        assert set(timeline.nodes["A"]) == {"node", "macro"}
+        assert timeline.total_ms >= timeline.spans[-1].start_ms
+
+    async def test_profile_span_without_profiler_is_noop(self):
+        with profile_span("ignored", "node", node_id="x"):
+            pass
+        assert get_current_profiler() is None
+
+
+class TestEngineProfiling:
+    """
+    【集成测试】
+    engine.step 在提供 profiler 时记录图、节点、指令各阶段和提交阶段的耗时。
+    """
+
+    async def test_step_records_all_phases(
+        self,
+        test_engine_setup: Tuple[ExecutionEngineInterface, Container, HookManager],
+        sandbox_factory: callable,
+        linear_collection: GraphCollection
+    ):
+        engine, _, _ = test_engine_setup
+        sandbox = await sandbox_factory(graph_collection=linear_collection)
+        profiler = StepProfiler()
+
+        await engine.step(sandbox, {}, profiler=profiler)
+        timeline = profiler.timeline()
+
+        categories = {s.category for s in timeline.spans}
+        assert categories >= {"graph", "node", "hook", "macro", "concurrency_wait", "runtime", "snapshot", "persistence"}
+        assert set(timeline.nodes) == {"A", "B", "C"}
+        for node_id in ("A", "B", "C"):
+            assert {"node", "macro", "runtime"} <= set(timeline.nodes[node_id])
+
+        # 依赖关系体现在时间线上：B 在 A 结束后才开始
+        node_spans = {s.node_id: s for s in timeline.spans if s.category == "node"}
+        assert node_spans["B"].start_ms >= node_spans["A"].start_ms + node_spans["A"].duration_ms
+
+
+@pytest.mark.e2e
+class TestProfilingAPI:
+    """
+    【E2E测试】
+    /step?profile=true 在 diagnostics.profile 中返回时间线，默认不返回。
+    """
+
+    async def test_profile_is_opt_in(self, client: AsyncClient, sandbox_in_db: Sandbox):
+        response = await client.post(f"/api/sandboxes/{sandbox_in_db.id}/step", json={})
+        assert response.status_code == 200
+        assert response.json()["diagnostics"]["profile"] is None
+
+        response = await client.post(f"/api/sandboxes/{sandbox_in_db.id}/step", params={"profile": "true"}, json={})
+        assert response.status_code == 200
+        profile = response.json()["diagnostics"]["profile"]
+        assert profile["spans"][0]["category"] == "queue"
+        assert any(span["category"] == "persistence" for span in profile["spans"])
+        assert profile["total_ms"] > 0
@@ -166,6 +166,10 @@ class TestResourceMutationAPI:
         assert history_data[1]["id"] == new_snapshot_id
         assert history_data[1]["parent_snapshot_id"] == original_snapshot_id
 
+        # 只取最新的一个快照
+        res_latest = await client.get(f"/api/sandboxes/{sandbox_id}/history", params={"limit": 1})
+        assert [s["id"] for s in res_latest.json()] == [new_snapshot_id]
+
     
     async def test_atomic_batch_mutation(self, client: AsyncClient, setup_sandbox: Sandbox):
         """测试一个请求中包含多个修改操作的原子性。"""
@@ -0,0 +1,144 @@
+# plugins/core_engine/tests/test_scheduling.py
+
+import pytest
+from typing import Tuple
+
+from plugins.core_engine.contracts import GraphCollection, GraphDefinition, ExecutionEngineInterface
+from backend.container import Container
+from backend.core.hooks import HookManager
+
+pytestmark = pytest.mark.asyncio
+
+SCHEDULER_NAMES = ["event", "worker_pool"]
+
+
+@pytest.mark.parametrize("scheduler", SCHEDULER_NAMES)
+class TestSchedulerParity:
+    """
+    【集成测试】
+    事件驱动调度器与工作者池调度器必须产生完全相同的执行语义：
+    依赖顺序、并行汇合、失败节点的下游跳过。
+    """
+
+    async def _step(self, engine, container, sandbox_factory, collection, monkeypatch, scheduler):
+        monkeypatch.setattr(engine, "scheduler", scheduler)
+        sandbox = await sandbox_factory(graph_collection=collection)
+        sandbox = await engine.step(sandbox, {})
+        return container.resolve("snapshot_store").get(sandbox.head_snapshot_id).run_output
+
+    async def test_linear_flow(
+        self,
+        scheduler: str,
+        monkeypatch,
+        test_engine_setup: Tuple[ExecutionEngineInterface, Container, HookManager],
+        sandbox_factory: callable,
+        linear_collection: GraphCollection
+    ):
+        engine, container, _ = test_engine_setup
+        output = await self._step(engine, container, sandbox_factory, linear_collection, monkeypatch, scheduler)
+
+        assert "The story is: a story about a cat" in output["B"]["output"]
+        assert "output" in output["C"]
+
+    async def test_parallel_flow(
+        self,
+        scheduler: str,
+        monkeypatch,
+        test_engine_setup: Tuple[ExecutionEngineInterface, Container, HookManager],
+        sandbox_factory: callable,
+        parallel_collection: GraphCollection
+    ):
+        engine, container, _ = test_engine_setup
+        output = await self._step(engine, container, sandbox_factory, parallel_collection, monkeypatch, scheduler)
+
+        assert output["merger"]["output"] == "Merged: Value A and Value B"
+
+    async def test_failure_skips_downstream(
+        self,
+        scheduler: str,
+        monkeypatch,
+        test_engine_setup: Tuple[ExecutionEngineInterface, Container, HookManager],
+        sandbox_factory: callable,
+        failing_node_collection: GraphCollection
+    ):
+        engine, container, _ = test_engine_setup
+        output = await self._step(engine, container, sandbox_factory, failing_node_collection, monkeypatch, scheduler)
+
+        assert "error" in output["B_fail"]
+        assert output["C_skip"]["status"] == "skipped"
+        assert output["D_independent"]["output"] == "independent"
+
+    async def test_map_flow(
+        self,
+        scheduler: str,
+        monkeypatch,
+        test_engine_setup: Tuple[ExecutionEngineInterface, Container, HookManager],
+        sandbox_factory: callable,
+        map_collection_basic: GraphCollection
+    ):
+        """子图（由 system.flow.map 驱动）同样使用所选的调度器。"""
+        engine, container, _ = test_engine_setup
+        output = await self._step(engine, container, sandbox_factory, map_collection_basic, monkeypatch, scheduler)
+
+        assert all("error" not in result for result in output.values() if isinstance(result, dict))
+
+
+async def test_graph_metadata_overrides_scheduler(
+    test_engine_setup: Tuple[ExecutionEngineInterface, Container, HookManager],
+    sandbox_factory: callable,
+    linear_collection: GraphCollection
+):
+    engine, container, _ = test_engine_setup
+    collection = linear_collection.model_copy(deep=True)
+    collection.root["main"].metadata["scheduler"] = "worker_pool"
+    assert engine._get_scheduler(collection.root["main"]).name == "worker_pool"
+
+    collection.root["main"].metadata["scheduler"] = "no_such_scheduler"
+    sandbox = await sandbox_factory(graph_collection=collection)
+    with pytest.raises(ValueError, match="Unknown scheduler"):
+        await engine.step(sandbox, {})
+
+
+class TestCriticalPathPriority:
+    """
+    【集成测试】
+    就绪节点按剩余关键路径长度排序：长链先启动，廉价的独立节点让路。
+    """
+
+    async def test_topological_priorities_without_history(self, isolated_engine, probe_node):
+        engine = isolated_engine().engine
+        graph_def = GraphDefinition.model_validate({"nodes": [
+            probe_node("cheap"), probe_node("L1"), probe_node("L2", ["L1"]), probe_node("L3", ["L2"])
+        ]})
+        plan = await engine.plan_cache.get_plan(graph_def)
+        priorities = engine.latency_tracker.critical_path_priorities(plan)
+
+        assert priorities == {"L3": 1.0, "L2": 2.0, "L1": 3.0, "cheap": 1.0}
+
+    @pytest.mark.parametrize("scheduler", SCHEDULER_NAMES)
+    async def test_long_chain_starts_first_when_saturated(self, scheduler: str, isolated_engine, probe_node):
+        harness = isolated_engine(scheduler=scheduler)
+        graph_def = GraphDefinition.model_validate({
+            "metadata": {"max_parallelism": 1},
+            "nodes": [probe_node(f"cheap_{i}") for i in range(3)] + [probe_node("L1"), probe_node("L2", ["L1"])]
+        })
+
+        await harness.run(graph_def)
+        assert harness.probe.started[0] == "L1"
+
+        harness.engine.prioritize_critical_path = False
+        await harness.run(graph_def)
+        assert harness.probe.started[0] == "cheap_0"
+
+    async def test_latency_history_reorders_equal_topologies(self, isolated_engine, probe_node):
+        harness = isolated_engine()
+        graph_def = GraphDefinition.model_validate({
+            "metadata": {"max_parallelism": 1},
+            "nodes": [probe_node("fast", delays=(0.0,)), probe_node("slow", delays=(0.02,))]
+        })
+
+        # 第一次运行没有历史，按声明顺序执行；之后 slow 的历史耗时使其优先
+        await harness.run(graph_def)
+        assert harness.probe.started == ["fast", "slow"]
+        await harness.run(graph_def)
+        assert harness.probe.started == ["slow", "fast"]
@@ -0,0 +1,136 @@
+# plugins/core_engine/tests/test_step_scheduler.py
+
+import asyncio
+import pytest
+from uuid import uuid4
+from httpx import AsyncClient
+
+from plugins.core_engine.contracts import Sandbox, StepQueueFullError
+from plugins.core_engine.step_scheduler import StepScheduler
+
+pytestmark = pytest.mark.asyncio
+
+
+async def _hold(scheduler: StepScheduler, sandbox_id, log: list, label, release: asyncio.Event = None):
+    async with scheduler.admit(sandbox_id) as ticket:
+        log.append(label)
+        if release is not None:
+            await release.wait()
+        else:
+            await asyncio.sleep(0)
+        return ticket.queue_wait_ms
+
+
+class TestStepScheduler:
+    """
+    【单元测试】
+    测试多租户 step 调度器：单沙盒串行、全局并发上限、加权公平准入、排队深度限制与取消。
+    """
+
+    async def test_same_sandbox_is_serialized_in_order(self):
+        scheduler = StepScheduler(max_concurrent_steps=4)
+        sandbox_id = uuid4()
+        release = asyncio.Event()
+        log = []
+
+        first = asyncio.create_task(_hold(scheduler, sandbox_id, log, 1, release))
+        others = [asyncio.create_task(_hold(scheduler, sandbox_id, log, i)) for i in (2, 3)]
+        await asyncio.sleep(0.01)
+        assert log == [1]
+        assert scheduler.get_stats()["waiting"] == 2
+
+        release.set()
+        await asyncio.gather(first, *others)
+        assert log == [1, 2, 3]
+        assert scheduler.get_stats()["active_sandboxes"] == 0
+
+    async def test_global_concurrency_cap(self):
+        scheduler = StepScheduler(max_concurrent_steps=2)
+        release = asyncio.Event()
+        log = []
+        tasks = [asyncio.create_task(_hold(scheduler, uuid4(), log, i, release)) for i in range(4)]
+        await asyncio.sleep(0.01)
+        assert len(log) == 2
+        assert scheduler.get_stats()["running"] == 2
+
+        release.set()
+        waits = await asyncio.gather(*tasks)
+        assert len(log) == 4
+        assert all(w >= 0 for w in waits)
+
+    async def test_weighted_fair_admission(self):
+        scheduler = StepScheduler(max_concurrent_steps=1)
+        heavy, light = uuid4(), uuid4()
+        scheduler.set_weight(light, 2.0)
+        blocker_release = asyncio.Event()
+        log = []
+
+        blocker = asyncio.create_task(_hold(scheduler, uuid4(), log, "blocker", blocker_release))
+        await asyncio.sleep(0)
+        tasks = [asyncio.create_task(_hold(scheduler, heavy, log, "heavy")) for _ in range(6)]
+        tasks += [asyncio.create_task(_hold(scheduler, light, log, "light")) for _ in range(6)]
+        await asyncio.sleep(0)
+
+        blocker_release.set()
+        await asyncio.gather(blocker, *tasks)
+
+        # 即使 heavy 先把请求全部排进队列，light 也不会被饿死，并按 2:1 的权重获得准入
+        first_six = log[1:7]
+        assert first_six.count("light") == 4
+        assert first_six.count("heavy") == 2
+
+    async def test_queue_depth_limit_rejects(self):
+        scheduler = StepScheduler(max_concurrent_steps=1, max_queue_depth=2, max_total_queued=3)
+        release = asyncio.Event()
+        sandbox_id = uuid4()
+        tasks = [asyncio.create_task(_hold(scheduler, sandbox_id, [], i, release)) for i in range(2)]
+        await asyncio.sleep(0)
+
+        with pytest.raises(StepQueueFullError):
+            async with scheduler.admit(sandbox_id):
+                pass
+
+        tasks += [asyncio.create_task(_hold(scheduler, uuid4(), [], i, release)) for i in range(2)]
+        await asyncio.sleep(0)
+        with pytest.raises(StepQueueFullError, match="Step queue is full"):
+            async with scheduler.admit(uuid4()):
+                pass
+        assert scheduler.get_stats()["rejected_total"] == 2
+
+        release.set()
+        await asyncio.gather(*tasks)
+
+    async def test_cancelled_waiter_leaves_queue(self):
+        scheduler = StepScheduler(max_concurrent_steps=1)
+        release = asyncio.Event()
+        log = []
+        holder = asyncio.create_task(_hold(scheduler, uuid4(), log, "holder", release))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(_hold(scheduler, uuid4(), log, "cancelled"))
+        await asyncio.sleep(0)
+        assert scheduler.get_stats()["waiting"] == 1
+
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert scheduler.get_stats()["waiting"] == 0
+
+        release.set()
+        await holder
+        assert log == ["holder"]
+        assert scheduler.get_stats()["running"] == 0
+
+
+@pytest.mark.e2e
+async def test_concurrent_steps_on_one_sandbox_build_linear_history(client: AsyncClient, sandbox_in_db: Sandbox):
+    """并发提交到同一沙盒的 step 必须依次从上一个头快照出发，形成一条线性历史。"""
+    responses = await asyncio.gather(*[
+        client.post(f"/api/sandboxes/{sandbox_in_db.id}/step", json={}) for _ in range(3)
+    ])
+    assert all(r.status_code == 200 for r in responses)
+    for r in responses:
+        assert r.json()["diagnostics"]["queue_wait_ms"] >= 0
+
+    history = (await client.get(f"/api/sandboxes/{sandbox_in_db.id}/history")).json()
+    parents = [s["parent_snapshot_id"] for s in history if s["parent_snapshot_id"]]
+    assert len(parents) == 3
+    assert len(set(parents)) == 3
@@ -0,0 +1,84 @@
+# plugins/core_engine/tests/test_step_streaming.py
+
+import json
+import pytest
+from typing import List, Tuple
+from httpx import AsyncClient
+
+from plugins.core_engine.contracts import GraphCollection, ExecutionEngineInterface, Sandbox
+from backend.core.contracts import Container, HookManager
+
+pytestmark = pytest.mark.asyncio
+
+
+def _parse_sse(body: str) -> List[Tuple[str, dict]]:
+    events = []
+    for block in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines() if ": " in line)
+        events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+
+class TestStepEventSink:
+    """
+    【集成测试】
+    engine.step 的 event_sink 在节点产生结果时即推送事件。
+    """
+
+    async def test_events_follow_node_lifecycle(
+        self,
+        test_engine_setup: Tuple[ExecutionEngineInterface, Container, HookManager],
+        sandbox_factory: callable,
+        failing_node_collection: GraphCollection
+    ):
+        engine, _, _ = test_engine_setup
+        sandbox = await sandbox_factory(graph_collection=failing_node_collection)
+        events = []
+
+        await engine.step(sandbox, {}, event_sink=lambda event, payload: events.append((event, payload)))
+
+        by_node = {}
+        for event, payload in events:
+            by_node.setdefault(payload["node_id"], []).append(event)
+        assert by_node["A_ok"] == ["node_started", "node_succeeded"]
+        assert by_node["B_fail"] == ["node_started", "node_failed"]
+        assert by_node["C_skip"] == ["node_skipped"]
+        assert by_node["D_independent"] == ["node_started", "node_succeeded"]
+
+        succeeded = next(p for e, p in events if e == "node_succeeded" and p["node_id"] == "A_ok")
+        assert succeeded["result"] == {"output": "start"}
+        assert succeeded["memoized"] is False
+
+
+@pytest.mark.e2e
+class TestStreamingStepAPI:
+    """
+    【E2E测试】
+    测试 POST /api/sandboxes/{id}/step:stream 的 Server-Sent Events 输出。
+    """
+
+    async def test_stream_emits_node_events_and_committed_snapshot(self, client: AsyncClient, sandbox_in_db: Sandbox):
+        async with client.stream("POST", f"/api/sandboxes/{sandbox_in_db.id}/step:stream", json={}) as response:
+            assert response.status_code == 200
+            assert response.headers["content-type"].startswith("text/event-stream")
+            body = "".join([chunk async for chunk in response.aiter_text()])
+
+        events = _parse_sse(body)
+        names = [name for name, _ in events]
+        assert names[0] == "step_started"
+        assert names[-1] == "step_completed"
+        # 线性图 A -> B -> C：每个节点都先开始再成功，且按依赖顺序完成
+        succeeded = [p["node_id"] for name, p in events if name == "node_succeeded"]
+        assert succeeded == ["A", "B", "C"]
+        assert names.index("node_started") < names.index("node_succeeded")
+
+        completed = events[-1][1]
+        assert completed["snapshot_id"] == completed["sandbox"]["head_snapshot_id"]
+        assert completed["diagnostics"]["queue_wait_ms"] >= 0
+
+        response = await client.get(f"/api/sandboxes/{sandbox_in_db.id}/history")
+        assert completed["snapshot_id"] in [s["id"] for s in response.json()]
+
+    async def test_stream_unknown_sandbox_is_404(self, client: AsyncClient):
+        response = await client.post("/api/sandboxes/00000000-0000-0000-0000-000000000000/step:stream", json={})
+        assert response.status_code == 404
@@ -0,0 +1,135 @@
+# plugins/core_engine/tests/test_timeouts.py
+
+import json
+import time
+import pytest
+from typing import Tuple
+from httpx import AsyncClient
+
+from backend.container import Container
+from backend.core.hooks import HookManager
+from plugins.core_engine.contracts import (
+    ExecutionEngineInterface, GraphCollection, GraphDefinition, StepDeadlineExceededError
+)
+from plugins.core_engine.timeouts import get_instruction_timeouts, parse_timeout
+
+pytestmark = pytest.mark.asyncio
+
+
+class TestNodeTimeouts:
+    """
+    【集成测试】
+    节点 metadata 中声明的节点级与指令级超时：超时的节点失败，其下游被跳过。
+    """
+
+    async def test_node_timeout_fails_node_and_skips_downstream(self, isolated_engine, probe_node):
+        harness = isolated_engine()
+        graph_def = GraphDefinition.model_validate({"nodes": [
+            probe_node("slow", delays=(0.0, 1.0), metadata={"timeout": 0.05}),
+            probe_node("after_slow", depends_on=["slow"]),
+            probe_node("independent"),
+        ]})
+        results = await harness.run(graph_def)
+
+        assert results["slow"]["timeout"] is True
+        assert "timed out after 0.05s" in results["slow"]["error"]
+        assert results["after_slow"]["status"] == "skipped"
+        assert results["independent"]["output"] == "independent"
+        assert harness.probe.cancelled == 1
+
+    async def test_instruction_timeouts_per_index(self, isolated_engine, probe_node):
+        graph_def = GraphDefinition.model_validate({"nodes": [
+            probe_node("pipeline", delays=(0.0, 1.0), metadata={"instruction_timeout": [None, 0.05]}),
+        ]})
+        results = await isolated_engine().run(graph_def)
+
+        assert results["pipeline"]["failed_step"] == 1
+        assert results["pipeline"]["timeout"] is True
+        assert "Step 2 ('test.probe') timed out" in results["pipeline"]["error"]
+
+    async def test_invalid_timeout_fails_node(self, isolated_engine, probe_node):
+        graph_def = GraphDefinition.model_validate({"nodes": [probe_node("bad", metadata={"timeout": -1})]})
+        results = await isolated_engine().run(graph_def)
+        assert "metadata.timeout must be a positive number" in results["bad"]["error"]
+
+    async def test_parse_helpers(self, probe_node):
+        assert parse_timeout("2.5", "t") == 2.5
+        assert parse_timeout(None, "t") is None
+        with pytest.raises(ValueError):
+            parse_timeout(True, "t")
+        node = GraphDefinition.model_validate({"nodes": [
+            probe_node("n", delays=(0, 0, 0), metadata={"instruction_timeout": 3})
+        ]}).nodes[0]
+        assert get_instruction_timeouts(node) == [3.0, 3.0, 3.0]
+
+
+class TestStepDeadline:
+    """
+    【集成测试】
+    step 截止时间到期时取消运行中的节点，未开始的节点被标记为跳过，且不提交快照。
+    """
+
+    async def test_deadline_cancels_running_and_skips_pending(self, isolated_engine, probe_node):
+        harness = isolated_engine()
+        graph_def = GraphDefinition.model_validate({"nodes": [
+            probe_node("fast"),
+            probe_node("slow", delays=(1.0,), depends_on=["fast"]),
+            probe_node("after_slow", depends_on=["slow"]),
+        ]})
+        started = time.monotonic()
+        with pytest.raises(StepDeadlineExceededError) as exc_info:
+            await harness.run(graph_def, deadline=time.monotonic() + 0.05)
+        assert time.monotonic() - started < 0.5
+
+        results = exc_info.value.node_results
+        assert results["fast"]["output"] == "fast"
+        assert results["slow"]["cancelled"] is True
+        assert results["after_slow"] == {"status": "skipped", "reason": "Step deadline exceeded."}
+        assert harness.probe.cancelled == 1
+
+    async def test_deadline_does_not_commit_snapshot(
+        self,
+        test_engine_setup: Tuple[ExecutionEngineInterface, Container, HookManager],
+        sandbox_factory: callable,
+        runtime_probe,
+        probe_node
+    ):
+        engine, container, _ = test_engine_setup
+        engine.registry.register("test.probe", runtime_probe.runtime_class())
+        collection = GraphCollection.model_validate({"main": {"nodes": [probe_node("slow", delays=(1.0,))]}})
+        sandbox = await sandbox_factory(graph_collection=collection)
+        head_before = sandbox.head_snapshot_id
+        events = []
+
+        with pytest.raises(StepDeadlineExceededError):
+            await engine.step(
+                sandbox, {},
+                event_sink=lambda event, payload: events.append((event, payload["node_id"])),
+                deadline=time.monotonic() + 0.05
+            )
+
+        assert container.resolve("sandbox_store").get(sandbox.id).head_snapshot_id == head_before
+        assert events == [("node_started", "slow"), ("node_failed", "slow")]
+
+
+@pytest.mark.e2e
+async def test_step_endpoint_returns_504_on_timeout(
+    client: AsyncClient,
+    test_engine_setup: Tuple[ExecutionEngineInterface, Container, HookManager],
+    sandbox_factory: callable,
+    runtime_probe,
+    probe_node
+):
+    engine, _, _ = test_engine_setup
+    engine.registry.register("test.probe", runtime_probe.runtime_class())
+    collection = GraphCollection.model_validate({"main": {"nodes": [probe_node("slow", delays=(1.0,))]}})
+    sandbox = await sandbox_factory(graph_collection=collection)
+
+    response = await client.post(f"/api/sandboxes/{sandbox.id}/step", params={"timeout": 0.05}, json={})
+    assert response.status_code == 504
+    assert response.json()["error_message"] == "Step deadline exceeded."
+
+    response = await client.post(f"/api/sandboxes/{sandbox.id}/step:stream", params={"timeout": 0.05}, json={})
+    last_block = response.text.strip().split("\n\n")[-1]
+    assert last_block.startswith("event: step_failed")
+    assert json.loads(last_block.split("data: ", 1)[1])["deadline_exceeded"] is True
@@ -0,0 +1,52 @@
+# plugins/core_engine/timeouts.py
+
+import time
+from typing import Any, List, Optional
+
+from .contracts import GenericNode
+
+# 节点 metadata 中声明超时（单位：秒）的键
+NODE_TIMEOUT_KEY = "timeout"
+INSTRUCTION_TIMEOUT_KEY = "instruction_timeout"
+
+
+def parse_timeout(value: Any, field: str) -> Optional[float]:
+    """将超时声明解析为正的秒数；None 表示不设超时。"""
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        raise ValueError(f"{field} must be a positive number of seconds, got {value!r}.")
+    try:
+        timeout = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{field} must be a positive number of seconds, got {value!r}.")
+    if timeout <= 0:
+        raise ValueError(f"{field} must be a positive number of seconds, got {value!r}.")
+    return timeout
+
+
+def get_node_timeout(node: GenericNode) -> Optional[float]:
+    """节点整体（所有指令加起来）的超时：metadata.timeout。"""
+    return parse_timeout(node.metadata.get(NODE_TIMEOUT_KEY), f"metadata.{NODE_TIMEOUT_KEY}")
+
+
+def get_instruction_timeouts(node: GenericNode) -> List[Optional[float]]:
+    """
+    每条指令的运行时超时：metadata.instruction_timeout。
+    可以是一个数字（应用于所有指令），也可以是与 run 列表按下标对齐的列表（null 表示该指令不设超时）。
+    """
+    raw = node.metadata.get(INSTRUCTION_TIMEOUT_KEY)
+    field = f"metadata.{INSTRUCTION_TIMEOUT_KEY}"
+    if isinstance(raw, list):
+        if len(raw) > len(node.run):
+            raise ValueError(f"{field} has {len(raw)} entries but node '{node.id}' only has {len(node.run)} instructions.")
+        timeouts = [parse_timeout(value, f"{field}[{i}]") for i, value in enumerate(raw)]
+        return timeouts + [None] * (len(node.run) - len(timeouts))
+    return [parse_timeout(raw, field)] * len(node.run)
+
+
+def remaining_seconds(deadline: Optional[float]) -> Optional[float]:
+    """距离 time.monotonic() 时钟上的绝对截止时间还剩的秒数（不会小于 0）。"""
+    if deadline is None:
+        return None
+    return max(deadline - time.monotonic(), 0.0)
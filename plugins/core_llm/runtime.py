@@ -16,6 +16,7 @@ class LLMRuntime(RuntimeInterface):
     一个强大的运行时，它通过"列表展开"机制编排一个结构化的消息列表，
     然后通过 Hevno LLM Gateway 发起调用。
     """
+    concurrency_class = "llm"
     
     class MessagePart(BaseModel):
         type: Literal["MESSAGE_PART"] = "MESSAGE_PART"
@@ -70,11 +71,11 @@ class LLMRuntime(RuntimeInterface):
             return {"error": f"Invalid configuration for llm.default: {e}"}
 
         macro_service: MacroEvaluationServiceInterface = context.shared.services.macro_evaluation_service
-        lock = context.shared.global_write_lock
+        lock = context.shared.macro_locks
         
         final_messages: List[Dict[str, Any]] = []
+        eval_context = macro_service.build_context(context)
         for item_model in validated_config.contents:
-            eval_context = macro_service.build_context(context)
             if not await macro_service.evaluate(item_model.is_enabled, eval_context, lock):
                 continue
                 
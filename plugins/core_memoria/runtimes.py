@@ -27,6 +27,11 @@ class MemoriaAddRuntime(RuntimeInterface):
     def get_config_model(cls) -> Type[BaseModel]:
         return cls.ConfigModel
 
+    @classmethod
+    def get_dependency_config(cls) -> Dict[str, Any]:
+        # 写入 moment.memoria，跳过执行会丢失记忆条目
+        return {"memoizable": False}
+
     async def execute(self, config: Dict[str, Any], context: ExecutionContext, **kwargs) -> Dict[str, Any]:
         try:
             validated_config = self.ConfigModel.model_validate(config)
@@ -96,6 +101,10 @@ class MemoriaQueryRuntime(RuntimeInterface):
     def get_config_model(cls) -> Type[BaseModel]:
         return cls.ConfigModel
 
+    @classmethod
+    def get_dependency_config(cls) -> Dict[str, Any]:
+        return {"state_reads": ["moment.memoria"]}
+
     async def execute(self, config: Dict[str, Any], context: ExecutionContext, **kwargs) -> Dict[str, Any]:
         try:
             # (这里省略了您添加的日志代码，但假设它们都存在)
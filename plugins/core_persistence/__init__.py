@@ -4,7 +4,9 @@ import logging
 
 from backend.core.contracts import Container, HookManager
 from .service import PersistenceService
+from .chunks import ChunkedPersistenceService
 from .stores import PersistentSandboxStore, PersistentSnapshotStore
+from .retention import RetentionPolicy, SnapshotCompactor
 from .api import persistence_router
 
 logger = logging.getLogger(__name__)
@@ -13,12 +15,44 @@ def _create_persistent_sandbox_store(container: Container) -> PersistentSandboxS
     return PersistentSandboxStore(container.resolve("persistence_service"))
 
 def _create_persistent_snapshot_store(container: Container) -> PersistentSnapshotStore:
-    return PersistentSnapshotStore(container.resolve("persistence_service"))
+    # 每隔多少个快照保存一个完整关键帧（1 表示不使用增量），还原快照的 LRU 缓存容量，
+    # 以及按需加载的快照缓存的内存预算（MB，超出时按 LRU 淘汰，沙盒的 head 不会被淘汰）
+    keyframe_interval = int(os.getenv("HEVNO_SNAPSHOT_KEYFRAME_INTERVAL", "16"))
+    materialized_cache_size = int(os.getenv("HEVNO_SNAPSHOT_MATERIALIZED_CACHE", "128"))
+    cache_budget_mb = float(os.getenv("HEVNO_SNAPSHOT_CACHE_MB", "256"))
+    return PersistentSnapshotStore(
+        container.resolve("persistence_service"),
+        keyframe_interval=keyframe_interval,
+        materialized_cache_size=materialized_cache_size,
+        cache_budget_bytes=int(cache_budget_mb * 1024 * 1024),
+    )
 
 def _create_persistence_service() -> PersistenceService:
     assets_dir = os.getenv("HEVNO_ASSETS_DIR", "assets")
+    # "files": 每个快照一个完整的 JSON 文件；"chunks": 以内容寻址的块去重保存快照的子树
+    storage = os.getenv("HEVNO_SNAPSHOT_STORAGE", "files").lower()
+    if storage == "chunks":
+        min_chunk_bytes = int(os.getenv("HEVNO_SNAPSHOT_CHUNK_MIN_BYTES", "1024"))
+        # 块文本读缓存的内存预算（MB），独立于快照缓存的 HEVNO_SNAPSHOT_CACHE_MB
+        chunk_cache_mb = float(os.getenv("HEVNO_SNAPSHOT_CHUNK_CACHE_MB", "16"))
+        return ChunkedPersistenceService(
+            assets_base_dir=assets_dir, min_chunk_bytes=min_chunk_bytes,
+            cache_bytes=int(chunk_cache_mb * 1024 * 1024)
+        )
+    if storage != "files":
+        logger.warning(f"Unknown HEVNO_SNAPSHOT_STORAGE '{storage}', falling back to 'files'.")
     return PersistenceService(assets_base_dir=assets_dir)
 
+def _create_snapshot_compactor(container: Container) -> SnapshotCompactor:
+    # 每隔多少秒压缩一次所有沙盒的快照历史；0（默认）表示不自动压缩，快照永久保留
+    interval = float(os.getenv("HEVNO_SNAPSHOT_COMPACTION_INTERVAL", "0"))
+    policy = RetentionPolicy(
+        keep_last=int(os.getenv("HEVNO_SNAPSHOT_KEEP_LAST", "50")),
+        thin_after_seconds=float(os.getenv("HEVNO_SNAPSHOT_THIN_AFTER_SECONDS", "86400")),
+        thin_every=int(os.getenv("HEVNO_SNAPSHOT_THIN_EVERY", "10")),
+    )
+    return SnapshotCompactor(container, policy, interval_seconds=interval)
+
 async def provide_router(routers: list) -> list:
     routers.append(persistence_router)
     logger.debug("Provided 'persistence_router' to the application.")
@@ -33,6 +67,13 @@ async def initialize_stores(container: Container):
     
     await sandbox_store.initialize()
 
+async def start_snapshot_compactor(container: Container):
+    """钩子实现: 后台工作者启动后开始定期压缩快照历史。"""
+    container.resolve("snapshot_compactor").start()
+
+async def stop_snapshot_compactor(container: Container):
+    await container.resolve("snapshot_compactor").stop()
+
 def register_plugin(container: Container, hook_manager: HookManager):
     logger.info("--> 正在注册 [core_persistence] 插件...")
     container.register(
@@ -44,6 +85,9 @@ def register_plugin(container: Container, hook_manager: HookManager):
     container.register(
         "snapshot_store", _create_persistent_snapshot_store, singleton=True
     )
+    container.register(
+        "snapshot_compactor", _create_snapshot_compactor, singleton=True
+    )
     logger.debug(
         "Registered 'sandbox_store' and 'snapshot_store' with persistent implementations."
     )
@@ -56,4 +100,10 @@ def register_plugin(container: Container, hook_manager: HookManager):
         priority=90, 
         plugin_name="core_persistence",
     )
+    hook_manager.add_implementation(
+        "app_startup_complete", start_snapshot_compactor, plugin_name="core_persistence"
+    )
+    hook_manager.add_implementation(
+        "app_shutdown", stop_snapshot_compactor, plugin_name="core_persistence"
+    )
     logger.info("插件 [core_persistence] 注册成功。")
\ No newline at end of file
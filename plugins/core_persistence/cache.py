@@ -0,0 +1,134 @@
+# plugins/core_persistence/cache.py
+"""
+快照存储的内存缓存：按 (sandbox_id, snapshot_id) 索引的 LRU，总大小受内存预算约束。
+每个沙盒当前的 head 快照（连同还原它所需的增量链）被钉住，不会因为其他快照的访问而被淘汰。
+"""
+
+from collections import OrderedDict
+from typing import Any, Dict, FrozenSet, Iterable, Iterator, List, Optional, Tuple
+from uuid import UUID
+
+import orjson
+
+CacheKey = Tuple[UUID, UUID]
+
+# 无法序列化时使用的估计值
+_FALLBACK_SIZE = 64 * 1024
+
+
+def estimate_size(data: Any) -> int:
+    """用序列化后的长度估计一份快照数据在内存中的体量（只用于预算，不要求精确）。"""
+    try:
+        return len(orjson.dumps(data, default=repr, option=orjson.OPT_NON_STR_KEYS))
+    except (TypeError, orjson.JSONEncodeError):
+        return _FALLBACK_SIZE
+
+
+class SnapshotCache:
+    """
+    一个受内存预算约束的 LRU 缓存。条目的大小由调用方给出；
+    超出预算时按最久未使用的顺序淘汰，被钉住的条目（每个沙盒的 head 及其增量链）跳过。
+    get 会更新访问顺序并计入命中/未命中，peek 只用于内部查找。
+    """
+    def __init__(self, budget_bytes: int):
+        self.budget_bytes = max(budget_bytes, 0)
+        self._entries: "OrderedDict[CacheKey, Tuple[Any, int]]" = OrderedDict()
+        self._keys: Dict[UUID, CacheKey] = {}
+        self._heads: Dict[UUID, UUID] = {}
+        self._pinned: Dict[UUID, FrozenSet[UUID]] = {}
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _is_pinned(self, key: CacheKey) -> bool:
+        pinned = self._pinned.get(key[0])
+        return pinned is not None and key[1] in pinned
+
+    def _evict(self):
+        skipped = 0
+        while self.size_bytes > self.budget_bytes and skipped < len(self._entries):
+            key = next(iter(self._entries))
+            if self._is_pinned(key):
+                self._entries.move_to_end(key)
+                skipped += 1
+                continue
+            _, size = self._entries.pop(key)
+            del self._keys[key[1]]
+            self.size_bytes -= size
+            self.evictions += 1
+
+    def get(self, snapshot_id: UUID) -> Optional[Any]:
+        key = self._keys.get(snapshot_id)
+        if key is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return self._entries[key][0]
+
+    def peek(self, snapshot_id: UUID) -> Optional[Any]:
+        key = self._keys.get(snapshot_id)
+        return self._entries[key][0] if key is not None else None
+
+    def put(self, sandbox_id: UUID, snapshot_id: UUID, value: Any, size: int):
+        self.pop(snapshot_id)
+        key = (sandbox_id, snapshot_id)
+        self._entries[key] = (value, size)
+        self._keys[snapshot_id] = key
+        self.size_bytes += size
+        self._evict()
+
+    def pop(self, snapshot_id: UUID) -> Optional[Any]:
+        key = self._keys.pop(snapshot_id, None)
+        if key is None:
+            return None
+        value, size = self._entries.pop(key)
+        self.size_bytes -= size
+        return value
+
+    def pin_head(self, sandbox_id: UUID, snapshot_id: Optional[UUID], chain: Iterable[UUID] = ()):
+        """钉住沙盒的 head 和 chain 中的快照；之前钉住的条目恢复为普通条目。"""
+        if snapshot_id is None:
+            self.unpin_sandbox(sandbox_id)
+        else:
+            self._heads[sandbox_id] = snapshot_id
+            self._pinned[sandbox_id] = frozenset((snapshot_id, *chain))
+        self._evict()
+
+    def head_of(self, sandbox_id: UUID) -> Optional[UUID]:
+        return self._heads.get(sandbox_id)
+
+    def unpin_sandbox(self, sandbox_id: UUID):
+        self._heads.pop(sandbox_id, None)
+        self._pinned.pop(sandbox_id, None)
+
+    def for_sandbox(self, sandbox_id: UUID) -> List[Tuple[UUID, Any]]:
+        return [(key[1], value) for key, (value, _) in self._entries.items() if key[0] == sandbox_id]
+
+    def values(self) -> Iterator[Any]:
+        return (value for value, _ in self._entries.values())
+
+    def __contains__(self, snapshot_id: UUID) -> bool:
+        return snapshot_id in self._keys
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self):
+        self._entries.clear()
+        self._keys.clear()
+        self.size_bytes = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "size_bytes": self.size_bytes,
+            "budget_bytes": self.budget_bytes,
+            "pinned_heads": len(self._heads),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+        }
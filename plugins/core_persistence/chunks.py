@@ -0,0 +1,326 @@
+# plugins/core_persistence/chunks.py
+"""
+内容寻址的快照存储。
+
+快照数据按 Merkle 方式切分：序列化后不小于 min_chunk_bytes 的子树以其内容的 SHA-256 命名，
+作为独立的块保存在 assets/chunks 下，父节点中只留下一个引用 {"__hevno_chunk__": <hash>}。
+块的内容中同样只包含子块的引用，因此相同的子树（例如未改变的 memoria、法典、图定义，
+或从同一个包导入的多个沙盒）无论出现在多少个快照中都只保存一次。
+较长的列表按固定长度分段（{"__hevno_chunks__": [<hash>, ...]}），向末尾追加只会产生一个新的尾段。
+
+每个块记录被引用的次数（来自快照文件和其他块），保存在 SQLite 表中以便增量更新；
+删除快照时引用计数归零的块连同它引用的子块一起被回收。
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+from uuid import UUID
+
+from backend.core.serialization import custom_json_decoder_object_hook
+from .service import PersistenceService
+
+logger = logging.getLogger(__name__)
+
+CHUNK_REF_KEY = "__hevno_chunk__"
+CHUNK_LIST_KEY = "__hevno_chunks__"
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+class _Encoding:
+    """一次切分的结果：根节点的 JSON 文本、新出现的块，以及每个块直接引用的子块。"""
+    __slots__ = ("root_text", "bodies", "children", "root_refs")
+
+    def __init__(self):
+        self.root_text = ""
+        self.bodies: Dict[str, str] = {}
+        self.children: Dict[str, List[str]] = {}
+        self.root_refs: List[str] = []
+
+
+class ChunkStore:
+    """
+    块的读写、切分与引用计数。所有方法都是同步的，并由一把线程锁串行化，调用方应在工作线程中调用。
+    """
+    def __init__(self, root_dir: Path, min_chunk_bytes: int = 1024, list_segment_items: int = 64,
+                 cache_bytes: int = 16 * 1024 * 1024):
+        self.root_dir = root_dir
+        self._objects_dir = root_dir / "objects"
+        self._objects_dir.mkdir(parents=True, exist_ok=True)
+        self.min_chunk_bytes = max(min_chunk_bytes, 1)
+        self.list_segment_items = max(list_segment_items, 1)
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(root_dir / "refcounts.sqlite3", check_same_thread=False, isolation_level=None)
+        # WAL 下每次提交只追加日志；限制日志在检查点之后保留的大小，避免它长期占用磁盘
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("PRAGMA journal_size_limit=1048576")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS chunks (hash TEXT PRIMARY KEY, refcount INTEGER NOT NULL, size INTEGER NOT NULL)"
+        )
+        # 块文本的 LRU 缓存，总长度受 cache_bytes 约束。只缓存不可变的文本，每次加载都重新解析，
+        # 这样不同快照拿到的是各自独立的对象，修改其中一个不会影响其他快照
+        self.cache_bytes = max(cache_bytes, 0)
+        self._texts: "OrderedDict[str, str]" = OrderedDict()
+        self._texts_size = 0
+        self.chunks_written = 0
+        self.chunks_reused = 0
+        self.bytes_written = 0
+        self.chunks_collected = 0
+
+    def _path(self, digest: str) -> Path:
+        return self._objects_dir / digest[:2] / f"{digest}.json"
+
+    # --- 切分 ---
+
+    def encode(self, data: Dict[str, Any]) -> _Encoding:
+        """自底向上切分数据（必须是 JSON 兼容的），根节点本身不切分。"""
+        encoding = _Encoding()
+        parts = [f"{_dumps(key)}:{self._encode_node(value, encoding, encoding.root_refs)}" for key, value in data.items()]
+        encoding.root_text = "{" + ",".join(parts) + "}"
+        return encoding
+
+    def _encode_node(self, value: Any, encoding: _Encoding, refs: List[str]) -> str:
+        """返回节点在父节点中的 JSON 文本：较大的子树被替换为块引用，并记入 refs。"""
+        if isinstance(value, dict):
+            child_refs: List[str] = []
+            parts = [f"{_dumps(key)}:{self._encode_node(item, encoding, child_refs)}" for key, item in value.items()]
+            return self._maybe_chunk("{" + ",".join(parts) + "}", child_refs, encoding, refs)
+        if isinstance(value, list):
+            segment = self.list_segment_items
+            if len(value) > segment:
+                # 长列表按固定边界分段，每段单独成块；追加元素只改变最后一段
+                segment_refs = []
+                for start in range(0, len(value), segment):
+                    child_refs = []
+                    body = "[" + ",".join(self._encode_node(item, encoding, child_refs) for item in value[start:start + segment]) + "]"
+                    segment_refs.append(self._add_chunk(body, child_refs, encoding))
+                refs.extend(segment_refs)
+                return _dumps({CHUNK_LIST_KEY: segment_refs})
+            child_refs = []
+            body = "[" + ",".join(self._encode_node(item, encoding, child_refs) for item in value) + "]"
+            return self._maybe_chunk(body, child_refs, encoding, refs)
+        return _dumps(value)
+
+    def _maybe_chunk(self, body: str, child_refs: List[str], encoding: _Encoding, refs: List[str]) -> str:
+        if len(body) < self.min_chunk_bytes:
+            # 内联的小子树中的引用归属于外层节点
+            refs.extend(child_refs)
+            return body
+        digest = self._add_chunk(body, child_refs, encoding)
+        refs.append(digest)
+        return _dumps({CHUNK_REF_KEY: digest})
+
+    @staticmethod
+    def _add_chunk(body: str, child_refs: List[str], encoding: _Encoding) -> str:
+        digest = hashlib.sha256(body.encode("utf-8")).hexdigest()
+        encoding.bodies[digest] = body
+        encoding.children[digest] = child_refs
+        return digest
+
+    # --- 引用计数 ---
+
+    def _refcount(self, digest: str) -> int:
+        row = self._db.execute("SELECT refcount FROM chunks WHERE hash = ?", (digest,)).fetchone()
+        return row[0] if row else 0
+
+    def _incref(self, digest: str, encoding: _Encoding):
+        if self._refcount(digest):
+            self._db.execute("UPDATE chunks SET refcount = refcount + 1 WHERE hash = ?", (digest,))
+            self.chunks_reused += 1
+            return
+        body = encoding.bodies[digest]
+        path = self._path(digest)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_text(body, encoding="utf-8")
+        os.replace(tmp_path, path)
+        self._db.execute("INSERT INTO chunks (hash, refcount, size) VALUES (?, 1, ?)", (digest, len(body)))
+        self.chunks_written += 1
+        self.bytes_written += len(body)
+        for child in encoding.children[digest]:
+            self._incref(child, encoding)
+
+    def _decref(self, digest: str):
+        refcount = self._refcount(digest)
+        if refcount > 1:
+            self._db.execute("UPDATE chunks SET refcount = refcount - 1 WHERE hash = ?", (digest,))
+            return
+        path = self._path(digest)
+        children = self._references_in(path.read_text(encoding="utf-8")) if path.is_file() else []
+        self._db.execute("DELETE FROM chunks WHERE hash = ?", (digest,))
+        path.unlink(missing_ok=True)
+        self._forget_text(digest)
+        self.chunks_collected += 1
+        for child in children:
+            self._decref(child)
+
+    @staticmethod
+    def _references_in(text: str) -> List[str]:
+        """找出一段 JSON 文本直接引用的块（不展开子块）。"""
+        refs: List[str] = []
+
+        def _hook(obj: dict) -> Any:
+            if CHUNK_REF_KEY in obj and len(obj) == 1:
+                refs.append(obj[CHUNK_REF_KEY])
+            elif CHUNK_LIST_KEY in obj and len(obj) == 1:
+                refs.extend(obj[CHUNK_LIST_KEY])
+            return obj
+
+        json.loads(text, object_hook=_hook)
+        return refs
+
+    # --- 快照文件 ---
+
+    def write_root(self, path: Path, data: Dict[str, Any]):
+        """切分并写入一个快照文件；覆盖已有文件时，先为新内容增加引用，再释放旧内容的引用。"""
+        encoding = self.encode(data)
+        with self._lock:
+            old_refs = self._references_in(path.read_text(encoding="utf-8")) if path.is_file() else []
+            self._db.execute("BEGIN")
+            try:
+                for digest in encoding.root_refs:
+                    self._incref(digest, encoding)
+                path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = path.with_suffix(".tmp")
+                tmp_path.write_text(encoding.root_text, encoding="utf-8")
+                os.replace(tmp_path, path)
+                self.bytes_written += len(encoding.root_text)
+                for digest in old_refs:
+                    self._decref(digest)
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def delete_root(self, path: Path):
+        """删除一个快照文件并释放它引用的块。"""
+        with self._lock:
+            if not path.is_file():
+                return
+            refs = self._references_in(path.read_text(encoding="utf-8"))
+            self._db.execute("BEGIN")
+            try:
+                for digest in refs:
+                    self._decref(digest)
+                path.unlink(missing_ok=True)
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def read_root(self, text: str) -> Dict[str, Any]:
+        """解析快照文件，展开其中的块引用。"""
+        with self._lock:
+            return json.loads(text, object_hook=self._decode_hook)
+
+    def _decode_hook(self, obj: dict) -> Any:
+        if len(obj) == 1:
+            if CHUNK_REF_KEY in obj:
+                return self._load_chunk(obj[CHUNK_REF_KEY])
+            if CHUNK_LIST_KEY in obj:
+                items: List[Any] = []
+                for digest in obj[CHUNK_LIST_KEY]:
+                    items.extend(self._load_chunk(digest))
+                return items
+        return custom_json_decoder_object_hook(obj)
+
+    def _load_chunk(self, digest: str) -> Any:
+        return json.loads(self._chunk_text(digest), object_hook=self._decode_hook)
+
+    def _chunk_text(self, digest: str) -> str:
+        text = self._texts.get(digest)
+        if text is not None:
+            self._texts.move_to_end(digest)
+            return text
+        text = self._path(digest).read_text(encoding="utf-8")
+        if len(text) <= self.cache_bytes:
+            self._texts[digest] = text
+            self._texts_size += len(text)
+            while self._texts_size > self.cache_bytes:
+                _, evicted = self._texts.popitem(last=False)
+                self._texts_size -= len(evicted)
+        return text
+
+    def _forget_text(self, digest: str):
+        text = self._texts.pop(digest, None)
+        if text is not None:
+            self._texts_size -= len(text)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            count, total = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM chunks").fetchone()
+        return {
+            "chunks": count,
+            "chunk_bytes": total,
+            "chunks_written": self.chunks_written,
+            "chunks_reused": self.chunks_reused,
+            "chunks_collected": self.chunks_collected,
+            "bytes_written": self.bytes_written,
+            "cached_chunk_bytes": self._texts_size,
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class ChunkedPersistenceService(PersistenceService):
+    """
+    以内容寻址的块保存快照的持久化服务。快照文件的位置和接口不变，只是文件中较大的子树换成了块引用；
+    沙盒文件、图标和包的导入导出与 PersistenceService 相同。
+    """
+    def __init__(self, assets_base_dir: str, min_chunk_bytes: int = 1024, list_segment_items: int = 64,
+                 cache_bytes: int = 16 * 1024 * 1024):
+        super().__init__(assets_base_dir)
+        self.chunk_store = ChunkStore(
+            self.assets_base_dir / "chunks", min_chunk_bytes=min_chunk_bytes, list_segment_items=list_segment_items,
+            cache_bytes=cache_bytes
+        )
+        logger.info(f"Content-addressed snapshot storage enabled: {self.chunk_store.root_dir.resolve()}")
+
+    def _snapshot_path(self, sandbox_id: UUID, snapshot_id: UUID) -> Path:
+        return self._get_sandbox_dir(sandbox_id) / "snapshots" / f"{snapshot_id}.json"
+
+    def _decode_snapshot(self, content: str) -> Dict[str, Any]:
+        return self.chunk_store.read_root(content)
+
+    async def save_snapshot(self, sandbox_id: UUID, snapshot_id: UUID, data: Dict[str, Any]) -> None:
+        await asyncio.to_thread(self.chunk_store.write_root, self._snapshot_path(sandbox_id, snapshot_id), data)
+        logger.debug(f"Persisted snapshot '{snapshot_id}' for sandbox '{sandbox_id}' as chunks")
+
+    async def load_snapshot(self, sandbox_id: UUID, snapshot_id: UUID) -> Optional[Dict[str, Any]]:
+        file_path = self._snapshot_path(sandbox_id, snapshot_id)
+        if not file_path.is_file():
+            return None
+        # 展开块引用需要读取更多文件，整个解析放到工作线程中
+        return await asyncio.to_thread(lambda: self._decode_snapshot(file_path.read_text(encoding="utf-8")))
+
+    async def delete_snapshot(self, sandbox_id: UUID, snapshot_id: UUID) -> None:
+        await asyncio.to_thread(self.chunk_store.delete_root, self._snapshot_path(sandbox_id, snapshot_id))
+        logger.debug(f"Deleted snapshot '{snapshot_id}' and released its chunks")
+
+    def _release_all_snapshots(self, sandbox_id: UUID):
+        snapshot_dir = self._get_sandbox_dir(sandbox_id) / "snapshots"
+        if snapshot_dir.is_dir():
+            for file_path in snapshot_dir.glob("*.json"):
+                self.chunk_store.delete_root(file_path)
+
+    async def delete_all_for_sandbox(self, sandbox_id: UUID) -> None:
+        await asyncio.to_thread(self._release_all_snapshots, sandbox_id)
+        await super().delete_all_for_sandbox(sandbox_id)
+
+    async def delete_sandbox(self, sandbox_id: UUID) -> None:
+        await asyncio.to_thread(self._release_all_snapshots, sandbox_id)
+        await super().delete_sandbox(sandbox_id)
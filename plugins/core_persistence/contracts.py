@@ -80,9 +80,34 @@ class PersistenceServiceInterface(ABC):
     async def load_all_snapshots_for_sandbox(self, sandbox_id: UUID) -> List[Dict[str, Any]]:
         raise NotImplementedError
 
+    @abstractmethod
+    async def load_snapshots(self, sandbox_id: UUID, snapshot_ids: List[UUID]) -> List[Dict[str, Any]]:
+        """批量加载指定的快照，跳过不存在的。"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def list_snapshot_ids(self, sandbox_id: UUID) -> List[UUID]:
+        """列出磁盘上保存的快照 ID，只读取目录，不读取快照内容。"""
+        raise NotImplementedError
+
     @abstractmethod
     async def delete_all_for_sandbox(self, sandbox_id: UUID) -> None:
         raise NotImplementedError
+
+    # --- 快照索引方法 ---
+    @abstractmethod
+    async def load_snapshot_index(self, sandbox_id: UUID) -> Optional[List[Dict[str, Any]]]:
+        """读取沙盒的快照索引日志；索引不存在或已损坏时返回 None。"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def append_snapshot_index(self, sandbox_id: UUID, entries: List[Dict[str, Any]]) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def write_snapshot_index(self, sandbox_id: UUID, entries: List[Dict[str, Any]]) -> None:
+        """用给定的条目整体改写快照索引。"""
+        raise NotImplementedError
     
     # --- 包导入/导出方法 ---
     @abstractmethod
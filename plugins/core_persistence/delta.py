@@ -0,0 +1,81 @@
+# plugins/core_persistence/delta.py
+"""
+快照 moment 的增量编码：相邻快照之间用 JSON-Patch (RFC 6902) 表示差异。
+
+diff_moments 自己生成补丁而不是使用 jsonpatch.make_patch：
+引擎产出的新 moment 与父快照共享未修改的子树（见 CopyOnWriteDict），按对象身份即可跳过它们，
+生成补丁的开销因此取决于改动的大小，而不是 moment 的大小。应用补丁使用 jsonpatch。
+"""
+
+import copy
+from typing import Any, Dict, List
+
+import jsonpatch
+
+from backend.core.utils import CopyOnWriteDict, unwrap_dot_accessible_dicts
+
+
+def _escape(key: str) -> str:
+    return key.replace("~", "~0").replace("/", "~1")
+
+
+def _same(a: Any, b: Any) -> bool:
+    if a is b:
+        return True
+    if type(a) is not type(b):
+        return False
+    try:
+        return bool(a == b)
+    except Exception:
+        # 自定义对象的 __eq__ 可能返回非布尔值或直接抛错，按“已改变”处理
+        return False
+
+
+def _diff(src: Any, dst: Any, path: str, ops: List[Dict[str, Any]]):
+    if src is dst:
+        return
+    # 非字符串键无法用 JSON Pointer 表示（序列化时会被转成字符串），整体替换
+    if type(src) is dict and type(dst) is dict \
+            and all(type(k) is str for k in src) and all(type(k) is str for k in dst):
+        for key in src:
+            if key not in dst:
+                ops.append({"op": "remove", "path": f"{path}/{_escape(key)}"})
+        for key, value in dst.items():
+            child_path = f"{path}/{_escape(key)}"
+            if key in src:
+                _diff(src[key], value, child_path, ops)
+            else:
+                ops.append({"op": "add", "path": child_path, "value": value})
+        return
+    if type(src) is list and type(dst) is list:
+        common = min(len(src), len(dst))
+        for index in range(common):
+            _diff(src[index], dst[index], f"{path}/{index}", ops)
+        # 从尾部开始删除，保证前面的下标不变
+        for index in range(len(src) - 1, common - 1, -1):
+            ops.append({"op": "remove", "path": f"{path}/{index}"})
+        for value in dst[common:]:
+            ops.append({"op": "add", "path": f"{path}/-", "value": value})
+        return
+    if not _same(src, dst):
+        ops.append({"op": "replace", "path": path, "value": dst})
+
+
+def diff_moments(src: Dict[str, Any], dst: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """生成把 src 变为 dst 的 JSON-Patch 操作列表。列表按公共前缀逐项比较，尾部的增删表示为 add/remove。"""
+    ops: List[Dict[str, Any]] = []
+    _diff(src, dst, "", ops)
+    return ops
+
+
+def apply_moment_patches(base: Dict[str, Any], patches: List[List[Dict[str, Any]]]) -> Dict[str, Any]:
+    """
+    在 base 上依次应用多个补丁，返回新的 moment；base 本身不会被修改。
+    补丁应用在 base 的写时复制包装上，结果与 base 共享所有未被补丁触及的子树。
+    补丁中的值会被复制，之后的补丁对结果的原地修改不会影响保存下来的补丁。
+    """
+    document: Any = CopyOnWriteDict(base)
+    for ops in patches:
+        if ops:
+            document = jsonpatch.apply_patch(document, copy.deepcopy(ops), in_place=True)
+    return unwrap_dot_accessible_dicts(document)
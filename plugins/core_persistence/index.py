@@ -0,0 +1,138 @@
+# plugins/core_persistence/index.py
+"""
+每个沙盒的快照索引：快照 ID、父快照、创建时间和增量基准。
+
+索引以追加写入的 JSON Lines 日志保存在快照目录中（snapshots/index.jsonl）：
+保存快照追加一行条目，删除快照追加一行墓碑，同一个 ID 以最后一行为准。
+日志中的失效行过多时整体改写一次。历史查询、存在性检查和查找增量依赖都只需读内存中的索引。
+"""
+
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set
+from uuid import UUID
+
+
+class SnapshotIndexEntry:
+    __slots__ = ("id", "parent_id", "created_at", "base_id")
+
+    def __init__(self, id: UUID, parent_id: Optional[UUID], created_at: datetime, base_id: Optional[UUID]):
+        self.id = id
+        self.parent_id = parent_id
+        self.created_at = created_at
+        self.base_id = base_id
+
+    def to_line(self) -> Dict[str, Any]:
+        return {
+            "id": str(self.id),
+            "parent": str(self.parent_id) if self.parent_id else None,
+            "created_at": self.created_at.isoformat(),
+            "base": str(self.base_id) if self.base_id else None,
+        }
+
+    @classmethod
+    def from_line(cls, line: Dict[str, Any]) -> "SnapshotIndexEntry":
+        return cls(
+            UUID(line["id"]),
+            UUID(line["parent"]) if line.get("parent") else None,
+            datetime.fromisoformat(line["created_at"]),
+            UUID(line["base"]) if line.get("base") else None,
+        )
+
+
+class SnapshotIndex:
+    """
+    一个沙盒的快照索引在内存中的形态。
+    _order 按创建时间排列；快照通常按时间顺序保存，追加时无需重新排序，删除只是让它在下次读取时被过滤。
+    """
+    def __init__(self):
+        self._entries: Dict[UUID, SnapshotIndexEntry] = {}
+        self._dependents: Dict[UUID, Set[UUID]] = {}
+        self._order: List[UUID] = []
+        self._order_dirty = False
+        # 日志中的行数，用于判断何时改写日志
+        self.log_lines = 0
+
+    @classmethod
+    def from_lines(cls, lines: List[Dict[str, Any]]) -> "SnapshotIndex":
+        index = cls()
+        for line in lines:
+            if line.get("deleted"):
+                index._remove(UUID(line["id"]))
+            else:
+                index._put(SnapshotIndexEntry.from_line(line))
+        index.log_lines = len(lines)
+        return index
+
+    def _put(self, entry: SnapshotIndexEntry):
+        previous = self._entries.get(entry.id)
+        if previous is not None:
+            self._unlink_base(previous)
+            if previous.created_at != entry.created_at:
+                self._order_dirty = True
+        else:
+            last = self._entries.get(self._order[-1]) if self._order else None
+            if last is not None and entry.created_at < last.created_at:
+                self._order_dirty = True
+            self._order.append(entry.id)
+        self._entries[entry.id] = entry
+        if entry.base_id is not None:
+            self._dependents.setdefault(entry.base_id, set()).add(entry.id)
+
+    def _remove(self, snapshot_id: UUID):
+        entry = self._entries.pop(snapshot_id, None)
+        if entry is None:
+            return
+        self._unlink_base(entry)
+        self._order_dirty = True
+
+    def _unlink_base(self, entry: SnapshotIndexEntry):
+        if entry.base_id is not None:
+            dependents = self._dependents.get(entry.base_id)
+            if dependents is not None:
+                dependents.discard(entry.id)
+                if not dependents:
+                    del self._dependents[entry.base_id]
+
+    def put(self, entry: SnapshotIndexEntry) -> Dict[str, Any]:
+        """更新索引，返回需要追加到日志的一行。"""
+        self._put(entry)
+        self.log_lines += 1
+        return entry.to_line()
+
+    def remove(self, snapshot_id: UUID) -> Dict[str, Any]:
+        self._remove(snapshot_id)
+        self.log_lines += 1
+        return {"id": str(snapshot_id), "deleted": True}
+
+    def to_lines(self) -> List[Dict[str, Any]]:
+        lines = [self._entries[sid].to_line() for sid in self.ordered()]
+        self.log_lines = len(lines)
+        return lines
+
+    def needs_rewrite(self) -> bool:
+        return self.log_lines > 2 * len(self._entries) + 64
+
+    def ordered(self, limit: Optional[int] = None) -> List[UUID]:
+        """按创建时间排列的快照 ID；给出 limit 时只返回最新的 limit 个。"""
+        if self._order_dirty:
+            self._order = sorted(self._entries, key=lambda sid: self._entries[sid].created_at)
+            self._order_dirty = False
+        if limit is None:
+            return list(self._order)
+        return self._order[-limit:] if limit > 0 else []
+
+    def ids(self) -> Set[UUID]:
+        return set(self._entries)
+
+    def get(self, snapshot_id: UUID) -> Optional[SnapshotIndexEntry]:
+        return self._entries.get(snapshot_id)
+
+    def dependents(self, snapshot_id: UUID) -> List[UUID]:
+        """以 snapshot_id 为增量基准的快照。"""
+        return list(self._dependents.get(snapshot_id, ()))
+
+    def __contains__(self, snapshot_id: UUID) -> bool:
+        return snapshot_id in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,205 @@
+# plugins/core_persistence/retention.py
+"""
+快照保留策略与后台压缩。
+
+压缩只删除历史中间的快照：根快照、每个分支的末端（包括沙盒当前的 head）和分支点始终保留，
+每个分支最近的 keep_last 个快照始终保留；更早且超过 thin_after_seconds 的历史每 thin_every 个回合保留一个。
+被删除快照的子快照改挂到最近的保留祖先上，因此保留下来的历史仍然是一棵完整的树。
+"""
+
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Set
+from uuid import UUID
+
+from pydantic import BaseModel, Field
+
+from backend.core.contracts import BackgroundTaskManager, Container
+from plugins.core_engine.contracts import StateSnapshot
+
+logger = logging.getLogger(__name__)
+
+
+class RetentionPolicy(BaseModel):
+    keep_last: int = Field(default=50, ge=1, description="每个分支始终保留的最近快照数。")
+    thin_after_seconds: float = Field(default=86400, ge=0, description="早于这个时间的快照会被稀疏化。")
+    thin_every: int = Field(default=10, ge=0, description="稀疏化的历史中每隔多少个回合保留一个；0 表示全部删除。")
+
+
+class CompactionPlan(BaseModel):
+    # 按子快照在前的顺序排列，删除时不会有仍然以它为增量基准的快照
+    remove: List[UUID] = Field(default_factory=list)
+    # 需要改挂到新父快照的保留快照（按父快照在前的顺序）
+    reparent: Dict[UUID, Optional[UUID]] = Field(default_factory=dict)
+
+
+def _as_utc(value: datetime) -> datetime:
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def plan_compaction(
+    snapshots: List[StateSnapshot],
+    policy: RetentionPolicy,
+    now: Optional[datetime] = None,
+    pinned: Optional[Set[UUID]] = None,
+) -> CompactionPlan:
+    """根据策略计算一个沙盒的快照中哪些被删除、哪些需要改挂父快照。纯函数，不做任何 I/O。"""
+    now = _as_utc(now or datetime.now(timezone.utc))
+    by_id = {s.id: s for s in snapshots}
+    children: Dict[UUID, List[UUID]] = {sid: [] for sid in by_id}
+    roots = []
+    for snapshot in snapshots:
+        parent_id = snapshot.parent_snapshot_id
+        if parent_id in by_id and parent_id != snapshot.id:
+            children[parent_id].append(snapshot.id)
+        else:
+            roots.append(snapshot.id)
+
+    # 广度优先得到每个快照的回合数（到根的距离）和父快照在前的顺序
+    depth: Dict[UUID, int] = {}
+    order: List[UUID] = []
+    queue = deque((root, 0) for root in sorted(roots, key=lambda sid: by_id[sid].created_at))
+    while queue:
+        sid, d = queue.popleft()
+        if sid in depth:
+            continue
+        depth[sid] = d
+        order.append(sid)
+        queue.extend((child, d + 1) for child in children[sid])
+
+    leaves = [sid for sid in order if not children[sid]]
+    keep: Set[UUID] = set(roots) | set(leaves) | set(pinned or ())
+    keep.update(sid for sid in order if len(children[sid]) > 1)
+    for leaf in leaves:
+        sid, count = leaf, 0
+        while sid is not None and count < policy.keep_last:
+            keep.add(sid)
+            count += 1
+            parent_id = by_id[sid].parent_snapshot_id
+            sid = parent_id if parent_id in by_id and parent_id != sid else None
+
+    threshold = now - timedelta(seconds=policy.thin_after_seconds)
+    for sid in order:
+        if sid in keep:
+            continue
+        if _as_utc(by_id[sid].created_at) >= threshold:
+            keep.add(sid)
+        elif policy.thin_every and depth[sid] % policy.thin_every == 0:
+            keep.add(sid)
+
+    plan = CompactionPlan()
+    survivor_parent: Dict[UUID, Optional[UUID]] = {}
+    for sid in order:
+        parent_id = by_id[sid].parent_snapshot_id
+        # 最近的保留祖先：父快照被保留时就是它自己，否则沿用父快照的结果
+        nearest = None
+        if parent_id in by_id and parent_id != sid:
+            nearest = parent_id if parent_id in keep else survivor_parent[parent_id]
+        survivor_parent[sid] = nearest
+        if sid in keep:
+            if parent_id in by_id and nearest != parent_id:
+                plan.reparent[sid] = nearest
+    plan.remove = [sid for sid in reversed(order) if sid not in keep]
+    return plan
+
+
+class SnapshotCompactor:
+    """
+    按保留策略压缩沙盒的快照历史。每个沙盒的压缩作为一个独立任务提交给 BackgroundTaskManager，
+    只改写受影响的快照：改挂父快照的保留快照重新编码，被删除的快照逐个删除（删除时会回收其存储）。
+    """
+    def __init__(self, container: Container, policy: RetentionPolicy, interval_seconds: float = 0):
+        self._container = container
+        self.policy = policy
+        self.interval_seconds = interval_seconds
+        self._pending: Set[UUID] = set()
+        self._loop_task: Optional[asyncio.Task] = None
+        self.runs = 0
+        self.snapshots_removed = 0
+        self.snapshots_reparented = 0
+
+    async def compact_sandbox(self, sandbox_id: UUID, now: Optional[datetime] = None) -> CompactionPlan:
+        sandbox_store = self._container.resolve("sandbox_store")
+        snapshot_store = self._container.resolve("snapshot_store")
+        sandbox = sandbox_store.get(sandbox_id)
+        if sandbox is None:
+            return CompactionPlan()
+        snapshots = await snapshot_store.find_by_sandbox(sandbox_id)
+        pinned = {sandbox.head_snapshot_id} if sandbox.head_snapshot_id else set()
+        plan = plan_compaction(snapshots, self.policy, now=now, pinned=pinned)
+
+        for snapshot_id, parent_id in plan.reparent.items():
+            await snapshot_store.reparent(sandbox_id, snapshot_id, parent_id)
+            self.snapshots_reparented += 1
+            await asyncio.sleep(0)
+        for snapshot_id in plan.remove:
+            # 压缩期间沙盒可能已经回退到这个快照上
+            current = sandbox_store.get(sandbox_id)
+            if current is None:
+                break
+            if current.head_snapshot_id == snapshot_id:
+                continue
+            await snapshot_store.delete(snapshot_id, sandbox_id=sandbox_id)
+            self.snapshots_removed += 1
+            await asyncio.sleep(0)
+
+        self.runs += 1
+        if plan.remove:
+            logger.info(
+                f"Compacted sandbox {sandbox_id}: removed {len(plan.remove)} snapshots, "
+                f"re-parented {len(plan.reparent)}."
+            )
+        return plan
+
+    async def run_scheduled(self, sandbox_id: UUID):
+        try:
+            await self.compact_sandbox(sandbox_id)
+        finally:
+            self._pending.discard(sandbox_id)
+
+    def schedule(self, sandbox_id: UUID):
+        """把一个沙盒的压缩提交到后台任务队列；同一个沙盒同时只排队一次。"""
+        if sandbox_id in self._pending:
+            return
+        task_manager: BackgroundTaskManager = self._container.resolve("task_manager")
+        self._pending.add(sandbox_id)
+        task_manager.submit_task(run_compaction_task, sandbox_id=sandbox_id)
+
+    def schedule_all(self):
+        sandbox_store = self._container.resolve("sandbox_store")
+        for sandbox in sandbox_store.values():
+            self.schedule(sandbox.id)
+
+    async def _run_periodically(self):
+        while True:
+            await asyncio.sleep(self.interval_seconds)
+            self.schedule_all()
+
+    def start(self):
+        if self.interval_seconds > 0 and self._loop_task is None:
+            self._loop_task = asyncio.create_task(self._run_periodically())
+            logger.info(f"Snapshot compactor started (every {self.interval_seconds}s, policy={self.policy.model_dump()}).")
+
+    async def stop(self):
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            await asyncio.gather(self._loop_task, return_exceptions=True)
+            self._loop_task = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "policy": self.policy.model_dump(),
+            "interval_seconds": self.interval_seconds,
+            "pending": len(self._pending),
+            "runs": self.runs,
+            "snapshots_removed": self.snapshots_removed,
+            "snapshots_reparented": self.snapshots_reparented,
+        }
+
+
+async def run_compaction_task(container: Container, sandbox_id: UUID):
+    """后台任务：压缩一个沙盒的快照历史。"""
+    compactor: SnapshotCompactor = container.resolve("snapshot_compactor")
+    await compactor.run_scheduled(sandbox_id)
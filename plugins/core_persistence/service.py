@@ -92,6 +92,10 @@ class PersistenceService(PersistenceServiceInterface):
         file_path = self._get_sandbox_dir(sandbox_id) / "snapshots" / f"{snapshot_id}.json"
         if not file_path.is_file(): return None
         async with aiofiles.open(file_path, mode='r', encoding='utf-8') as f: content = await f.read()
+        return self._decode_snapshot(content)
+
+    def _decode_snapshot(self, content: str) -> Dict[str, Any]:
+        """把快照文件的内容解析为数据字典。子类可以改变快照文件的格式。"""
         return json.loads(content, object_hook=custom_json_decoder_object_hook)
 
     async def load_all_snapshots_for_sandbox(self, sandbox_id: UUID) -> List[Dict[str, Any]]:
@@ -99,18 +103,72 @@ class PersistenceService(PersistenceServiceInterface):
         if not snapshot_dir.is_dir():
             return []
 
-        def _sync_read_files() -> List[Dict[str, Any]]:
-            snapshots_data = []
+        return await asyncio.to_thread(lambda: self._sync_read_snapshot_files(list(snapshot_dir.glob("*.json"))))
+
+    async def load_snapshots(self, sandbox_id: UUID, snapshot_ids: List[UUID]) -> List[Dict[str, Any]]:
+        snapshot_dir = self._get_sandbox_dir(sandbox_id) / "snapshots"
+        file_paths = [snapshot_dir / f"{snapshot_id}.json" for snapshot_id in snapshot_ids]
+        return await asyncio.to_thread(self._sync_read_snapshot_files, file_paths)
+
+    async def list_snapshot_ids(self, sandbox_id: UUID) -> List[UUID]:
+        snapshot_dir = self._get_sandbox_dir(sandbox_id) / "snapshots"
+        if not snapshot_dir.is_dir():
+            return []
+        def _sync_list_ids():
+            snapshot_ids = []
             for file_path in snapshot_dir.glob("*.json"):
                 try:
-                    content = file_path.read_text(encoding='utf-8')
-                    snapshots_data.append(json.loads(content, object_hook=custom_json_decoder_object_hook))
-                except (json.JSONDecodeError) as e:
-                    logger.error(f"Skipping corrupt snapshot file {file_path}: {e}")
-            return snapshots_data
-            
-        return await asyncio.to_thread(_sync_read_files)
+                    snapshot_ids.append(UUID(file_path.stem))
+                except ValueError:
+                    continue
+            return snapshot_ids
+        return await asyncio.to_thread(_sync_list_ids)
+
+    def _sync_read_snapshot_files(self, file_paths: List[Path]) -> List[Dict[str, Any]]:
+        snapshots_data = []
+        for file_path in file_paths:
+            try:
+                content = file_path.read_text(encoding='utf-8')
+                snapshots_data.append(self._decode_snapshot(content))
+            except FileNotFoundError:
+                continue
+            except (json.JSONDecodeError) as e:
+                logger.error(f"Skipping corrupt snapshot file {file_path}: {e}")
+        return snapshots_data
         
+    def _snapshot_index_path(self, sandbox_id: UUID) -> Path:
+        # 索引与快照文件放在同一目录，删除所有快照时一起被删除
+        return self._get_sandbox_dir(sandbox_id) / "snapshots" / "index.jsonl"
+
+    async def load_snapshot_index(self, sandbox_id: UUID) -> Optional[List[Dict[str, Any]]]:
+        file_path = self._snapshot_index_path(sandbox_id)
+        if not file_path.is_file():
+            return None
+        async with aiofiles.open(file_path, mode='r', encoding='utf-8') as f:
+            content = await f.read()
+        try:
+            return [json.loads(line) for line in content.splitlines() if line.strip()]
+        except json.JSONDecodeError as e:
+            # 例如写入到一半时进程退出；调用方会从快照文件重建索引
+            logger.warning(f"Snapshot index {file_path} is corrupt and will be rebuilt: {e}")
+            return None
+
+    async def append_snapshot_index(self, sandbox_id: UUID, entries: List[Dict[str, Any]]) -> None:
+        file_path = self._snapshot_index_path(sandbox_id)
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        lines = "".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries)
+        async with aiofiles.open(file_path, mode='a', encoding='utf-8') as f:
+            await f.write(lines)
+
+    async def write_snapshot_index(self, sandbox_id: UUID, entries: List[Dict[str, Any]]) -> None:
+        file_path = self._snapshot_index_path(sandbox_id)
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = file_path.with_suffix(".tmp")
+        lines = "".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries)
+        async with aiofiles.open(tmp_path, mode='w', encoding='utf-8') as f:
+            await f.write(lines)
+        await asyncio.to_thread(os.replace, tmp_path, file_path)
+
     async def delete_all_for_sandbox(self, sandbox_id: UUID) -> None:
         """异步删除属于特定沙盒的所有快照文件。"""
         snapshot_dir = self._get_sandbox_dir(sandbox_id) / "snapshots"
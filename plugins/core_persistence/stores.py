@@ -1,14 +1,19 @@
 # plugins/core_persistence/stores.py
 import asyncio
 import logging
-from typing import Dict, List, Optional
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
 from uuid import UUID
 
 # 从 core_engine 导入接口定义
 from plugins.core_engine.contracts import Sandbox, StateSnapshot, SnapshotStoreInterface, SandboxStoreInterface
 from backend.core.serialization import pickle_fallback_encoder
+from .cache import SnapshotCache, estimate_size
 from .contracts import PersistenceServiceInterface
+from .index import SnapshotIndex, SnapshotIndexEntry
+from .delta import apply_moment_patches, diff_moments
 from pydantic import ValidationError
+from pydantic_core import to_jsonable_python
 
 logger = logging.getLogger(__name__)
 
@@ -32,17 +37,27 @@ class PersistentSandboxStore(SandboxStoreInterface):
             self._locks.setdefault(sandbox_id, asyncio.Lock())
         return self._locks[sandbox_id]
         
+    def _resolve_snapshot_store(self) -> Optional[SnapshotStoreInterface]:
+        if not self._snapshot_store and self._container:
+            self._snapshot_store = self._container.resolve("snapshot_store")
+        return self._snapshot_store
+
+    def _pin_head(self, sandbox: Sandbox):
+        # 让快照缓存始终保留每个沙盒的 head
+        snapshot_store = self._resolve_snapshot_store()
+        if isinstance(snapshot_store, PersistentSnapshotStore):
+            snapshot_store.pin_head(sandbox.id, sandbox.head_snapshot_id)
+
     async def initialize(self):
-        logger.info("Pre-loading all sandboxes and their snapshots from disk into cache...")
+        """
+        从磁盘加载所有沙盒。快照不在这里预加载：它们在第一次被访问时按需加载，
+        启动时间和内存占用因此不再随历史总量增长。
+        """
+        logger.info("Loading all sandboxes from disk into cache...")
         count = 0
         
-        # 1. 在初始化开始时，确保我们能访问到 snapshot_store
         if not self._container:
-             logger.error("Container not set on PersistentSandboxStore. Cannot pre-load snapshots.")
-             return
-        
-        # 解析一次并缓存，避免在循环中重复解析
-        snapshot_store: SnapshotStoreInterface = self._container.resolve("snapshot_store")
+             logger.error("Container not set on PersistentSandboxStore. Snapshot heads will not be pinned.")
         
         sandbox_ids = await self._persistence.list_sandbox_ids()
         for sid_str in sandbox_ids:
@@ -52,16 +67,12 @@ class PersistentSandboxStore(SandboxStoreInterface):
                 if data:
                     sandbox = Sandbox.model_validate(data)
                     self._cache[sid] = sandbox
+                    self._pin_head(sandbox)
                     count += 1
-                    
-                    # 2. 对于每一个加载的沙盒，立即让 snapshot_store 去加载它所有的快照
-                    #    find_by_sandbox 会自动将加载的快照放入 snapshot_store 的缓存中
-                    logger.debug(f"Pre-loading snapshots for sandbox {sid}...")
-                    await snapshot_store.find_by_sandbox(sid)
 
             except (ValueError, FileNotFoundError, ValidationError) as e:
                 logger.warning(f"Skipping invalid sandbox directory '{sid_str}': {e}")
-        logger.info(f"Successfully pre-loaded {count} sandboxes and their associated snapshots into cache.")
+        logger.info(f"Successfully loaded {count} sandboxes into cache; snapshots are loaded on demand.")
 
     async def save(self, sandbox: Sandbox):
         lock = self._get_lock(sandbox.id)
@@ -71,6 +82,7 @@ class PersistentSandboxStore(SandboxStoreInterface):
 
             await self._persistence.save_sandbox(sandbox.id, data)
             self._cache[sandbox.id] = sandbox
+            self._pin_head(sandbox)
             
     def get(self, key: UUID) -> Optional[Sandbox]:
         return self._cache.get(key)
@@ -79,10 +91,9 @@ class PersistentSandboxStore(SandboxStoreInterface):
         lock = self._get_lock(key)
         async with lock:
             # 正确地从容器中解析 snapshot_store 并调用其方法
-            if self._container:
-                if not self._snapshot_store:
-                    self._snapshot_store = self._container.resolve("snapshot_store")
-                await self._snapshot_store.delete_all_for_sandbox(key)
+            snapshot_store = self._resolve_snapshot_store()
+            if snapshot_store:
+                await snapshot_store.delete_all_for_sandbox(key)
             else:
                  logger.warning("Container not set on PersistentSandboxStore, cannot delete snapshots automatically.")
 
@@ -101,83 +112,459 @@ class PersistentSandboxStore(SandboxStoreInterface):
         pass
 
 
+class _SnapshotRecord:
+    """
+    一个快照在存储中的形态。
+    - 关键帧：snapshot 是完整的快照，base_id 为 None；
+    - 增量帧：snapshot 只是头信息（moment 为空），moment 由 base_id 指向的快照加上 patch 得到。
+    depth 是到最近关键帧的增量链长度。
+    """
+    __slots__ = ("snapshot", "base_id", "patch", "depth")
+
+    def __init__(self, snapshot: StateSnapshot, base_id: Optional[UUID] = None,
+                 patch: Optional[List[Dict[str, Any]]] = None, depth: int = 0):
+        self.snapshot = snapshot
+        self.base_id = base_id
+        self.patch = patch
+        self.depth = depth
+
+
 class PersistentSnapshotStore(SnapshotStoreInterface):
     """
     管理快照的持久化和缓存。
-    - 快照按需从磁盘加载。
+    - 快照按需从磁盘加载：load(sandbox_id, snapshot_id) 在缓存未命中时读取快照文件（以及还原它所需的增量链）。
+    - 缓存按 (sandbox_id, snapshot_id) 索引，总大小受 cache_budget_bytes 约束，按 LRU 淘汰；每个沙盒的 head 被钉住。
     - 所有对持久化层的调用现在都是非阻塞的。
+    - 快照以增量形式保存：每个快照只记录相对父快照的 JSON-Patch，每隔 keyframe_interval 个快照保存一个完整的关键帧，
+      使长会话的历史不再以 O(n²) 的体量写入磁盘。keyframe_interval 为 1 时每个快照都是关键帧（旧格式）。
+    - 磁盘上没有增量信息的快照文件（旧格式）按关键帧读取。
+    - get/load/find_by_sandbox 返回完整快照；还原出的快照放在一个有容量上限的 LRU 中，它们与基准快照共享未修改的子树。
+    - 每个沙盒有一份持久化的快照索引（ID、父快照、创建时间、增量基准），保存和删除时增量更新。
+      历史查询、存在性检查和查找增量依赖都通过索引完成，不再扫描磁盘或整个缓存。
     """
-    def __init__(self, persistence_service: PersistenceServiceInterface):
+    def __init__(self, persistence_service: PersistenceServiceInterface,
+                 keyframe_interval: int = 16, materialized_cache_size: int = 128,
+                 cache_budget_bytes: int = 256 * 1024 * 1024):
         self._persistence = persistence_service
-        self._cache: Dict[UUID, StateSnapshot] = {}
+        self._cache = SnapshotCache(cache_budget_bytes)
         # 为每个快照ID创建一个独立的锁，以实现原子性保存
         self._locks: Dict[UUID, asyncio.Lock] = {}
-        logger.info("PersistentSnapshotStore initialized.")
+        self.keyframe_interval = max(keyframe_interval, 1)
+        self.materialized_cache_size = max(materialized_cache_size, 0)
+        self._materialized: "OrderedDict[UUID, StateSnapshot]" = OrderedDict()
+        self.materialize_hits = 0
+        self.materialize_misses = 0
+        self.disk_loads = 0
+        self._indexes: Dict[UUID, SnapshotIndex] = {}
+        self._index_locks: Dict[UUID, asyncio.Lock] = {}
+        self.index_rebuilds = 0
+        logger.info(
+            f"PersistentSnapshotStore initialized (keyframe every {self.keyframe_interval} snapshots, "
+            f"cache budget {self._cache.budget_bytes // (1024 * 1024)} MB)."
+        )
 
     def _get_lock(self, snapshot_id: UUID) -> asyncio.Lock:
         return self._locks.setdefault(snapshot_id, asyncio.Lock())
 
+    # --- 快照索引 ---
+
+    async def _get_index(self, sandbox_id: UUID) -> SnapshotIndex:
+        index = self._indexes.get(sandbox_id)
+        if index is not None:
+            return index
+        async with self._index_locks.setdefault(sandbox_id, asyncio.Lock()):
+            index = self._indexes.get(sandbox_id)
+            if index is None:
+                index = await self._load_index(sandbox_id)
+                self._indexes[sandbox_id] = index
+        return index
+
+    async def _load_index(self, sandbox_id: UUID) -> SnapshotIndex:
+        """
+        读取索引日志并与快照目录的文件列表核对。快照文件和索引日志是分两步写入的，
+        进程在两步之间退出会让它们不一致（例如写入了快照但没有记入索引），此时以快照文件为准重建索引。
+        """
+        lines = await self._persistence.load_snapshot_index(sandbox_id)
+        if lines is not None:
+            index = SnapshotIndex.from_lines(lines)
+            on_disk = set(await self._persistence.list_snapshot_ids(sandbox_id))
+            if on_disk == index.ids():
+                return index
+            logger.warning(
+                f"Snapshot index for sandbox {sandbox_id} is out of sync with its snapshot files "
+                f"({len(on_disk - index.ids())} unindexed, {len(index.ids() - on_disk)} missing); rebuilding."
+            )
+        return await self._rebuild_index(sandbox_id)
+
+    async def _rebuild_index(self, sandbox_id: UUID) -> SnapshotIndex:
+        """从快照文件重建索引：用于索引出现之前保存的沙盒，或索引文件损坏时。"""
+        index = SnapshotIndex()
+        for data in await self._persistence.load_all_snapshots_for_sandbox(sandbox_id):
+            try:
+                record = self._from_data(data)
+            except (ValidationError, KeyError, ValueError):
+                continue
+            index.put(self._index_entry(record))
+        if len(index) or await self._persistence.load_snapshot_index(sandbox_id) is not None:
+            await self._persistence.write_snapshot_index(sandbox_id, index.to_lines())
+            self.index_rebuilds += 1
+            logger.info(f"Rebuilt snapshot index for sandbox {sandbox_id} ({len(index)} snapshots).")
+        return index
+
+    @staticmethod
+    def _index_entry(record: _SnapshotRecord) -> SnapshotIndexEntry:
+        snapshot = record.snapshot
+        return SnapshotIndexEntry(snapshot.id, snapshot.parent_snapshot_id, snapshot.created_at, record.base_id)
+
+    async def _index_put(self, record: _SnapshotRecord):
+        sandbox_id = record.snapshot.sandbox_id
+        index = await self._get_index(sandbox_id)
+        line = index.put(self._index_entry(record))
+        await self._persistence.append_snapshot_index(sandbox_id, [line])
+        await self._maybe_rewrite_index(sandbox_id, index)
+
+    async def _index_remove(self, sandbox_id: UUID, snapshot_id: UUID):
+        index = await self._get_index(sandbox_id)
+        line = index.remove(snapshot_id)
+        await self._persistence.append_snapshot_index(sandbox_id, [line])
+        await self._maybe_rewrite_index(sandbox_id, index)
+
+    async def _maybe_rewrite_index(self, sandbox_id: UUID, index: SnapshotIndex):
+        # 覆盖和删除会在日志中留下失效的行，积累过多时整体改写
+        if index.needs_rewrite():
+            await self._persistence.write_snapshot_index(sandbox_id, index.to_lines())
+
+    # --- 缓存与按需加载 ---
+
+    def _record(self, snapshot_id: UUID, loaded: Optional[Dict[UUID, _SnapshotRecord]] = None) -> Optional[_SnapshotRecord]:
+        # loaded 是本次操作刚从磁盘读到的记录，即使它们已经被缓存淘汰也能使用
+        record = self._cache.peek(snapshot_id)
+        if record is None and loaded:
+            record = loaded.get(snapshot_id)
+        return record
+
+    def _cache_record(self, record: _SnapshotRecord, size: int):
+        self._cache.put(record.snapshot.sandbox_id, record.snapshot.id, record, size)
+
+    def _parse_record(self, data: Dict[str, Any]) -> _SnapshotRecord:
+        size = estimate_size(data)
+        record = self._from_data(data)
+        self._cache_record(record, size)
+        return record
+
+    async def _load_record(self, sandbox_id: UUID, snapshot_id: UUID) -> Optional[_SnapshotRecord]:
+        data = await self._persistence.load_snapshot(sandbox_id, snapshot_id)
+        if data is None:
+            return None
+        self.disk_loads += 1
+        try:
+            return self._parse_record(data)
+        except (ValidationError, KeyError, ValueError) as e:
+            logger.warning(f"Skipping snapshot {snapshot_id} with invalid data for sandbox {sandbox_id}: {e}")
+            return None
+
+    async def _ensure_chain(self, sandbox_id: UUID, snapshot_id: UUID) -> Dict[UUID, _SnapshotRecord]:
+        """加载还原一个快照所需的记录：沿增量链直到关键帧或已还原的快照。"""
+        loaded: Dict[UUID, _SnapshotRecord] = {}
+        sid = snapshot_id
+        while sid is not None:
+            record = self._record(sid, loaded) or await self._load_record(sandbox_id, sid)
+            if record is None:
+                break
+            loaded[sid] = record
+            if record.base_id is None or record.base_id in self._materialized:
+                break
+            sid = record.base_id
+        return loaded
+
+    # --- 增量编码与还原 ---
+
+    def _remember(self, snapshot: StateSnapshot):
+        if self.materialized_cache_size == 0:
+            return
+        self._materialized[snapshot.id] = snapshot
+        self._materialized.move_to_end(snapshot.id)
+        while len(self._materialized) > self.materialized_cache_size:
+            self._materialized.popitem(last=False)
+
+    def _materialize(self, snapshot_id: UUID, loaded: Optional[Dict[UUID, _SnapshotRecord]] = None) -> Optional[StateSnapshot]:
+        record = self._record(snapshot_id, loaded)
+        if record is None:
+            return None
+        if record.base_id is None:
+            return record.snapshot
+        cached = self._materialized.get(snapshot_id)
+        if cached is not None:
+            self._materialized.move_to_end(snapshot_id)
+            self.materialize_hits += 1
+            return cached
+        self.materialize_misses += 1
+
+        # 沿增量链回溯到最近的关键帧或已还原的快照，再依次应用补丁
+        chain = [record]
+        while True:
+            base_id = chain[-1].base_id
+            base_snapshot = self._materialized.get(base_id)
+            if base_snapshot is not None:
+                break
+            base_record = self._record(base_id, loaded)
+            if base_record is None:
+                # get() 只查缓存，基准快照可能已被淘汰；load() 会先补全增量链
+                logger.debug(f"Cannot materialize snapshot {snapshot_id}: base snapshot {base_id} is not loaded.")
+                return None
+            if base_record.base_id is None:
+                base_snapshot = base_record.snapshot
+                break
+            chain.append(base_record)
+
+        moment = apply_moment_patches(base_snapshot.moment, [r.patch for r in reversed(chain)])
+        snapshot = record.snapshot.model_copy(update={"moment": moment})
+        self._remember(snapshot)
+        return snapshot
+
+    def _encode(self, snapshot: StateSnapshot, loaded: Optional[Dict[UUID, _SnapshotRecord]] = None) -> _SnapshotRecord:
+        """决定快照以关键帧还是相对父快照的增量保存。"""
+        parent_id = snapshot.parent_snapshot_id
+        parent_record = self._record(parent_id, loaded) if parent_id else None
+        if parent_record is None or parent_id == snapshot.id \
+                or parent_record.snapshot.sandbox_id != snapshot.sandbox_id \
+                or parent_record.depth + 1 >= self.keyframe_interval:
+            return _SnapshotRecord(snapshot)
+        parent = self._materialize(parent_id, loaded)
+        if parent is None:
+            return _SnapshotRecord(snapshot)
+        patch = diff_moments(parent.moment, snapshot.moment)
+        header = snapshot.model_copy(update={"moment": {}})
+        return _SnapshotRecord(header, parent_id, patch, parent_record.depth + 1)
+
+    async def _write(self, snapshot: StateSnapshot):
+        """编码并写入一个快照，更新缓存。父快照在缓存中时会按需补全它的增量链。"""
+        parent_id = snapshot.parent_snapshot_id
+        loaded = None
+        if parent_id and parent_id in self._cache and parent_id != snapshot.id:
+            loaded = await self._ensure_chain(snapshot.sandbox_id, parent_id)
+        async with self._get_lock(snapshot.id):
+            record = self._encode(snapshot, loaded)
+            data = self._to_data(record)
+            await self._persistence.save_snapshot(snapshot.sandbox_id, snapshot.id, data)
+            self._cache_record(record, estimate_size(data))
+            await self._index_put(record)
+            self._materialized.pop(snapshot.id, None)
+            if record.base_id is not None:
+                self._remember(snapshot)
+
+    def _to_data(self, record: _SnapshotRecord) -> Dict[str, Any]:
+        # 同样，使用 mode='json' 并提供 fallback 函数
+        if record.base_id is None:
+            return record.snapshot.model_dump(mode='json', fallback=pickle_fallback_encoder)
+        data = record.snapshot.model_dump(mode='json', fallback=pickle_fallback_encoder, exclude={"moment"})
+        data["moment_delta"] = {
+            "base": str(record.base_id),
+            "depth": record.depth,
+            "patch": to_jsonable_python(record.patch, fallback=pickle_fallback_encoder),
+        }
+        return data
+
+    @staticmethod
+    def _from_data(data: Dict[str, Any]) -> _SnapshotRecord:
+        delta = data.pop("moment_delta", None)
+        snapshot = StateSnapshot.model_validate(data)
+        if delta is None:
+            return _SnapshotRecord(snapshot)
+        return _SnapshotRecord(snapshot, UUID(delta["base"]), delta["patch"], delta.get("depth", 1))
+
+    async def _find_dependents(self, sandbox_id: UUID, snapshot_id: UUID) -> Dict[UUID, _SnapshotRecord]:
+        """通过索引找出以 snapshot_id 为增量基准的快照，并取得它们的记录。"""
+        index = await self._get_index(sandbox_id)
+        dependent_ids = index.dependents(snapshot_id)
+        dependents = {sid: r for sid in dependent_ids if (r := self._cache.peek(sid)) is not None}
+        missing = [sid for sid in dependent_ids if sid not in dependents]
+        if missing:
+            for data in await self._persistence.load_snapshots(sandbox_id, missing):
+                try:
+                    record = self._parse_record(data)
+                except (ValidationError, KeyError, ValueError):
+                    continue
+                dependents[record.snapshot.id] = record
+        return dependents
+
+    async def _rebase_dependents(self, sandbox_id: UUID, snapshot_id: UUID):
+        """
+        在快照被覆盖或删除之前，把以它为增量基准的快照改写为关键帧，
+        使它们不再依赖即将改变的内容。
+        """
+        dependents = await self._find_dependents(sandbox_id, snapshot_id)
+        if not dependents:
+            return
+        loaded = await self._ensure_chain(sandbox_id, snapshot_id)
+        for dependent_id, dependent in dependents.items():
+            full = self._materialize(dependent_id, {**loaded, dependent_id: dependent})
+            if full is None:
+                continue
+            async with self._get_lock(dependent_id):
+                record = _SnapshotRecord(full)
+                data = self._to_data(record)
+                await self._persistence.save_snapshot(full.sandbox_id, full.id, data)
+                self._cache_record(record, estimate_size(data))
+                await self._index_put(record)
+            logger.debug(f"Rewrote snapshot {dependent_id} as a keyframe before its base {snapshot_id} changed.")
+
+    # --- SnapshotStoreInterface ---
+
     async def save(self, snapshot: StateSnapshot) -> None:
         """异步保存快照到磁盘并更新缓存。"""
-        lock = self._get_lock(snapshot.id)
-        async with lock:
-            # 同样，使用 mode='json' 并提供 fallback 函数
-            data = snapshot.model_dump(mode='json', fallback=pickle_fallback_encoder)
-          
-            await self._persistence.save_snapshot(snapshot.sandbox_id, snapshot.id, data)
-            self._cache[snapshot.id] = snapshot
+        index = await self._get_index(snapshot.sandbox_id)
+        if snapshot.id in index:
+            # 覆盖已有快照（例如编辑器的 overwrite 模式）会改变以它为基准的增量
+            await self._rebase_dependents(snapshot.sandbox_id, snapshot.id)
+        await self._write(snapshot)
+
+    async def reparent(self, sandbox_id: UUID, snapshot_id: UUID, parent_id: Optional[UUID]) -> None:
+        """
+        把快照改挂到另一个父快照上（历史压缩时使用）。快照的 moment 不变，
+        以它为基准的增量仍然有效，因此只需要相对新的父快照重新编码它自己。
+        """
+        full = await self.load(sandbox_id, snapshot_id)
+        if full is None:
+            return
+        await self._write(full.model_copy(update={"parent_snapshot_id": parent_id}))
 
     def get(self, snapshot_id: UUID) -> Optional[StateSnapshot]:
         """
-        从缓存中同步获取快照。
-        注意：此方法不会从磁盘加载。它依赖于 find_by_sandbox 或 save 来填充缓存。
-        这是一个设计权衡，以避免在get()中需要sandbox_id。
+        从缓存中同步获取完整的快照；增量快照在这里还原。
+        注意：此方法不会从磁盘加载，缓存未命中时返回 None。需要按需加载时使用 load。
         """
-        return self._cache.get(snapshot_id)
+        if self._cache.get(snapshot_id) is None:
+            return None
+        return self._materialize(snapshot_id)
 
-    async def find_by_sandbox(self, sandbox_id: UUID) -> List[StateSnapshot]:
-        """异步加载属于特定沙盒的所有快照，并更新缓存。"""
-        # 使用 await 调用异步的 load_all_snapshots_for_sandbox
-        snapshots_data = await self._persistence.load_all_snapshots_for_sandbox(sandbox_id)
-        for data in snapshots_data:
-            try:
-                s = StateSnapshot.model_validate(data)
-                self._cache[s.id] = s
-            except ValidationError as e:
-                logger.warning(f"Skipping snapshot with invalid data for sandbox {sandbox_id}: {e}")
-        
-        # 即使磁盘上没有，也要确保返回缓存中可能存在的（例如，刚创建还未写入的）
-        relevant_snapshots = [s for s in self._cache.values() if s.sandbox_id == sandbox_id]
-        # 去重，以防万一
-        unique_snapshots = {s.id: s for s in relevant_snapshots}.values()
-        return sorted(list(unique_snapshots), key=lambda s: s.created_at)
+    async def load(self, sandbox_id: UUID, snapshot_id: UUID) -> Optional[StateSnapshot]:
+        """异步获取一个快照：缓存未命中时从磁盘加载它和还原它所需的增量链。"""
+        record = self._cache.get(snapshot_id)
+        if record is not None and record.snapshot.sandbox_id != sandbox_id:
+            return None
+        if record is None and not await self.exists(sandbox_id, snapshot_id):
+            return None
+        loaded = await self._ensure_chain(sandbox_id, snapshot_id)
+        snapshot = self._materialize(snapshot_id, loaded)
+        if snapshot is None:
+            if snapshot_id in loaded:
+                logger.error(f"Cannot materialize snapshot {snapshot_id}: its delta chain is incomplete on disk.")
+            elif record is None:
+                # 索引中有这个快照但文件已经不在（例如删除到一半时进程退出），移除失效的条目
+                logger.warning(f"Snapshot {snapshot_id} is indexed but cannot be loaded; removing it from the index.")
+                await self._index_remove(sandbox_id, snapshot_id)
+            return None
+        if snapshot.sandbox_id != sandbox_id:
+            return None
+        if self._cache.head_of(sandbox_id) == snapshot_id:
+            # head 的增量链刚被加载，一起钉住
+            self.pin_head(sandbox_id, snapshot_id)
+        return snapshot
+
+    def pin_head(self, sandbox_id: UUID, snapshot_id: Optional[UUID]) -> None:
+        """钉住沙盒当前的 head 以及缓存中还原它所需的增量链，使 get(head) 始终可用。"""
+        chain = []
+        record = self._cache.peek(snapshot_id) if snapshot_id else None
+        while record is not None and record.base_id is not None:
+            chain.append(record.base_id)
+            record = self._cache.peek(record.base_id)
+        self._cache.pin_head(sandbox_id, snapshot_id, chain)
+
+    async def exists(self, sandbox_id: UUID, snapshot_id: UUID) -> bool:
+        """通过索引判断快照是否属于这个沙盒，不读取快照本身。"""
+        return snapshot_id in await self._get_index(sandbox_id)
+
+    async def find_by_sandbox(self, sandbox_id: UUID, limit: Optional[int] = None) -> List[StateSnapshot]:
+        """
+        按创建时间返回沙盒的快照；给出 limit 时只返回最新的 limit 个。
+        快照 ID 来自索引，只有缓存中没有的快照才会从磁盘批量读取。
+        """
+        index = await self._get_index(sandbox_id)
+        snapshot_ids = index.ordered(limit)
+        loaded: Dict[UUID, _SnapshotRecord] = {}
+        missing = []
+        for sid in snapshot_ids:
+            record = self._cache.get(sid)
+            if record is None:
+                missing.append(sid)
+            else:
+                loaded[sid] = record
+        if missing:
+            self.disk_loads += len(missing)
+            for data in await self._persistence.load_snapshots(sandbox_id, missing):
+                try:
+                    record = self._parse_record(data)
+                    loaded[record.snapshot.id] = record
+                except (ValidationError, KeyError, ValueError) as e:
+                    logger.warning(f"Skipping snapshot with invalid data for sandbox {sandbox_id}: {e}")
+
+        snapshots = []
+        for sid in snapshot_ids:
+            snapshot = self._materialize(sid, loaded)
+            if snapshot is None and sid in loaded:
+                # 只取最新的一段历史时，最早几个快照的增量链可能延伸到这段历史之外
+                snapshot = await self.load(sandbox_id, sid)
+            if snapshot is not None:
+                snapshots.append(snapshot)
+        return snapshots
 
     async def delete_all_for_sandbox(self, sandbox_id: UUID) -> None:
         """实现接口中新加的方法"""
         await self._persistence.delete_all_for_sandbox(sandbox_id)
-        # 从缓存中也移除
-        ids_to_remove = [sid for sid, s in self._cache.items() if s.sandbox_id == sandbox_id]
-        for sid in ids_to_remove:
-            self._cache.pop(sid, None)
+        # 从缓存和索引中也移除（索引文件与快照文件一起被删除）
+        for sid, _ in self._cache.for_sandbox(sandbox_id):
+            self._cache.pop(sid)
+            self._materialized.pop(sid, None)
             self._locks.pop(sid, None)
+        self._cache.unpin_sandbox(sandbox_id)
+        self._indexes.pop(sandbox_id, None)
+        self._index_locks.pop(sandbox_id, None)
 
-    async def delete(self, snapshot_id: UUID) -> None:
-        """异步删除指定的快照，包括其持久化文件和缓存条目。"""
-        snapshot = self.get(snapshot_id)
-        if not snapshot:
+    async def delete(self, snapshot_id: UUID, sandbox_id: Optional[UUID] = None) -> None:
+        """
+        异步删除指定的快照，包括其持久化文件、缓存条目和索引条目。
+        快照不在缓存中时，需要提供 sandbox_id 才能在磁盘上找到它。
+        """
+        record = self._cache.peek(snapshot_id)
+        if record is not None:
+            sandbox_id = record.snapshot.sandbox_id
+        if sandbox_id is None or not await self.exists(sandbox_id, snapshot_id):
             # 如果快照不存在，静默返回，因为目标已经达成
             return
-            
+
+        await self._rebase_dependents(sandbox_id, snapshot_id)
         lock = self._get_lock(snapshot_id)
         async with lock:
-            await self._persistence.delete_snapshot(snapshot.sandbox_id, snapshot.id)
+            # 先写墓碑再删除文件：两步之间退出只会留下一个未索引的文件，下次加载索引时会被发现
+            await self._index_remove(sandbox_id, snapshot_id)
+            await self._persistence.delete_snapshot(sandbox_id, snapshot_id)
             # 从缓存和锁字典中移除
-            self._cache.pop(snapshot_id, None)
+            self._cache.pop(snapshot_id)
+            self._materialized.pop(snapshot_id, None)
             self._locks.pop(snapshot_id, None)
             logger.info(f"Deleted snapshot {snapshot_id} from persistence and cache.")
 
+    def get_stats(self) -> Dict[str, Any]:
+        records = list(self._cache.values())
+        keyframes = sum(1 for r in records if r.base_id is None)
+        return {
+            # 只统计缓存中的快照
+            "snapshots": len(records),
+            "keyframes": keyframes,
+            "deltas": len(records) - keyframes,
+            "keyframe_interval": self.keyframe_interval,
+            "cache": self._cache.get_stats(),
+            "disk_loads": self.disk_loads,
+            "indexed_sandboxes": len(self._indexes),
+            "index_rebuilds": self.index_rebuilds,
+            "materialized_cached": len(self._materialized),
+            "materialized_cache_size": self.materialized_cache_size,
+            "materialize_hits": self.materialize_hits,
+            "materialize_misses": self.materialize_misses,
+        }
 
     def clear(self) -> None:
         """此操作在持久化存储中无意义，记录警告并忽略。"""
         logger.warning("`clear` called on PersistentSnapshotStore, but it does nothing to disk state. Cache is NOT cleared.")
-        pass
\ No newline at end of file
+        pass
@@ -0,0 +1,135 @@
+# plugins/core_persistence/tests/test_chunks.py
+
+import json
+import pytest
+import uuid
+from pathlib import Path
+
+from plugins.core_engine.contracts import StateSnapshot
+from plugins.core_persistence.chunks import CHUNK_REF_KEY, ChunkedPersistenceService
+from plugins.core_persistence.stores import PersistentSnapshotStore
+
+pytestmark = pytest.mark.asyncio
+
+
+def make_moment(turns: int) -> dict:
+    return {
+        "memoria": {"stream": [{"id": i, "content": f"turn {i} happened in the tavern"} for i in range(turns)]},
+        "world": {"desc": "x" * 4000},
+        "player": {"hp": 100 - turns},
+    }
+
+
+@pytest.fixture
+def chunked_service(tmp_path: Path) -> ChunkedPersistenceService:
+    service = ChunkedPersistenceService(str(tmp_path), min_chunk_bytes=256, list_segment_items=8)
+    yield service
+    service.chunk_store.close()
+
+
+def chunk_files(service: ChunkedPersistenceService) -> set:
+    return {p.stem for p in (service.chunk_store.root_dir / "objects").rglob("*.json")}
+
+
+class TestChunkedPersistence:
+    """
+    【单元测试】
+    内容寻址的快照存储：相同的子树只保存一次，快照文件只保存块引用，删除快照时回收不再被引用的块。
+    """
+
+    async def test_round_trip_and_deduplication(self, chunked_service: ChunkedPersistenceService):
+        sandbox_id = uuid.uuid4()
+        first, second = uuid.uuid4(), uuid.uuid4()
+        await chunked_service.save_snapshot(sandbox_id, first, {"id": str(first), "moment": make_moment(20)})
+        chunks_after_first = chunk_files(chunked_service)
+        await chunked_service.save_snapshot(sandbox_id, second, {"id": str(second), "moment": make_moment(21)})
+
+        loaded = await chunked_service.load_snapshot(sandbox_id, second)
+        assert loaded == {"id": str(second), "moment": make_moment(21)}
+        assert len(await chunked_service.load_all_snapshots_for_sandbox(sandbox_id)) == 2
+
+        # 世界设定和 memoria 的前两段没有变化，第二个快照只新增了尾段和包含它们的父块
+        new_chunks = chunk_files(chunked_service) - chunks_after_first
+        assert 0 < len(new_chunks) < len(chunks_after_first)
+        snapshot_file = chunked_service.sandboxes_root_dir / str(sandbox_id) / "snapshots" / f"{second}.json"
+        raw = snapshot_file.read_text(encoding="utf-8")
+        assert CHUNK_REF_KEY in raw and "x" * 4000 not in raw
+
+    async def test_deleting_snapshots_collects_unreferenced_chunks(self, chunked_service: ChunkedPersistenceService):
+        sandbox_id, other_sandbox_id = uuid.uuid4(), uuid.uuid4()
+        first, second, copy_id = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+        await chunked_service.save_snapshot(sandbox_id, first, {"moment": make_moment(20)})
+        await chunked_service.save_snapshot(sandbox_id, second, {"moment": make_moment(30)})
+        await chunked_service.save_snapshot(other_sandbox_id, copy_id, {"moment": make_moment(20)})
+        shared = chunk_files(chunked_service)
+
+        # 另一个沙盒仍然引用 first 的全部内容，删除 first 不会回收任何块
+        await chunked_service.delete_snapshot(sandbox_id, first)
+        assert chunk_files(chunked_service) == shared
+
+        await chunked_service.delete_all_for_sandbox(sandbox_id)
+        remaining = chunk_files(chunked_service)
+        assert remaining and remaining < shared
+        assert await chunked_service.load_snapshot(other_sandbox_id, copy_id) == {"moment": make_moment(20)}
+
+        await chunked_service.delete_sandbox(other_sandbox_id)
+        assert chunk_files(chunked_service) == set()
+        assert chunked_service.chunk_store.get_stats()["chunks"] == 0
+
+    async def test_overwriting_a_snapshot_releases_old_chunks(self, chunked_service: ChunkedPersistenceService):
+        sandbox_id, snapshot_id = uuid.uuid4(), uuid.uuid4()
+        await chunked_service.save_snapshot(sandbox_id, snapshot_id, {"moment": make_moment(20)})
+        await chunked_service.save_snapshot(sandbox_id, snapshot_id, {"moment": {"world": {"desc": "y" * 4000}}})
+        assert await chunked_service.load_snapshot(sandbox_id, snapshot_id) == {"moment": {"world": {"desc": "y" * 4000}}}
+
+        await chunked_service.delete_snapshot(sandbox_id, snapshot_id)
+        assert chunk_files(chunked_service) == set()
+
+    async def test_loaded_chunks_are_not_shared_between_snapshots(self, chunked_service: ChunkedPersistenceService):
+        sandbox_id, first, second = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+        await chunked_service.save_snapshot(sandbox_id, first, {"moment": make_moment(20)})
+        await chunked_service.save_snapshot(sandbox_id, second, {"moment": make_moment(20)})
+
+        loaded_first = await chunked_service.load_snapshot(sandbox_id, first)
+        loaded_first["moment"]["world"]["desc"] = "changed"
+        loaded_first["moment"]["memoria"]["stream"].append({"id": -1})
+
+        # 两个快照引用同一批块，但修改一个快照加载出的对象不会影响另一个
+        assert await chunked_service.load_snapshot(sandbox_id, second) == {"moment": make_moment(20)}
+        assert await chunked_service.load_snapshot(sandbox_id, first) == {"moment": make_moment(20)}
+
+    async def test_chunk_cache_is_bounded_lru(self, tmp_path: Path):
+        service = ChunkedPersistenceService(str(tmp_path), min_chunk_bytes=256, list_segment_items=8, cache_bytes=6000)
+        try:
+            sandbox_id, snapshot_id = uuid.uuid4(), uuid.uuid4()
+            await service.save_snapshot(sandbox_id, snapshot_id, {"moment": make_moment(40)})
+            assert await service.load_snapshot(sandbox_id, snapshot_id) == {"moment": make_moment(40)}
+
+            store = service.chunk_store
+            stats = store.get_stats()
+            assert stats["chunk_bytes"] > 6000
+            assert 0 < stats["cached_chunk_bytes"] <= 6000
+            # 再次读取的块被移到队尾，之后的淘汰先从其他块开始
+            oldest = next(iter(store._texts))
+            store._chunk_text(oldest)
+            assert await service.load_snapshot(sandbox_id, snapshot_id) == {"moment": make_moment(40)}
+            assert oldest in store._texts
+            assert store.get_stats()["cached_chunk_bytes"] <= 6000
+        finally:
+            service.chunk_store.close()
+
+    async def test_works_under_the_delta_snapshot_store(self, chunked_service: ChunkedPersistenceService):
+        store = PersistentSnapshotStore(chunked_service, keyframe_interval=2)
+        sandbox_id = uuid.uuid4()
+        parent = None
+        for turn in range(6):
+            snapshot = StateSnapshot(sandbox_id=sandbox_id, moment=make_moment(turn * 5), parent_snapshot_id=parent)
+            await store.save(snapshot)
+            parent = snapshot.id
+
+        reloaded = PersistentSnapshotStore(chunked_service, keyframe_interval=2)
+        snapshots = await reloaded.find_by_sandbox(sandbox_id)
+        assert [s.moment for s in snapshots] == [make_moment(turn * 5) for turn in range(6)]
+
+        await reloaded.delete_all_for_sandbox(sandbox_id)
+        assert chunk_files(chunked_service) == set()
@@ -0,0 +1,105 @@
+# plugins/core_persistence/tests/test_retention.py
+
+import pytest
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Tuple
+
+from backend.core.contracts import Container
+from plugins.core_engine.contracts import Sandbox, StateSnapshot
+from plugins.core_persistence.retention import RetentionPolicy, SnapshotCompactor, plan_compaction
+
+pytestmark = pytest.mark.asyncio
+
+NOW = datetime(2026, 1, 10, tzinfo=timezone.utc)
+
+
+def make_chain(sandbox_id: uuid.UUID, turns: int, parent: Optional[StateSnapshot] = None,
+               start: datetime = NOW - timedelta(days=5)) -> List[StateSnapshot]:
+    """每回合一个快照，每个快照比上一个晚一分钟。"""
+    chain = []
+    for turn in range(turns):
+        snapshot = StateSnapshot(
+            sandbox_id=sandbox_id,
+            moment={"turn": turn},
+            parent_snapshot_id=parent.id if parent else None,
+            created_at=start + timedelta(minutes=turn),
+        )
+        chain.append(snapshot)
+        parent = snapshot
+    return chain
+
+
+class TestRetentionPlan:
+    """
+    【单元测试】
+    保留策略：保留每个分支最近的快照、稀疏化旧历史，并始终保留根、分支点和末端。
+    """
+
+    async def test_thins_old_history_and_keeps_recent_snapshots(self):
+        chain = make_chain(uuid.uuid4(), 40)
+        plan = plan_compaction(chain, RetentionPolicy(keep_last=5, thin_after_seconds=86400, thin_every=10), now=NOW)
+
+        kept = [s for s in chain if s.id not in set(plan.remove)]
+        assert [s.moment["turn"] for s in kept] == [0, 10, 20, 30, 35, 36, 37, 38, 39]
+        # 被删除的快照按子快照在前的顺序排列
+        removed_turns = [next(s for s in chain if s.id == sid).moment["turn"] for sid in plan.remove]
+        assert removed_turns == sorted(removed_turns, reverse=True)
+        # 每个保留快照的父快照都是上一个保留快照
+        assert plan.reparent == {kept[i].id: kept[i - 1].id for i in (1, 2, 3, 4)}
+
+    async def test_recent_history_is_never_thinned(self):
+        chain = make_chain(uuid.uuid4(), 30, start=NOW - timedelta(minutes=10))
+        plan = plan_compaction(chain, RetentionPolicy(keep_last=1, thin_every=10), now=NOW)
+        assert plan.remove == [] and plan.reparent == {}
+
+    async def test_branch_points_heads_and_pins_are_kept(self):
+        sandbox_id = uuid.uuid4()
+        trunk = make_chain(sandbox_id, 20)
+        branch = make_chain(sandbox_id, 10, parent=trunk[7])
+        pinned = trunk[13]
+        plan = plan_compaction(trunk + branch, RetentionPolicy(keep_last=2, thin_every=0), now=NOW,
+                               pinned={pinned.id})
+
+        removed = set(plan.remove)
+        for protected in (trunk[0], trunk[7], trunk[-1], branch[-1], pinned, trunk[-2], branch[-2]):
+            assert protected.id not in removed
+        assert trunk[5].id in removed and branch[3].id in removed
+        assert plan.reparent[branch[-2].id] == trunk[7].id
+        assert plan.reparent[pinned.id] == trunk[7].id
+        assert plan.reparent[trunk[-2].id] == pinned.id
+
+
+class TestSnapshotCompactor:
+    """
+    【集成测试】
+    压缩器删除快照并改挂保留的快照，增量存储的快照在压缩后仍能被完整还原。
+    """
+
+    async def test_compacts_a_sandbox_incrementally(self, test_engine_setup: Tuple[None, Container, None]):
+        _, container, _ = test_engine_setup
+        sandbox_store = container.resolve("sandbox_store")
+        snapshot_store = container.resolve("snapshot_store")
+        persistence = container.resolve("persistence_service")
+
+        sandbox = Sandbox(name="Compaction", definition={"initial_lore": {}, "initial_moment": {}})
+        chain = make_chain(sandbox.id, 25)
+        for snapshot in chain:
+            await snapshot_store.save(snapshot)
+        sandbox.head_snapshot_id = chain[-1].id
+        await sandbox_store.save(sandbox)
+
+        compactor = SnapshotCompactor(container, RetentionPolicy(keep_last=3, thin_every=10))
+        try:
+            plan = await compactor.compact_sandbox(sandbox.id, now=NOW)
+            assert len(plan.remove) == 19
+
+            history = await snapshot_store.find_by_sandbox(sandbox.id)
+            assert [s.moment["turn"] for s in history] == [0, 10, 20, 22, 23, 24]
+            assert [s.parent_snapshot_id for s in history[1:]] == [s.id for s in history[:-1]]
+            assert compactor.get_stats()["snapshots_removed"] == 19
+
+            snapshot_files = (persistence.sandboxes_root_dir / str(sandbox.id) / "snapshots").glob("*.json")
+            assert len(list(snapshot_files)) == 6
+        finally:
+            await sandbox_store.delete(sandbox.id)
@@ -1,14 +1,17 @@
 # plugins/core_persistence/tests/test_stores.py
 
+import json
 import pytest
 import uuid
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 from typing import Tuple
 
 from backend.core.contracts import Container
 from plugins.core_engine.contracts import Sandbox, StateSnapshot, SnapshotStoreInterface
 from plugins.core_persistence.contracts import PersistenceServiceInterface
-from plugins.core_persistence.stores import PersistentSandboxStore
+from plugins.core_persistence.index import SnapshotIndex, SnapshotIndexEntry
+from plugins.core_persistence.stores import PersistentSandboxStore, PersistentSnapshotStore
 
 pytestmark = pytest.mark.asyncio
 
@@ -110,4 +113,230 @@ class TestPersistentStores:
         
         # 5. Deletion is handled by deleting the parent sandbox
         await persistence_service.delete_sandbox(test_sandbox.id)
-        assert not snapshot_file.exists()
\ No newline at end of file
+        assert not snapshot_file.exists()
+
+class TestDeltaSnapshots:
+    """
+    【集成测试】
+    快照以相对父快照的 JSON-Patch 保存，定期写入关键帧；get/find_by_sandbox 仍返回完整快照。
+    """
+
+    @pytest.fixture
+    def delta_store(self, test_engine_setup: Tuple[None, Container, None]) -> PersistentSnapshotStore:
+        _, container, _ = test_engine_setup
+        return PersistentSnapshotStore(container.resolve("persistence_service"), keyframe_interval=3, materialized_cache_size=2)
+
+    async def _save_chain(self, store: PersistentSnapshotStore, sandbox_id: uuid.UUID, turns: int) -> list:
+        snapshots, parent = [], None
+        moment = {"log": [], "world": {"name": "Hevno", "lore": "x" * 1000}}
+        for turn in range(turns):
+            moment = {**moment, "turn": turn, "log": moment["log"] + [f"turn {turn}"]}
+            snapshot = StateSnapshot(sandbox_id=sandbox_id, moment=moment, parent_snapshot_id=parent)
+            await store.save(snapshot)
+            snapshots.append(snapshot)
+            parent = snapshot.id
+        return snapshots
+
+    async def test_snapshots_are_stored_as_patches_with_keyframes(self, delta_store, test_sandbox: Sandbox):
+        persistence: PersistenceServiceInterface = delta_store._persistence
+        snapshots = await self._save_chain(delta_store, test_sandbox.id, 7)
+        try:
+            files = [
+                json.loads((persistence.sandboxes_root_dir / str(test_sandbox.id) / "snapshots" / f"{s.id}.json").read_text("utf-8"))
+                for s in snapshots
+            ]
+            assert ["moment_delta" in f for f in files] == [False, True, True, False, True, True, False]
+            assert files[1]["moment_delta"]["patch"] == [
+                {"op": "add", "path": "/log/-", "value": "turn 1"},
+                {"op": "replace", "path": "/turn", "value": 1},
+            ]
+            assert delta_store.get_stats()["keyframes"] == 3
+
+            # 清空缓存后从磁盘重新加载，仍得到完整的快照
+            delta_store._cache.clear()
+            delta_store._materialized.clear()
+            found = await delta_store.find_by_sandbox(test_sandbox.id)
+            assert [s.moment for s in found] == [s.moment for s in snapshots]
+            assert delta_store.get(snapshots[5].id).moment["log"][-1] == "turn 5"
+        finally:
+            await persistence.delete_sandbox(test_sandbox.id)
+
+    async def test_deleting_or_overwriting_a_base_rewrites_dependents(self, delta_store, test_sandbox: Sandbox):
+        persistence: PersistenceServiceInterface = delta_store._persistence
+        first, second, third = await self._save_chain(delta_store, test_sandbox.id, 3)
+        try:
+            await delta_store.delete(second.id)
+            assert delta_store.get(third.id).moment == third.moment
+
+            await delta_store.save(first.model_copy(update={"moment": {"edited": True}}))
+            assert delta_store.get(first.id).moment == {"edited": True}
+            assert delta_store.get(third.id).moment == third.moment
+        finally:
+            await persistence.delete_sandbox(test_sandbox.id)
+
+
+class TestLazySnapshotCache:
+    """
+    【集成测试】
+    快照按需加载：缓存受内存预算约束并按 LRU 淘汰，沙盒的 head 被钉住；未缓存的快照由 load 从磁盘读取。
+    """
+
+    @pytest.fixture
+    def small_store(self, test_engine_setup: Tuple[None, Container, None]) -> PersistentSnapshotStore:
+        _, container, _ = test_engine_setup
+        return PersistentSnapshotStore(
+            container.resolve("persistence_service"), keyframe_interval=3, materialized_cache_size=0,
+            cache_budget_bytes=8 * 1024,
+        )
+
+    async def test_load_reads_evicted_snapshots_and_their_delta_chain(self, small_store, test_sandbox: Sandbox):
+        persistence: PersistenceServiceInterface = small_store._persistence
+        snapshots, parent = [], None
+        for turn in range(12):
+            snapshot = StateSnapshot(
+                sandbox_id=test_sandbox.id, moment={"turn": turn, "lore": "x" * 2000}, parent_snapshot_id=parent
+            )
+            await small_store.save(snapshot)
+            small_store.pin_head(test_sandbox.id, snapshot.id)
+            snapshots.append(snapshot)
+            parent = snapshot.id
+        try:
+            stats = small_store.get_stats()["cache"]
+            assert stats["size_bytes"] <= stats["budget_bytes"] and stats["evictions"] > 0
+            # head 被钉住，始终可以同步获取；早期的快照已被淘汰
+            assert small_store.get(snapshots[-1].id).moment["turn"] == 11
+            assert small_store.get(snapshots[4].id) is None
+
+            # 增量快照按需加载时连同它的增量链一起读取（5 -> 4 -> 关键帧 3）
+            small_store._cache.clear()
+            loaded = await small_store.load(test_sandbox.id, snapshots[5].id)
+            assert loaded.moment == snapshots[5].moment
+            assert small_store.disk_loads == 3
+            assert await small_store.load(uuid.uuid4(), snapshots[4].id) is None
+
+            # 删除未缓存的快照时，提供 sandbox_id 即可在磁盘上找到它，依赖它的增量被改写为关键帧
+            small_store._cache.clear()
+            await small_store.delete(snapshots[3].id, sandbox_id=test_sandbox.id)
+            assert await small_store.load(test_sandbox.id, snapshots[3].id) is None
+            assert (await small_store.load(test_sandbox.id, snapshots[5].id)).moment == snapshots[5].moment
+        finally:
+            await persistence.delete_sandbox(test_sandbox.id)
+
+    async def test_startup_does_not_preload_snapshots(self, test_engine_setup: Tuple[None, Container, None]):
+        _, container, _ = test_engine_setup
+        persistence: PersistenceServiceInterface = container.resolve("persistence_service")
+        snapshot_store = PersistentSnapshotStore(persistence)
+        sandbox_store = PersistentSandboxStore(persistence)
+        container_proxy = type("C", (), {"resolve": lambda self, name: snapshot_store})()
+        sandbox_store.set_container(container_proxy)
+
+        sandbox = Sandbox(name="Lazy", definition={"initial_lore": {}, "initial_moment": {}})
+        genesis = StateSnapshot(sandbox_id=sandbox.id, moment={"turn": 0})
+        await snapshot_store.save(genesis)
+        sandbox.head_snapshot_id = genesis.id
+        await sandbox_store.save(sandbox)
+        try:
+            restarted_snapshots = PersistentSnapshotStore(persistence)
+            restarted = PersistentSandboxStore(persistence)
+            restarted.set_container(type("C", (), {"resolve": lambda self, name: restarted_snapshots})())
+            await restarted.initialize()
+
+            assert restarted.get(sandbox.id) is not None
+            assert restarted_snapshots.get_stats()["snapshots"] == 0
+            head = await restarted_snapshots.load(sandbox.id, sandbox.head_snapshot_id)
+            assert head.moment == {"turn": 0}
+            assert restarted_snapshots.get_stats()["cache"]["misses"] == 1
+            assert restarted_snapshots.get(genesis.id) is not None
+        finally:
+            await persistence.delete_sandbox(sandbox.id)
+
+
+class TestSnapshotIndex:
+    """
+    【集成测试】
+    每个沙盒的快照索引：保存和删除时增量更新，历史查询与存在性检查不再扫描快照文件。
+    """
+
+    async def test_index_log_replays_puts_and_tombstones(self):
+        index = SnapshotIndex()
+        first, second, third = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+        now = datetime.now(timezone.utc)
+        lines = [
+            index.put(SnapshotIndexEntry(first, None, now, None)),
+            index.put(SnapshotIndexEntry(second, first, now + timedelta(seconds=1), first)),
+            index.put(SnapshotIndexEntry(third, second, now + timedelta(seconds=2), second)),
+            index.remove(second),
+            index.put(SnapshotIndexEntry(third, first, now + timedelta(seconds=2), first)),
+        ]
+        replayed = SnapshotIndex.from_lines(json.loads(json.dumps(lines)))
+        assert replayed.ordered() == [first, third]
+        assert replayed.ordered(limit=1) == [third]
+        assert replayed.dependents(first) == [third] and replayed.dependents(second) == []
+        assert second not in replayed and replayed.get(third).parent_id == first
+        assert [line["id"] for line in replayed.to_lines()] == [str(first), str(third)]
+
+    async def test_history_and_existence_checks_use_the_index(self, test_engine_setup: Tuple[None, Container, None],
+                                                             test_sandbox: Sandbox):
+        _, container, _ = test_engine_setup
+        persistence: PersistenceServiceInterface = container.resolve("persistence_service")
+        store = PersistentSnapshotStore(persistence, keyframe_interval=3)
+        snapshots, parent = [], None
+        for turn in range(8):
+            snapshot = StateSnapshot(sandbox_id=test_sandbox.id, moment={"turn": turn}, parent_snapshot_id=parent)
+            await store.save(snapshot)
+            snapshots.append(snapshot)
+            parent = snapshot.id
+        snapshot_dir = persistence.sandboxes_root_dir / str(test_sandbox.id) / "snapshots"
+        try:
+            # 删除增量基准：依赖它的快照被改写为关键帧，索引日志追加一行更新和一行墓碑
+            await store.delete(snapshots[1].id)
+            assert len((snapshot_dir / "index.jsonl").read_text("utf-8").splitlines()) == 8 + 1 + 1
+
+            # 重启后：存在性检查只读索引，历史只加载请求的快照
+            restarted = PersistentSnapshotStore(persistence, keyframe_interval=3)
+            assert await restarted.exists(test_sandbox.id, snapshots[5].id)
+            assert not await restarted.exists(test_sandbox.id, snapshots[1].id)
+            assert not await restarted.exists(uuid.uuid4(), snapshots[5].id)
+            assert restarted.disk_loads == 0
+
+            latest = await restarted.find_by_sandbox(test_sandbox.id, limit=2)
+            assert [s.moment["turn"] for s in latest] == [6, 7]
+            history = await restarted.find_by_sandbox(test_sandbox.id)
+            assert [s.moment["turn"] for s in history] == [0, 2, 3, 4, 5, 6, 7]
+
+            # 没有索引的旧沙盒在第一次访问时从快照文件重建索引
+            (snapshot_dir / "index.jsonl").unlink()
+            legacy = PersistentSnapshotStore(persistence, keyframe_interval=3)
+            assert [s.id for s in await legacy.find_by_sandbox(test_sandbox.id)] == [s.id for s in history]
+            assert legacy.index_rebuilds == 1 and (snapshot_dir / "index.jsonl").is_file()
+        finally:
+            await persistence.delete_sandbox(test_sandbox.id)
+
+    async def test_index_is_reconciled_with_snapshot_files(self, test_engine_setup: Tuple[None, Container, None],
+                                                           test_sandbox: Sandbox):
+        _, container, _ = test_engine_setup
+        persistence: PersistenceServiceInterface = container.resolve("persistence_service")
+        store = PersistentSnapshotStore(persistence, keyframe_interval=1)
+        snapshots = [StateSnapshot(sandbox_id=test_sandbox.id, moment={"turn": turn}) for turn in range(3)]
+        for snapshot in snapshots:
+            await store.save(snapshot)
+        snapshot_dir = persistence.sandboxes_root_dir / str(test_sandbox.id) / "snapshots"
+        index_path = snapshot_dir / "index.jsonl"
+        try:
+            # 模拟崩溃：快照文件已写入但索引没有记录它，另一个快照的文件已删除但索引仍有它
+            lines = index_path.read_text("utf-8").splitlines()
+            index_path.write_text("\n".join(lines[:2]) + "\n", "utf-8")
+            (snapshot_dir / f"{snapshots[0].id}.json").unlink()
+
+            restarted = PersistentSnapshotStore(persistence, keyframe_interval=1)
+            assert [s.id for s in await restarted.find_by_sandbox(test_sandbox.id)] == [s.id for s in snapshots[1:]]
+            assert restarted.index_rebuilds == 1
+            assert not await restarted.exists(test_sandbox.id, snapshots[0].id)
+
+            # 已加载的索引中仍有条目、文件却已不在时，load 会移除失效的条目
+            (snapshot_dir / f"{snapshots[1].id}.json").unlink()
+            restarted._cache.pop(snapshots[1].id)
+            assert await restarted.load(test_sandbox.id, snapshots[1].id) is None
+            assert not await restarted.exists(test_sandbox.id, snapshots[1].id)
+        finally:
+            await persistence.delete_sandbox(test_sandbox.id)